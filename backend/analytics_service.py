@@ -0,0 +1,256 @@
+import math
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+# Aggregates over the latest version of every ROI in the selected folder.
+# The per-ROI measurements are read from roi_measurements.xlsx once, kept in
+# memory and updated as ROIs are saved or deleted; results are cached until the
+# next change. The workbook's mtime is checked on every request so edits made
+# outside the app trigger a re-read.
+
+DEFAULT_BINS = 30
+CDF_POINTS = 101  # quantiles 0.00, 0.01, ..., 1.00
+
+_states: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+
+def _workbook_mtime(folder_path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(os.path.join(folder_path, "roi_measurements.xlsx"))
+    except OSError:
+        return None
+
+
+def _get_state(folder_path: str) -> Dict:
+    import file_service
+    import metrics_service
+
+    key = os.path.abspath(folder_path)
+    mtime = _workbook_mtime(folder_path)
+    with _lock:
+        state = _states.get(key)
+        if state is not None and state["mtime"] == mtime:
+            metrics_service.record_cache("analytics_rois", True)
+            return state
+
+    metrics_service.record_cache("analytics_rois", False)
+    measurements = file_service.load_latest_roi_measurements(folder_path)
+    state = {
+        "mtime": mtime,
+        "rois": measurements,
+        "image_sizes": state["image_sizes"] if state is not None else {},
+        "results": {},
+    }
+    with _lock:
+        _states[key] = state
+    return state
+
+
+def record_roi(folder_path: str, image_name: str, selection_number: int, area_um2: float, area_px2: float,
+               scale_px_per_um: float, page: int = 0):
+    """
+    Applies a saved ROI to the in-memory table instead of re-reading the workbook.
+    """
+    with _lock:
+        state = _states.get(os.path.abspath(folder_path))
+        if state is None:
+            return
+        state["rois"][(image_name, selection_number, page)] = {
+            "area_um2": area_um2,
+            "area_px2": area_px2,
+            "scale_px_per_um": scale_px_per_um,
+        }
+        state["results"] = {}
+        state["mtime"] = _workbook_mtime(folder_path)
+
+
+def drop_image(folder_path: str, image_name: str):
+    """
+    Removes an image's ROIs after its analysis was deleted.
+    """
+    with _lock:
+        state = _states.get(os.path.abspath(folder_path))
+        if state is None:
+            return
+        for roi_key in [k for k in state["rois"] if k[0] == image_name]:
+            del state["rois"][roi_key]
+        state["results"] = {}
+        state["mtime"] = _workbook_mtime(folder_path)
+
+
+def mark_current(folder_path: str):
+    """
+    Records that the workbook was rewritten without changing any measurement (e.g. notes edits).
+    """
+    with _lock:
+        state = _states.get(os.path.abspath(folder_path))
+        if state is not None:
+            state["mtime"] = _workbook_mtime(folder_path)
+
+
+def _stats(values) -> Dict:
+    import numpy as np
+
+    if not len(values):
+        return {"sum": 0.0, "mean": None, "median": None, "p10": None, "p90": None, "min": None, "max": None}
+    p10, median, p90 = np.percentile(values, [10, 50, 90])
+    return {
+        "sum": float(values.sum()),
+        "mean": float(values.mean()),
+        "median": float(median),
+        "p10": float(p10),
+        "p90": float(p90),
+        "min": float(values.min()),
+        "max": float(values.max()),
+    }
+
+
+def _histogram(values, bins: int, log: bool) -> Dict:
+    import numpy as np
+
+    if log:
+        values = values[values > 0]
+    if not len(values):
+        return {"edges": [], "counts": []}
+    lo, hi = float(values.min()), float(values.max())
+    if hi == lo:
+        hi = lo + 1.0
+    edges = np.geomspace(lo, hi, bins + 1) if log else np.linspace(lo, hi, bins + 1)
+    counts, _ = np.histogram(values, bins=edges)
+    return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def _cdf(values) -> Dict:
+    import numpy as np
+
+    quantiles = np.linspace(0, 1, CDF_POINTS)
+    if not len(values):
+        return {"quantiles": quantiles.tolist(), "values": []}
+    return {"quantiles": quantiles.tolist(), "values": np.quantile(values, quantiles).tolist()}
+
+
+def _image_area_px(folder_path: str, state: Dict, image_name: str) -> Optional[int]:
+    import file_service
+
+    sizes = state["image_sizes"]
+    if image_name not in sizes:
+        try:
+            width, height = file_service._image_size(os.path.join(folder_path, image_name))
+            sizes[image_name] = width * height
+        except Exception:
+            sizes[image_name] = None
+    return sizes[image_name]
+
+
+def _per_image(folder_path: str, state: Dict, images, pages, areas_um2, areas_px2, diameters):
+    """
+    Per-image count, totals, mean/median area and porosity (ROI area over the area
+    of the analysed pages), computed with one sort and bincounts rather than a loop over ROIs.
+    """
+    import numpy as np
+
+    names, codes = np.unique(images, return_inverse=True)
+    counts = np.bincount(codes, minlength=len(names))
+    total_um2 = np.bincount(codes, weights=areas_um2, minlength=len(names))
+    total_px2 = np.bincount(codes, weights=areas_px2, minlength=len(names))
+    total_diameter = np.bincount(codes, weights=diameters, minlength=len(names))
+
+    # Medians: sort by (image, area) and pick the middle element(s) of each run
+    order = np.lexsort((areas_um2, codes))
+    sorted_areas = areas_um2[order]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    lower = sorted_areas[starts + (counts - 1) // 2]
+    upper = sorted_areas[starts + counts // 2]
+    medians = (lower + upper) / 2
+
+    # Number of distinct analysed pages per image (stacks)
+    page_pairs = np.unique(np.stack([codes, pages]), axis=1)
+    page_counts = np.bincount(page_pairs[0], minlength=len(names))
+
+    summaries = []
+    for i, name in enumerate(names.tolist()):
+        image_area = _image_area_px(folder_path, state, name)
+        summaries.append({
+            "image_name": name,
+            "count": int(counts[i]),
+            "total_area_um2": float(total_um2[i]),
+            "total_area_px2": float(total_px2[i]),
+            "mean_area_um2": float(total_um2[i] / counts[i]),
+            "median_area_um2": float(medians[i]),
+            "mean_diameter_um": float(total_diameter[i] / counts[i]),
+            "pages": int(page_counts[i]),
+            "porosity": float(total_px2[i] / (image_area * page_counts[i])) if image_area else None,
+        })
+    return summaries
+
+
+def _measurement(value) -> Optional[float]:
+    """
+    A measurement cell as a float (empty cells count as 0), or None when it holds
+    text or a non-finite number.
+    """
+    if value is None or value == "":
+        return 0.0
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def compute_analytics(folder_path: str, bins: int = DEFAULT_BINS, log_bins: bool = False) -> Dict:
+    """
+    Counts, area and equivalent-diameter statistics, histograms and CDFs over the
+    latest ROI versions of all images, plus per-image summaries.
+    Equivalent diameter is that of the circle with the same area: 2 * sqrt(A / pi).
+    ROIs whose area cells are not numbers are left out and counted in "skipped".
+    """
+    import numpy as np
+    import metrics_service
+
+    state = _get_state(folder_path)
+    cache_key: Tuple = (bins, log_bins)
+    with _lock:
+        cached = state["results"].get(cache_key)
+    if cached is not None:
+        metrics_service.record_cache("analytics_result", True)
+        return cached
+    metrics_service.record_cache("analytics_result", False)
+
+    with metrics_service.stage("analytics", rois=len(state["rois"])):
+        with _lock:
+            rois = list(state["rois"].items())
+        items = []
+        for key, m in rois:
+            area_um2, area_px2 = _measurement(m["area_um2"]), _measurement(m["area_px2"])
+            if area_um2 is not None and area_px2 is not None:
+                items.append((key, area_um2, area_px2))
+        images = np.array([key[0] for key, _, _ in items], dtype=object)
+        pages = np.array([key[2] for key, _, _ in items], dtype=np.int64)
+        areas_um2 = np.array([area for _, area, _ in items], dtype=np.float64)
+        areas_px2 = np.array([area for _, _, area in items], dtype=np.float64)
+        diameters = 2 * np.sqrt(np.clip(areas_um2, 0, None) / np.pi)
+
+        result = {
+            "images": int(len(set(images.tolist()))),
+            "count": int(len(items)),
+            "skipped": len(rois) - len(items),
+            "area_um2": _stats(areas_um2),
+            "diameter_um": _stats(diameters),
+            "histograms": {
+                "area_um2": _histogram(areas_um2, bins, log_bins),
+                "diameter_um": _histogram(diameters, bins, log_bins),
+            },
+            "cdf": {
+                "area_um2": _cdf(areas_um2),
+                "diameter_um": _cdf(diameters),
+            },
+            "per_image": _per_image(folder_path, state, images.astype(str), pages, areas_um2, areas_px2, diameters) if items else [],
+        }
+
+    with _lock:
+        state["results"][cache_key] = result
+    return result
+
@@ -1,14 +1,27 @@
 import os
 import io
-import tifffile
-from PIL import Image
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Dict
-from starlette.responses import StreamingResponse
-from cv_service import detect_scale_bar
+from typing import List, Dict, Optional
+from starlette.responses import StreamingResponse, PlainTextResponse, FileResponse, JSONResponse, Response
+from cv_service import SCALE_BAR_ENGINES, detect_scale_bars
+import analytics_service
+import export_service
 import file_service
+import geometry_service
+import history_service
+import intensity_service
+import jobs_service
+import memory_service
+import metrics_service
+import prefetch_service
+import profile_service
+import response_service
+import spatial_service
+import static_service
+import thumbnail_service
+import tiff_service
 
 class RoiData(BaseModel):
     selection_number: int
@@ -22,15 +35,39 @@ class RoiData(BaseModel):
     notes: str = ""
     is_modification: bool = False
     is_notes_only: bool = False  # Flag to distinguish notes-only updates from geometry changes
+    overlay_mode: Optional[str] = None  # "crop" (default), "svg" or "full"; see file_service.OVERLAY_MODES
+    page: int = 0  # page of a multi-page TIFF the ROI was drawn on
+    allow_duplicate: bool = False  # save even if another ROI covers (nearly) the same area
+    simplify_tolerance: Optional[float] = None  # px; overrides the folder's ingest setting, 0 keeps every vertex
 
 class FolderRequest(BaseModel):
     folder_path: str
 
+class OverlapQuery(BaseModel):
+    points: List[Dict[str, float]]
+    exclude: Optional[int] = None  # selection number to ignore (the ROI being modified)
+    page: int = 0
+
+class CompactionRequest(BaseModel):
+    keep_last: Optional[int] = None  # keep the newest N history entries per ROI
+    max_age_days: Optional[float] = None  # drop history entries older than this
+    save_policy: bool = False  # persist these limits as the folder's default policy
+
+class JobRequest(BaseModel):
+    kind: str  # see jobs_service.JOB_KINDS
+    params: Dict = {}
+    priority: int = 0  # higher runs first
+    max_attempts: int = jobs_service.DEFAULT_MAX_ATTEMPTS
+
+metrics_service.configure_logging()
+
 app = FastAPI()
 
 # In-memory state for the selected folder
 app_state = {
     "selected_folder": None,
+    "startup": None,  # start-up profile, filled in by serve.py once the server is listening
+    "frontend_dist": static_service.find_frontend_dist(),  # built UI served from the same origin
 }
 
 # Configure CORS
@@ -42,6 +79,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency, body sizes and in-flight depth (exposed on /metrics)
+app.add_middleware(metrics_service.MetricsMiddleware)
+
+# Opt-in sampling profiles of single requests (PORES_PROFILING=1, then X-Profile: 1 or ?profile=1)
+app.add_middleware(profile_service.ProfilingMiddleware)
+
+
+@app.exception_handler(memory_service.AdmissionTimeout)
+def memory_busy(request: Request, exc: memory_service.AdmissionTimeout):
+    """
+    A decode that could not get its memory reservation in time is a 503, not a failure.
+    """
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+
 @app.post("/api/select-folder")
 def select_folder(request: FolderRequest):
     """
@@ -59,38 +111,93 @@ def select_folder(request: FolderRequest):
     app_state["selected_folder"] = folder_path
     return {"selected_folder": folder_path}
 
+def _list_tiff_files(folder: str) -> List[str]:
+    return sorted([f for f in os.listdir(folder) if f.lower().endswith(('.tif', '.tiff'))])
+
+
+def _build_image_list(folder: str) -> List[Dict]:
+    tiff_files = _list_tiff_files(folder)
+
+    analyzed_images = file_service.get_analyzed_images(folder)
+
+    response_data = []
+    for filename in tiff_files:
+        response_data.append({
+            "filename": filename,
+            "has_data": filename in analyzed_images
+        })
+
+    return response_data
+
+
 @app.get("/api/images")
-def get_image_list():
+def get_image_list(request: Request):
     """
     Returns a list of TIFF images in the selected folder.
     Also checks if analysis has been performed on them by reading the Excel file.
+    Answers 304 when the client's If-None-Match is still current.
     """
     folder = app_state.get("selected_folder")
     if not folder or not os.path.isdir(folder):
         raise HTTPException(status_code=404, detail="Folder not selected or not found.")
 
     try:
-        files = os.listdir(folder)
-        tiff_files = sorted([f for f in files if f.lower().endswith(('.tif', '.tiff'))])
+        return response_service.conditional_response(
+            request, prefetch_service.listing_version(folder), lambda: _build_image_list(folder))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read directory: {e}")
 
-        analyzed_images = file_service.get_analyzed_images(folder)
 
-        response_data = []
-        for filename in tiff_files:
-            response_data.append({
-                "filename": filename,
-                "has_data": filename in analyzed_images
-            })
+@app.get("/api/thumbnails")
+def get_thumbnails(names: Optional[List[str]] = Query(None), size: int = 200, mode: str = "ndjson",
+                   image_format: str = Query("webp", alias="format")):
+    """
+    Thumbnails of many images in one response (all images of the folder when no
+    names are given), rendered in parallel. mode=ndjson streams one JSON line per
+    image as it finishes ({"name", "mime", "width", "height", "data": base64} or
+    {"name", "error"}); mode=sprite returns one sheet of size x size cells with the
+    offset of each image (at most thumbnail_service.MAX_SPRITE_CELLS, fewer for large sizes).
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
 
-        return response_data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to read directory: {e}")
+    if mode not in ("ndjson", "sprite"):
+        raise HTTPException(status_code=400, detail="mode must be 'ndjson' or 'sprite'.")
+    if image_format not in thumbnail_service.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(thumbnail_service.FORMATS)}.")
+    if not thumbnail_service.MIN_SIZE <= size <= thumbnail_service.MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"size must be between {thumbnail_service.MIN_SIZE} and {thumbnail_service.MAX_SIZE}.")
+
+    available = _list_tiff_files(folder)
+    if names is None:
+        names = available
+    else:
+        missing = sorted(set(names) - set(available))
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Image not found: {', '.join(missing)}")
+
+    if mode == "sprite":
+        import base64
+        try:
+            thumbnail_service.sprite_layout(len(names), size)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        sprite = thumbnail_service.build_sprite(folder, names, size=size, fmt=image_format)
+        sprite["data"] = base64.b64encode(sprite["data"]).decode("ascii")
+        return {"size": size, **sprite}
+
+    return StreamingResponse(thumbnail_service.ndjson_lines(folder, names, size=size, fmt=image_format),
+                             media_type="application/x-ndjson")
 
 
 @app.get("/api/images/{filename}")
-async def get_image(filename: str):
+def get_image(filename: str, page: int = 0, series: int = 0, channel: Optional[int] = None):
     """
-    Reads a TIFF file, converts it to PNG in memory, and returns it.
+    Reads one page of a TIFF file, converts it to PNG in memory, and returns it.
+    Multi-page stacks are addressed with page/series/channel (see tiff_service);
+    only the requested page is read. Also starts prefetching the neighbouring
+    images of the list (see prefetch_service).
     """
     folder = app_state.get("selected_folder")
     if not folder:
@@ -101,28 +208,26 @@ async def get_image(filename: str):
         raise HTTPException(status_code=404, detail="Image not found.")
 
     try:
-        # Read TIFF image using tifffile
-        with tifffile.TiffFile(filepath) as tif:
-            image_array = tif.asarray()
-
-        # Convert numpy array to PIL Image
-        img = Image.fromarray(image_array)
-
-        # Save PIL image to a byte stream
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0) # Go to the beginning of the stream
-
-        return StreamingResponse(img_byte_arr, media_type="image/png")
-
+        data = prefetch_service.get_png(filepath, page=page, series=series, channel=channel)
+    except IndexError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except memory_service.AdmissionTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process image: {e}")
 
+    try:
+        prefetch_service.schedule(folder, _list_tiff_files(folder), filename)
+    except OSError as e:
+        print(f"Warning: Could not schedule prefetch: {e}")
+    return Response(content=data, media_type="image/png")
+
 
 @app.get("/api/images/{filename}/thumbnail")
-async def get_thumbnail(filename: str, size: int = 200):
+def get_thumbnail(filename: str, size: int = 200, page: int = 0, series: int = 0,
+                  channel: Optional[int] = None):
     """
-    Returns a low-resolution thumbnail of the image for quick preview.
+    Returns a low-resolution thumbnail of one page of the image for quick preview.
     """
     folder = app_state.get("selected_folder")
     if not folder:
@@ -133,48 +238,132 @@ async def get_thumbnail(filename: str, size: int = 200):
         raise HTTPException(status_code=404, detail="Image not found.")
 
     try:
-        import numpy as np
-        
-        with tifffile.TiffFile(filepath) as tif:
-            image_array = tif.asarray()
-
-        # Handle multi-channel or multi-page TIFFs
-        if len(image_array.shape) > 2:
-            # If multi-page, take first page
-            if image_array.shape[0] > 1:
-                image_array = image_array[0]
-            # If multi-channel, take first channel
-            elif image_array.shape[2] > 1:
-                image_array = image_array[:, :, 0]
-
-        # Normalize to 0-255 range if needed
-        if image_array.dtype != np.uint8:
-            min_val = np.min(image_array)
-            max_val = np.max(image_array)
-            if max_val > min_val:
-                image_array = ((image_array - min_val) / (max_val - min_val) * 255).astype(np.uint8)
-            else:
-                image_array = image_array.astype(np.uint8)
-
-        img = Image.fromarray(image_array)
-        img.thumbnail((size, size), Image.Resampling.LANCZOS)
-
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-
-        return StreamingResponse(img_byte_arr, media_type="image/png")
+        data, _, _ = prefetch_service.get_thumbnail(filepath, size=size, page=page, series=series, channel=channel)
+        return Response(content=data, media_type="image/png")
 
+    except IndexError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except memory_service.AdmissionTimeout:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to generate thumbnail: {str(e)}")
 
 
+@app.get("/api/images/{filename}/pages")
+def get_image_pages(filename: str):
+    """
+    Describes the series of an image (axes, shape, dtype, plane and channel counts)
+    from the file header, for page/series/channel addressing of stacks.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    filepath = os.path.join(folder, filename)
+    if not os.path.exists(filepath):
+        raise HTTPException(status_code=404, detail="Image not found.")
+
+    try:
+        return tiff_service.describe_image(filepath)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read image header: {e}")
+
+
+@app.get("/api/images/{filename}/stats")
+def get_image_stats(filename: str, page: int = 0, series: int = 0, channel: Optional[int] = None):
+    """
+    Intensity statistics of one plane (min/max, mean/std, percentiles, histogram),
+    computed once from a subsample and cached next to the images.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    filepath = os.path.join(folder, filename)
+    if not os.path.exists(filepath):
+        raise HTTPException(status_code=404, detail="Image not found.")
+
+    try:
+        return intensity_service.get_stats(filepath, page=page, series=series, channel=channel)
+    except (IndexError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except memory_service.AdmissionTimeout:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute statistics: {e}")
+
+
+@app.get("/api/images/{filename}/view")
+def get_image_view(filename: str, page: int = 0, series: int = 0, channel: Optional[int] = None,
+                   low: Optional[float] = None, high: Optional[float] = None,
+                   window: Optional[float] = None, level: Optional[float] = None,
+                   auto: bool = False, gamma: float = 1.0):
+    """
+    8-bit PNG of one plane with a contrast window: low/high, or window (width) and
+    level (centre), or auto (1st-99th percentile); defaults to the plane's min..max.
+    The applied range is returned in the X-Window header as "low,high".
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    filepath = os.path.join(folder, filename)
+    if not os.path.exists(filepath):
+        raise HTTPException(status_code=404, detail="Image not found.")
+    if gamma <= 0:
+        raise HTTPException(status_code=400, detail="gamma must be positive.")
+
+    try:
+        from PIL import Image
+
+        view, (window_low, window_high) = intensity_service.render_view(
+            filepath, page=page, series=series, channel=channel,
+            low=low, high=high, window=window, level=level, auto=auto, gamma=gamma)
+        with metrics_service.stage("png_encode", bytes_in=view.nbytes) as info:
+            buffer = io.BytesIO()
+            # Contrast is adjusted interactively; favour encode speed over size
+            Image.fromarray(view).save(buffer, format='PNG', compress_level=1)
+            info["bytes_out"] = buffer.tell()
+    except (IndexError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except memory_service.AdmissionTimeout:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to render view: {e}")
+
+    return Response(content=buffer.getvalue(), media_type="image/png",
+                    headers={"X-Window": f"{window_low:g},{window_high:g}"})
+
+
+def _plane_count(filepath: str, series: int) -> int:
+    """
+    Number of pages in a series; raises HTTPException 400 for an unknown series.
+    """
+    info = tiff_service.describe_image(filepath)["series"]
+    if series < 0 or series >= len(info):
+        raise HTTPException(status_code=400, detail=f"series {series} out of range (0-{len(info) - 1}).")
+    return info[series]["planes"]
+
+
+def _scale_bar_coords(coords) -> Dict:
+    # Component detections have sub-pixel endpoints
+    return dict(zip(("x1", "y1", "x2", "y2"), (round(float(v), 2) for v in coords)))
+
+
+def _check_engine(engine: str):
+    if engine not in SCALE_BAR_ENGINES:
+        raise HTTPException(status_code=400, detail=f"engine must be one of {', '.join(SCALE_BAR_ENGINES)}.")
+
+
 @app.get("/api/images/{filename}/scale-bar")
-def get_scale_bar(filename: str):
+def get_scale_bar(filename: str, page: int = 0, series: int = 0, engine: str = "auto"):
     """
-    Detects and returns the coordinates of the scale bar for an image.
+    Detects and returns the coordinates of the scale bar for an image (one page of a stack).
+    engine is "auto" (connected components, Hough when their confidence is low),
+    "components" or "hough"; the response carries the engine used and its confidence
+    (0-1, null for Hough).
     """
     folder = app_state.get("selected_folder")
     if not folder:
@@ -184,30 +373,71 @@ def get_scale_bar(filename: str):
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="Image not found.")
 
-    coords = detect_scale_bar(filepath)
-    if coords:
-        x1, y1, x2, y2 = coords
-        return {"x1": int(x1), "y1": int(y1), "x2": int(x2), "y2": int(y2)}
+    _check_engine(engine)
+    planes = _plane_count(filepath, series)
+    if page < 0 or page >= planes:
+        raise HTTPException(status_code=400, detail=f"page {page} out of range (0-{planes - 1}).")
+
+    result = prefetch_service.get_scale_bar(filepath, page=page, series=series, engine=engine)
+    if result:
+        return {**_scale_bar_coords(result["coords"]), "confidence": result["confidence"], "engine": result["engine"]}
 
     raise HTTPException(status_code=404, detail="Scale bar not detected.")
 
 
+@app.get("/api/images/{filename}/scale-bars")
+def get_scale_bars(filename: str, series: int = 0, start: int = 0, stop: Optional[int] = None, step: int = 1,
+                   engine: str = "auto"):
+    """
+    Detects the scale bar on every page of a stack (or pages start:stop:step) in parallel.
+    Pages without a detectable bar get "scaleBar": null.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    filepath = os.path.join(folder, filename)
+    if not os.path.exists(filepath):
+        raise HTTPException(status_code=404, detail="Image not found.")
+
+    if step < 1:
+        raise HTTPException(status_code=400, detail="step must be at least 1.")
+    _check_engine(engine)
+    pages = list(range(_plane_count(filepath, series)))[start:stop:step]
+
+    results = []
+    for result in detect_scale_bars(filepath, pages, series=series, engine=engine):
+        coords = result["coords"]
+        results.append({
+            "page": result["page"],
+            "scaleBar": _scale_bar_coords(coords) if coords else None,
+            "confidence": result["confidence"],
+            "engine": result["engine"],
+        })
+    return {"pages": results}
+
+
 @app.get("/api/images/{filename}/analysis")
-def get_saved_analysis(filename: str):
+def get_saved_analysis(request: Request, filename: str, points: str = "packed", page: int = 0):
     """
     Loads previously saved analysis for an image (ROIs and scale bar data).
     Returns empty if no analysis found.
+    ROI geometry is returned as compact "pointsPacked" strings by default;
+    pass points=json for the {"x", "y"} list form.
+    Carries an ETag (304 when unchanged) and is compressed per Accept-Encoding.
     """
     folder = app_state.get("selected_folder")
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not selected.")
 
+    if points not in ("packed", "json"):
+        raise HTTPException(status_code=400, detail="points must be 'packed' or 'json'.")
+
     try:
-        analysis_data = file_service.load_roi_data(folder, filename)
-        # Load notes for this image
-        notes = file_service.load_notes(folder, filename)
-        analysis_data["notes"] = notes
-        return analysis_data
+        # Served from the prefetch cache when this image was opened as a neighbour
+        return response_service.conditional_response(
+            request, prefetch_service.analysis_version(folder, filename, points, page),
+            lambda: prefetch_service.get_analysis(folder, filename, points_format=points, page=page))
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -256,18 +486,21 @@ def save_notes(filename: str, data: Dict):
 
 
 @app.delete("/api/images/{filename}/analysis")
-def delete_image_analysis(filename: str):
+def delete_image_analysis(filename: str, background_tasks: BackgroundTasks):
     """
     Deletes all ROI analysis data for an image:
-    - Removes rows from Excel file
-    - Deletes overlay images
+    - Tombstones its rows in the Excel file (removed physically on compaction)
+    - Deletes overlay images in the background, after the response is sent
     """
     folder = app_state.get("selected_folder")
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not selected.")
 
     try:
-        file_service.delete_image_analysis(folder, filename)
+        deleted_at = file_service.delete_image_analysis(folder, filename)
+        background_tasks.add_task(file_service.delete_overlay_files, folder, filename, deleted_at)
+        spatial_service.invalidate(folder, filename)
+        analytics_service.drop_image(folder, filename)
         return {"message": "Analysis data deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete analysis: {str(e)}")
@@ -284,10 +517,44 @@ def save_roi(filename: str, roi_data: RoiData):
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not selected.")
 
+    if roi_data.overlay_mode and roi_data.overlay_mode not in file_service.OVERLAY_MODES:
+        raise HTTPException(status_code=400, detail=f"overlay_mode must be one of {', '.join(file_service.OVERLAY_MODES)}.")
+
+    overlaps = []
+    geometry_report = None
     try:
+        if not roi_data.is_notes_only:
+            # Ingest: drop duplicate vertices, simplify and check for self-intersections
+            settings = geometry_service.load_ingest_settings(folder)
+            if roi_data.simplify_tolerance is not None:
+                settings["simplify_tolerance"] = roi_data.simplify_tolerance
+            try:
+                with metrics_service.stage("polygon_ingest", vertices=len(roi_data.points)) as info:
+                    polygon, geometry_report = geometry_service.prepare_polygon(roi_data.points, **settings)
+                    info["vertices_out"] = geometry_report["vertices_after"]
+            except (KeyError, TypeError, ValueError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid ROI points: each point needs numeric x and y ({e}).")
+            roi_data.points = geometry_service.array_to_points(polygon)
+            if geometry_report["repaired"]:
+                # The repaired outline is a different shape, so its area is measured again
+                roi_data.area_px2 = geometry_report["area_after_px2"]
+                if roi_data.scale_px_per_um > 0:
+                    roi_data.area_um2 = roi_data.area_px2 / (roi_data.scale_px_per_um ** 2)
+
+            # Duplicate check against the other ROIs of this image (the ROI's own previous version is excluded)
+            index = spatial_service.get_index(folder, filename, roi_data.page)
+            overlaps = index.overlaps(roi_data.points, exclude=roi_data.selection_number)
+            duplicates = [o["id"] for o in overlaps if o["iou"] >= spatial_service.DUPLICATE_IOU]
+            if duplicates and not roi_data.allow_duplicate:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"ROI duplicates existing ROI(s) {', '.join(str(d) for d in duplicates)}.",
+                )
+
         # For notes-only updates, just update the existing row's notes
         if roi_data.is_notes_only:
-            file_service.update_roi_notes(folder, filename, roi_data.selection_number, roi_data.notes)
+            file_service.update_roi_notes(folder, filename, roi_data.selection_number, roi_data.notes, roi_data.page)
+            analytics_service.mark_current(folder)
         else:
             # Save the overlay and get the filename with version info
             overlay_filename = file_service.save_overlay_image(
@@ -295,7 +562,9 @@ def save_roi(filename: str, roi_data: RoiData):
                 filename,
                 roi_data.selection_number,
                 roi_data.points,
-                roi_data.version
+                roi_data.version,
+                roi_data.overlay_mode,
+                roi_data.page
             )
 
             # Prepare data for Excel - include all new fields
@@ -305,20 +574,360 @@ def save_roi(filename: str, roi_data: RoiData):
 
             # Save to Excel
             file_service.save_roi_to_excel(folder, excel_data)
+            spatial_service.record_saved_roi(folder, filename, roi_data.selection_number, roi_data.points, roi_data.page)
+            analytics_service.record_roi(folder, filename, roi_data.selection_number, roi_data.area_um2,
+                                         roi_data.area_px2, roi_data.scale_px_per_um, roi_data.page)
+
+        response = {"message": "ROI saved successfully.", "overlaps": overlaps}
+        if geometry_report is not None:
+            response.update({
+                "geometry": geometry_report,
+                "points": roi_data.points,
+                "areaPx2": roi_data.area_px2,
+                "areaUm2": roi_data.area_um2,
+            })
+        return response
 
-        return {"message": "ROI saved successfully."}
-
+    except HTTPException:
+        raise
     except (PermissionError, IOError) as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
 
+@app.get("/api/images/{filename}/rois/at")
+def get_rois_at(filename: str, x: float, y: float, page: int = 0):
+    """
+    Hit-tests a point (image pixels) against the image's ROIs.
+    Returns the ids of all containing ROIs, smallest first.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    return {"rois": spatial_service.get_index(folder, filename, page).at(x, y)}
+
+
+@app.get("/api/images/{filename}/rois/overlaps")
+def get_roi_overlaps(filename: str, selection_number: Optional[int] = None, page: int = 0):
+    """
+    Lists overlapping ROIs with intersection area (px²) and IoU.
+    With selection_number, only the ROIs overlapping that one; otherwise every overlapping pair.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    index = spatial_service.get_index(folder, filename, page)
+    if selection_number is None:
+        return {"pairs": index.overlapping_pairs()}
+    if selection_number not in index.polygons:
+        raise HTTPException(status_code=404, detail="ROI not found.")
+    return {"overlaps": index.overlaps(index.polygons[selection_number], exclude=selection_number)}
+
+
+@app.post("/api/images/{filename}/rois/overlaps")
+def query_roi_overlaps(filename: str, request: OverlapQuery):
+    """
+    Checks a candidate polygon against the saved ROIs before it is saved.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    index = spatial_service.get_index(folder, filename, request.page)
+    try:
+        overlaps = index.overlaps(request.points, exclude=request.exclude)
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid ROI points: each point needs numeric x and y ({e}).")
+    return {
+        "overlaps": overlaps,
+        "duplicates": [o["id"] for o in overlaps if o["iou"] >= spatial_service.DUPLICATE_IOU],
+    }
+
+
+@app.get("/api/images/{filename}/rois/{selection_number}/overlay")
+def export_roi_overlay(filename: str, selection_number: int, mode: str = "full", page: int = 0):
+    """
+    Renders the overlay of the latest saved version of an ROI on demand and returns it.
+    Use mode=full for a full-image raster export; crop and svg are also accepted.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    if mode not in file_service.OVERLAY_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(file_service.OVERLAY_MODES)}.")
+
+    analysis = file_service.load_roi_data(folder, filename, page=page)
+    roi = next((r for r in analysis["rois"] if r["id"] == selection_number), None)
+    if roi is None:
+        raise HTTPException(status_code=404, detail="ROI not found.")
+
+    try:
+        overlay_filename = file_service.save_overlay_image(
+            folder, filename, selection_number, roi["points"], roi["version"], mode, page
+        )
+    except IOError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    media_type = "image/svg+xml" if overlay_filename.endswith(".svg") else "image/png"
+    return FileResponse(os.path.join(folder, "_roi_overlays", overlay_filename), media_type=media_type)
+
+
+@app.get("/api/images/{filename}/rois/{selection_number}/versions")
+def get_roi_versions(filename: str, selection_number: int, page: int = 0):
+    """
+    Lists the retained versions of an ROI, newest first.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    return {"versions": file_service.list_roi_versions(folder, filename, selection_number, page)}
+
+
+@app.get("/api/images/{filename}/rois/{selection_number}/versions/{version}")
+def get_roi_version(filename: str, selection_number: int, version: int, page: int = 0):
+    """
+    Reconstructs an ROI as it was at a given version.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    roi = file_service.load_roi_version(folder, filename, selection_number, version, page)
+    if roi is None:
+        raise HTTPException(status_code=404, detail="Version not found or compacted away.")
+    return roi
+
+
+@app.get("/api/analytics")
+def get_analytics(bins: int = analytics_service.DEFAULT_BINS, log_bins: bool = False):
+    """
+    Pore statistics over the latest ROI versions of all images in the selected folder:
+    counts, area and equivalent diameter summaries, histograms, CDFs and per-image totals.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    if bins < 1 or bins > 1000:
+        raise HTTPException(status_code=400, detail="bins must be between 1 and 1000.")
+
+    return analytics_service.compute_analytics(folder, bins, log_bins)
+
+
+@app.get("/api/export")
+def export_measurements(format: str = "parquet", history: bool = False):
+    """
+    Streams the measurement table as Parquet or Arrow IPC with typed columns and a
+    list<struct<x, y>> polygon column, one row group per image.
+    history=true also includes every retained earlier version of each ROI.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    if format not in export_service.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(export_service.EXPORT_FORMATS)}.")
+    try:
+        export_service.require_pyarrow()
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+    extension = "parquet" if format == "parquet" else "arrow"
+    return StreamingResponse(
+        export_service.stream_export(folder, format, history),
+        media_type=export_service.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="roi_measurements.{extension}"'},
+    )
+
+
+@app.post("/api/history/compact")
+def compact_history(request: Optional[CompactionRequest] = None):
+    """
+    Compacts ROI version history for the selected folder.
+    Without limits in the body, the folder's saved policy (or environment defaults) is used.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    request = request or CompactionRequest()
+    if request.keep_last is None and request.max_age_days is None:
+        policy = history_service.load_policy(folder)
+    else:
+        policy = {"keep_last": request.keep_last, "max_age_days": request.max_age_days}
+        if request.save_policy:
+            history_service.save_policy(folder, request.keep_last, request.max_age_days)
+
+    try:
+        stats = file_service.compact_roi_history(folder, policy["keep_last"], policy["max_age_days"])
+    except (PermissionError, IOError) as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"policy": policy, **stats}
+
+
+@app.post("/api/jobs")
+def submit_job(request: JobRequest):
+    """
+    Queues a background job for the selected folder and returns it.
+    """
+    folder = app_state.get("selected_folder")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not selected.")
+
+    try:
+        job_id = jobs_service.submit(request.kind, folder, request.params, request.priority, request.max_attempts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return jobs_service.get_job(job_id)
+
+
+@app.get("/api/jobs")
+def list_jobs(status: Optional[str] = None, limit: int = 50):
+    """
+    Lists jobs of all folders, newest first.
+    """
+    if status and status not in jobs_service.JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(jobs_service.JOB_STATUSES)}.")
+    return {"jobs": jobs_service.list_jobs(status, limit)}
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: int, items: bool = False):
+    """
+    Returns a job's status and progress; items=true adds the status of every item.
+    """
+    job = jobs_service.get_job(job_id, items)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/events")
+def stream_job_progress(job_id: int):
+    """
+    Streams the job's progress as server-sent events until it finishes.
+    """
+    if jobs_service.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return StreamingResponse(
+        jobs_service.iter_progress(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: int):
+    """
+    Cancels a job; items already running finish first.
+    """
+    job = jobs_service.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@app.post("/api/jobs/{job_id}/retry")
+def retry_job(job_id: int):
+    """
+    Queues a failed or cancelled job again, for its failed and unfinished items.
+    """
+    try:
+        job = jobs_service.retry(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@app.get("/api/prefetch")
+def get_prefetch_stats():
+    """
+    Size and activity of the neighbouring-image prefetch cache.
+    """
+    return prefetch_service.stats()
+
+
+@app.get("/api/memory")
+def get_memory_stats():
+    """
+    Memory budget for image decoding: bytes reserved now and at peak, and admission counts.
+    """
+    return memory_service.stats()
+
+
+@app.get("/api/profiles")
+def get_profiles():
+    """
+    Lists the stored request profiles, newest first.
+    Profiling is enabled with PORES_PROFILING=1 (see profile_service).
+    """
+    return {"enabled": profile_service.ENABLED, "profiles": profile_service.list_profiles()}
+
+
+@app.get("/api/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = "speedscope"):
+    """
+    Downloads a profile as speedscope JSON (open it on speedscope.app) or, with
+    format=collapsed, as collapsed stacks for flamegraph tools.
+    """
+    if format not in ("speedscope", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be 'speedscope' or 'collapsed'.")
+    try:
+        if format == "collapsed":
+            return PlainTextResponse(profile_service.collapsed(profile_service.load(profile_id)))
+        return FileResponse(profile_service.profile_path(profile_id), media_type="application/json",
+                            filename=profile_id + profile_service.PROFILE_SUFFIX)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+
+
+@app.get("/api/health")
+def health():
+    """
+    Readiness probe. Returns the start-up profile when launched through serve.py.
+    """
+    return {"status": "ready", "startup": app_state.get("startup")}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Exposes request and stage metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics_service.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
-def read_root():
+def read_root(request: Request):
+    dist_dir = app_state.get("frontend_dist")
+    if dist_dir:
+        return static_service.asset_response(dist_dir, "index.html", request.headers.get("accept-encoding", ""))
     return {"message": "Pore ROI Analyzer Backend"}
 
 
+# Registered last so every API route above takes precedence
+@app.get("/{asset_path:path}", include_in_schema=False)
+def get_frontend_asset(asset_path: str, request: Request):
+    """
+    Serves the built frontend (precompressed variants, immutable caching for hashed bundles).
+    """
+    dist_dir = app_state.get("frontend_dist")
+    if not dist_dir or asset_path.startswith("api/"):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    response = static_service.asset_response(dist_dir, asset_path, request.headers.get("accept-encoding", ""))
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
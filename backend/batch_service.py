@@ -0,0 +1,382 @@
+"""
+Headless batch analysis of an image folder (the `pores` command).
+
+    python batch_service.py <folder>
+    python batch_service.py <folder> --segment --export roi_measurements.parquet
+    python batch_service.py <folder> --segment --all-pages --workers 8 --overlay-mode svg
+
+Every TIFF in the folder goes through the same pipeline as the UI: scale bar
+detection (a bar already saved for the image is kept), optional automatic pore
+segmentation, polygon ingest and measurement, and an overlay per ROI. Images
+are processed on a process pool; measurements are written to
+roi_measurements.xlsx from the main process only, a few images per workbook
+save. An export (see export_service) can be written at the end.
+
+Progress is checkpointed in .pore_analyzer_batch.json once an image's rows
+are saved, so an interrupted run (Ctrl+C, reboot) picks up where it stopped
+when started again. Images whose file changed since they were processed are
+done again; --restart ignores the checkpoint.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+import cv_service
+import file_service
+import geometry_service
+import tiff_service
+
+CHECKPOINT_FILE = ".pore_analyzer_batch.json"
+
+# Same default the UI assumes for an auto-detected scale bar
+DEFAULT_SCALE_UM = 100
+
+# Completed images are written to the workbook in groups of this many
+DEFAULT_FLUSH_EVERY = 10
+
+# Margin (px) around a detected scale bar that segmentation ignores, to skip its label
+SCALE_BAR_MARGIN = 40
+
+# Pipeline options (see the command-line flags in main)
+DEFAULT_OPTIONS = {
+    "segment": False,
+    "all_pages": False,
+    "bright_pores": False,
+    "min_area_px": cv_service.DEFAULT_MIN_PORE_AREA_PX,
+    "scale_um": DEFAULT_SCALE_UM,
+    "overlay_mode": file_service.DEFAULT_OVERLAY_MODE,
+    "verbose": False,
+}
+
+
+def list_images(folder_path: str) -> List[str]:
+    return sorted(f for f in os.listdir(folder_path) if tiff_service.is_tiff(f))
+
+
+def _file_signature(path: str) -> Dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def load_checkpoint(folder_path: str) -> Dict:
+    """
+    Reads the batch checkpoint: {"images": {image_name: {"status", "size", "mtime", ...}}}.
+    """
+    checkpoint_file = os.path.join(folder_path, CHECKPOINT_FILE)
+    if os.path.exists(checkpoint_file):
+        try:
+            with open(checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+            checkpoint.setdefault("images", {})
+            return checkpoint
+        except Exception as e:
+            print(f"Warning: Could not read batch checkpoint, starting over: {e}", file=sys.stderr)
+    return {"images": {}}
+
+
+def save_checkpoint(folder_path: str, checkpoint: Dict):
+    # Written to a temporary file first so a crash never leaves a truncated checkpoint
+    checkpoint_file = os.path.join(folder_path, CHECKPOINT_FILE)
+    temp_file = checkpoint_file + ".tmp"
+    with open(temp_file, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temp_file, checkpoint_file)
+
+
+def pending_images(folder_path: str, checkpoint: Dict) -> List[str]:
+    """
+    Images not yet done according to the checkpoint (failed ones are retried).
+    """
+    pending = []
+    for image_name in list_images(folder_path):
+        entry = checkpoint["images"].get(image_name)
+        if (entry and entry.get("status") == "done"
+                and {k: entry.get(k) for k in ("size", "mtime")} == _file_signature(os.path.join(folder_path, image_name))):
+            continue
+        pending.append(image_name)
+    return pending
+
+
+def _scale_bar_length(scale_bar: Dict) -> float:
+    return math.hypot(scale_bar["x2"] - scale_bar["x1"], scale_bar["y2"] - scale_bar["y1"])
+
+
+def analyze_image(folder_path: str, image_name: str, options: Dict) -> Dict:
+    """
+    Runs the pipeline for one image and returns its results; nothing is written to
+    the workbook here (overlay files are, as their names are unique per ROI).
+    Runs in a worker process.
+    """
+    start = time.time()
+    image_path = os.path.join(folder_path, image_name)
+    # detect_scale_bar reports its progress on stdout, which would break the progress bar
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log if not options["verbose"] else sys.stdout):
+        saved = file_service.load_scale_bar(folder_path, image_name)
+        detected = False
+        if saved["scaleBar"] and saved["scaleUm"]:
+            scale_bar, scale_um = saved["scaleBar"], saved["scaleUm"]
+        else:
+            coords = cv_service.detect_scale_bar(image_path)
+            scale_bar = dict(zip(("x1", "y1", "x2", "y2"), (round(float(v), 2) for v in coords))) if coords else None
+            scale_um = options["scale_um"] if coords else 0
+            detected = coords is not None
+        px_per_um = _scale_bar_length(scale_bar) / scale_um if scale_bar and scale_um else 0
+
+        rois = []
+        if options["segment"]:
+            exclude_box = None
+            if scale_bar:
+                exclude_box = (
+                    min(scale_bar["x1"], scale_bar["x2"]) - SCALE_BAR_MARGIN,
+                    min(scale_bar["y1"], scale_bar["y2"]) - SCALE_BAR_MARGIN,
+                    max(scale_bar["x1"], scale_bar["x2"]) + SCALE_BAR_MARGIN,
+                    max(scale_bar["y1"], scale_bar["y2"]) + SCALE_BAR_MARGIN,
+                )
+            planes = tiff_service.describe_image(image_path)["series"][0]["planes"]
+            settings = geometry_service.load_ingest_settings(folder_path)
+            for page in (range(planes) if options["all_pages"] else [0]):
+                outlines = cv_service.segment_pores(
+                    image_path, page=page, min_area_px=options["min_area_px"],
+                    dark_pores=not options["bright_pores"], exclude_box=exclude_box,
+                )
+                for selection_number, outline in enumerate(outlines, start=1):
+                    polygon, report = geometry_service.prepare_polygon(outline, **settings)
+                    points = geometry_service.array_to_points(polygon)
+                    area_px2 = report["area_after_px2"]
+                    overlay_file = None
+                    if options["overlay_mode"] != "none":
+                        overlay_file = file_service.save_overlay_image(
+                            folder_path, image_name, selection_number, points, 1, options["overlay_mode"], page
+                        )
+                    rois.append({
+                        "image_name": image_name,
+                        "selection_number": selection_number,
+                        "version": 1,
+                        "page": page,
+                        "scale_px_per_um": px_per_um,
+                        "scale_bar": scale_bar,
+                        "scale_um": scale_um,
+                        "area_px2": area_px2,
+                        "area_um2": area_px2 / (px_per_um ** 2) if px_per_um > 0 else 0,
+                        "points": points,
+                        "notes": "",
+                        "overlay_file": overlay_file,
+                    })
+
+    return {
+        "image_name": image_name,
+        "scale_bar": scale_bar,
+        "scale_um": scale_um,
+        "scale_bar_detected": detected,
+        "rois": rois,
+        "segmented": options["segment"],
+        "seconds": round(time.time() - start, 3),
+    }
+
+
+class ProgressBar:
+    """
+    Single-line progress bar on a terminal; one line per image otherwise
+    (e.g. when stderr goes to a log file on a headless machine).
+    """
+
+    def __init__(self, total: int, stream=None, width: int = 30):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.stream = stream or sys.stderr
+        self.width = width
+        self.start = time.time()
+        self.interactive = hasattr(self.stream, "isatty") and self.stream.isatty()
+
+    def _eta(self) -> str:
+        if not self.done:
+            return "--"
+        remaining = (time.time() - self.start) / self.done * (self.total - self.done)
+        minutes, seconds = divmod(int(remaining), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+    def update(self, image_name: str, message: str, failed: bool = False):
+        self.done += 1
+        self.failed += int(failed)
+        if self.interactive:
+            filled = int(self.width * self.done / self.total) if self.total else self.width
+            bar = "#" * filled + "-" * (self.width - filled)
+            line = f"\r[{bar}] {self.done}/{self.total} images, {self.failed} failed, ETA {self._eta()}  "
+            if failed:
+                line = f"\r{image_name}: {message}\n" + line
+            self.stream.write(line)
+        else:
+            self.stream.write(f"[{self.done}/{self.total}] {image_name}: {message} (ETA {self._eta()})\n")
+        self.stream.flush()
+
+    def close(self):
+        if self.interactive:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+def save_results(folder_path: str, results: List[Dict]):
+    """
+    Writes the ROIs (one workbook save) and the detected scale bars of analyze_image results.
+    """
+    rois = [roi for result in results if "rois" in result for roi in result["rois"]]
+    file_service.save_rois_to_excel(folder_path, rois)
+    for result in results:
+        if result.get("scale_bar_detected"):
+            file_service.save_scale_bar(folder_path, result["image_name"], result["scale_bar"], result["scale_um"])
+
+
+def _flush(folder_path: str, checkpoint: Dict, completed: List[Dict]):
+    """
+    Saves the results of completed images, then marks them in the checkpoint.
+    If the workbook cannot be written (e.g. open in Excel), the images stay
+    pending and are done again on the next run.
+    """
+    if not completed:
+        return
+    save_results(folder_path, completed)
+    for result in completed:
+        entry = dict(_file_signature(os.path.join(folder_path, result["image_name"])))
+        if "error" in result:
+            entry.update({"status": "failed", "error": result["error"]})
+        else:
+            entry.update({"status": "done", "rois": len(result["rois"]), "seconds": result["seconds"],
+                          "scale_bar": result["scale_bar"] is not None})
+        checkpoint["images"][result["image_name"]] = entry
+    save_checkpoint(folder_path, checkpoint)
+    completed.clear()
+
+
+def run_batch(folder_path: str, options: Dict, workers: Optional[int] = None, restart: bool = False,
+              flush_every: int = DEFAULT_FLUSH_EVERY, stream=None) -> Dict:
+    """
+    Processes every pending image of a folder. Returns a summary
+    {"images", "skipped", "failed", "rois", "seconds"}.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    start = time.time()
+    checkpoint = {"images": {}} if restart else load_checkpoint(folder_path)
+    all_images = list_images(folder_path)
+    images = pending_images(folder_path, checkpoint)
+    # Hand-drawn ROIs are never overwritten: segmentation only runs on images without any
+    analyzed = file_service.get_analyzed_images(folder_path) if options["segment"] else set()
+
+    progress = ProgressBar(len(images), stream)
+    summary = {"images": len(images), "skipped": len(all_images) - len(images), "failed": 0, "rois": 0}
+    completed = []
+
+    def handle(image_name: str, result: Optional[Dict], error: Optional[BaseException]):
+        if error is not None:
+            result = {"image_name": image_name, "error": str(error)}
+            summary["failed"] += 1
+            progress.update(image_name, f"failed: {error}", failed=True)
+        else:
+            summary["rois"] += len(result["rois"])
+            bar = "scale bar" if result["scale_bar"] else "no scale bar"
+            rois = f"{len(result['rois'])} ROI(s)" if result["segmented"] else "existing ROIs kept"
+            progress.update(image_name, f"{rois}, {bar} ({result['seconds']:.1f} s)")
+        completed.append(result)
+        if len(completed) >= flush_every:
+            _flush(folder_path, checkpoint, completed)
+
+    def image_options(image_name: str) -> Dict:
+        return dict(options, segment=options["segment"] and image_name not in analyzed)
+
+    try:
+        if workers == 1:
+            for image_name in images:
+                try:
+                    result, error = analyze_image(folder_path, image_name, image_options(image_name)), None
+                except Exception as e:
+                    result, error = None, e
+                handle(image_name, result, error)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(analyze_image, folder_path, name, image_options(name)): name for name in images}
+                try:
+                    for future in as_completed(futures):
+                        error = future.exception()
+                        handle(futures[future], None if error else future.result(), error)
+                except KeyboardInterrupt:
+                    for future in futures:
+                        future.cancel()
+                    raise
+    finally:
+        # Whatever finished is kept, also on Ctrl+C
+        _flush(folder_path, checkpoint, completed)
+        progress.close()
+
+    summary["seconds"] = round(time.time() - start, 1)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pores", description="Analyze every TIFF image of a folder without the UI.")
+    parser.add_argument("folder", help="Image folder (roi_measurements.xlsx is written there)")
+    parser.add_argument("--segment", action="store_true",
+                        help="Detect pores automatically on images that have no ROIs yet")
+    parser.add_argument("--all-pages", action="store_true", help="Segment every page of a stack, not just the first")
+    parser.add_argument("--bright-pores", action="store_true", help="Pores are brighter than the matrix")
+    parser.add_argument("--min-area", type=float, default=cv_service.DEFAULT_MIN_PORE_AREA_PX,
+                        help="Smallest pore kept by segmentation, in px² (default: %(default)s)")
+    parser.add_argument("--scale-um", type=float, default=DEFAULT_SCALE_UM,
+                        help="Length of an auto-detected scale bar in µm (default: %(default)s)")
+    parser.add_argument("--overlay-mode", choices=file_service.OVERLAY_MODES + ("none",), default=file_service.DEFAULT_OVERLAY_MODE)
+    parser.add_argument("--export", metavar="PATH", help="Write a Parquet/Arrow export when done")
+    parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet", help="Export format")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--flush-every", type=int, default=DEFAULT_FLUSH_EVERY,
+                        help="Images per workbook save and checkpoint (default: %(default)s)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and process every image")
+    parser.add_argument("--verbose", action="store_true", help="Show scale bar detection output")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.folder):
+        print(f"Not a folder: {args.folder}", file=sys.stderr)
+        return 2
+
+    options = dict(
+        DEFAULT_OPTIONS,
+        segment=args.segment,
+        all_pages=args.all_pages,
+        bright_pores=args.bright_pores,
+        min_area_px=args.min_area,
+        scale_um=args.scale_um,
+        overlay_mode=args.overlay_mode,
+        verbose=args.verbose,
+    )
+    try:
+        summary = run_batch(args.folder, options, args.workers, args.restart, max(args.flush_every, 1))
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume.", file=sys.stderr)
+        return 130
+    except (PermissionError, IOError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"Processed {summary['images']} image(s) in {summary['seconds']} s: {summary['rois']} ROI(s), "
+          f"{summary['failed']} failed, {summary['skipped']} already done")
+
+    if args.export:
+        import export_service
+        try:
+            rows = export_service.export_to_path(args.folder, args.export, args.format)
+        except ImportError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f"Exported {rows} row(s) to {args.export}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+"""
+End-to-end performance benchmark for the Pore ROI Analyzer backend.
+
+Generates a synthetic TIFF corpus (8/16-bit, single and multi-page, with and
+without a scale bar) plus a pre-populated roi_measurements.xlsx, drives the
+FastAPI app in-process through every endpoint and records throughput,
+p50/p99 latency, the RSS growth of each endpoint and the run's peak RSS to JSON.
+
+Usage (from the backend directory):
+    python benchmark.py --profile quick --output bench.json
+    python benchmark.py --profile quick --save-baseline benchmark_baseline.json
+    python benchmark.py --profile quick --baseline benchmark_baseline.json
+
+With --baseline the run exits with status 1 if any endpoint regressed by more
+than --tolerance (default 25%) in p50, p99, throughput or RSS growth (beyond
+RSS_NOISE_MB), or the run's peak RSS grew by more than the same tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+# Per-endpoint RSS growth below this many MiB over the baseline is allocator noise
+RSS_NOISE_MB = 16
+
+# Corpus profiles: images are (name, bits, pages, width, height, scale_bar)
+PROFILES = {
+    "quick": {
+        "images": [
+            ("u8_1k_bar.tif", 8, 1, 1024, 768, True),
+            ("u16_1k_bar.tif", 16, 1, 1024, 768, True),
+            ("u16_2k_nobar.tif", 16, 1, 2048, 1536, False),
+            ("u16_stack_1k.tif", 16, 5, 1024, 768, True),
+        ],
+        "roi_rows": 10000,
+        "delete_rows": 30,
+        "iterations": 5,
+    },
+    "standard": {
+        "images": [
+            ("u8_2k_bar.tif", 8, 1, 2048, 1536, True),
+            ("u16_4k_bar.tif", 16, 1, 4096, 3072, True),
+            ("u16_8k_nobar.tif", 16, 1, 8192, 6144, False),
+            ("u16_stack_2k.tif", 16, 20, 2048, 1536, True),
+        ],
+        "roi_rows": 50000,
+        "delete_rows": 100,
+        "iterations": 5,
+    },
+    "full": {
+        "images": [
+            ("u8_4k_bar.tif", 8, 1, 4096, 3072, True),
+            ("u16_8k_bar.tif", 16, 1, 8192, 6144, True),
+            ("u16_20k_bar.tif", 16, 1, 20000, 20000, True),
+            ("u8_20k_nobar.tif", 8, 1, 20000, 15000, False),
+            ("u16_stack_4k.tif", 16, 32, 4096, 3072, True),
+        ],
+        "roi_rows": 100000,
+        "delete_rows": 300,
+        "iterations": 3,
+    },
+}
+
+EXCEL_HEADER = [
+    "image_name", "selection_number", "version", "scale_px_per_um",
+    "scale_um", "scale_bar_x1", "scale_bar_y1", "scale_bar_x2", "scale_bar_y2",
+    "area_um2", "area_px2", "points_json", "notes", "overlay_file"
+]
+
+
+def _synthetic_page(rng, bits: int, width: int, height: int, scale_bar: bool):
+    """
+    Builds one noisy grayscale page with dark elliptical "pores" and an optional
+    saturated scale bar in the bottom-right corner.
+    """
+    import numpy as np
+    import cv2
+
+    dtype = np.uint8 if bits == 8 else np.uint16
+    max_val = np.iinfo(dtype).max
+    page = (rng.random((height, width), dtype=np.float32) * 0.3 + 0.4) * max_val
+    page = page.astype(dtype)
+
+    for _ in range(max(4, (width * height) // 400000)):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(5, max(6, width // 50))), int(rng.integers(5, max(6, height // 50))))
+        cv2.ellipse(page, center, axes, float(rng.integers(0, 180)), 0, 360, int(max_val * 0.1), -1)
+
+    if scale_bar:
+        bar_len = width // 6
+        bar_h = max(4, height // 150)
+        x2 = width - width // 20
+        y = height - height // 15
+        page[y:y + bar_h, x2 - bar_len:x2] = max_val
+    return page
+
+
+def generate_corpus(folder: str, profile: dict, seed: int = 0):
+    """
+    Writes the TIFF images and a roi_measurements.xlsx with profile["roi_rows"] rows.
+    The first image gets profile["delete_rows"] rows at the top of the sheet (the
+    worst case for row deletion); the rest are shared by the other images.
+    Returns the list of image names.
+    """
+    import numpy as np
+    import tifffile
+
+    rng = np.random.default_rng(seed)
+    names = []
+    for name, bits, pages, width, height, scale_bar in profile["images"]:
+        path = os.path.join(folder, name)
+        with tifffile.TiffWriter(path, bigtiff=width * height * pages * bits // 8 > 2 ** 31) as tif:
+            for _ in range(pages):
+                tif.write(_synthetic_page(rng, bits, width, height, scale_bar), contiguous=True)
+        names.append(name)
+
+    rows_per_image = {names[0]: profile["delete_rows"]}
+    remaining = max(0, profile["roi_rows"] - profile["delete_rows"])
+    for name in names[1:]:
+        rows_per_image[name] = remaining // max(1, len(names) - 1)
+    write_roi_workbook(os.path.join(folder, "roi_measurements.xlsx"), rows_per_image, rng)
+    return names
+
+
+def write_roi_workbook(filepath: str, rows_per_image: dict, rng):
+    """
+    Streams a legacy-schema ROI workbook with several versions per ROI.
+    """
+    import numpy as np
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(EXCEL_HEADER)
+    for image_name, rows in rows_per_image.items():
+        base = os.path.splitext(image_name)[0]
+        for i in range(rows):
+            selection_number = i // 3 + 1
+            version = i % 3 + 1
+            n_vertices = int(rng.integers(8, 200))
+            cx, cy = float(rng.integers(100, 900)), float(rng.integers(100, 700))
+            radius = float(rng.integers(5, 80))
+            theta = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+            xs = np.round(cx + radius * np.cos(theta), 1).tolist()
+            ys = np.round(cy + radius * np.sin(theta), 1).tolist()
+            points = [{"x": x, "y": y} for x, y in zip(xs, ys)]
+            area_px2 = float(np.pi * radius * radius)
+            sheet.append([
+                image_name, selection_number, version, 2.5, 100, 700, 720, 860, 720,
+                area_px2 / 6.25, area_px2, json.dumps(points), "",
+                f"{base}_{selection_number}_v{version}.png",
+            ])
+    workbook.save(filepath)
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+def _peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MiB (0 where unsupported).
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS reports bytes
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+        except ImportError:
+            return 0.0
+
+
+def _proc_status_mb(field: str):
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _start_rss_window():
+    """
+    Resets the kernel's peak-RSS mark where possible (Linux clear_refs) and returns
+    (baseline MiB, reset) for _rss_window_peak. Elsewhere the process-wide peak is the
+    baseline, so only growth beyond every earlier endpoint is seen.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        resident = _proc_status_mb("VmRSS")
+        if resident is not None:
+            return resident, True
+    except OSError:
+        pass
+    return _peak_rss_mb(), False
+
+
+def _rss_window_peak(window) -> float:
+    """
+    Peak RSS (MiB) since _start_rss_window.
+    """
+    baseline, reset = window
+    peak = _proc_status_mb("VmHWM") if reset else None
+    return max(peak if peak is not None else _peak_rss_mb(), baseline)
+
+
+def _measure(client, results: dict, label: str, method: str, url: str, iterations: int, **kwargs):
+    """
+    Issues the same request `iterations` times and records latency statistics and the
+    RSS growth over these requests under `label`.
+    """
+    latencies = []
+    status = None
+    window = _start_rss_window()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        response = client.request(method, url, **kwargs)
+        latencies.append(time.perf_counter() - t0)
+        status = response.status_code
+    total = time.perf_counter() - started
+
+    entry = results.setdefault(label, {"samples": 0, "latencies": [], "total_s": 0.0})
+    entry["samples"] += iterations
+    entry["latencies"].extend(latencies)
+    entry["total_s"] += total
+    entry["status"] = status
+    peak = _rss_window_peak(window)
+    entry["peak_rss_mb"] = max(entry.get("peak_rss_mb", 0.0), round(peak, 1))
+    entry["rss_growth_mb"] = max(entry.get("rss_growth_mb", 0.0), round(peak - window[0], 1))
+
+
+def _summarize(raw: dict) -> dict:
+    summary = {}
+    for label, entry in raw.items():
+        latencies = sorted(entry["latencies"])
+        summary[label] = {
+            "samples": entry["samples"],
+            "status": entry["status"],
+            "throughput_rps": round(entry["samples"] / entry["total_s"], 3) if entry["total_s"] else 0.0,
+            "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+            "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+            "peak_rss_mb": entry["peak_rss_mb"],
+            "rss_growth_mb": entry["rss_growth_mb"],
+        }
+    return summary
+
+
+def run_benchmark(profile_name: str, workdir: str, iterations: int = None) -> dict:
+    """
+    Generates the corpus in workdir and benchmarks every endpoint against it.
+    """
+    # Benchmark jobs go to a throwaway queue, not the user's
+    os.environ.setdefault("PORES_JOBS_DB", os.path.join(workdir, "jobs.sqlite3"))
+    from fastapi.testclient import TestClient
+    import app as backend_app
+
+    profile = PROFILES[profile_name]
+    iterations = iterations or profile["iterations"]
+
+    corpus_start = time.perf_counter()
+    image_names = generate_corpus(workdir, profile)
+    corpus_seconds = time.perf_counter() - corpus_start
+
+    raw = {}
+    client = TestClient(backend_app.app)
+    _measure(client, raw, "POST /api/select-folder", "POST", "/api/select-folder", iterations,
+             json={"folder_path": workdir})
+    _measure(client, raw, "GET /api/images", "GET", "/api/images", iterations)
+    _measure(client, raw, "GET /api/thumbnails", "GET", "/api/thumbnails?size=200", iterations)
+    _measure(client, raw, "GET /api/thumbnails?mode=sprite", "GET", "/api/thumbnails?size=200&mode=sprite", iterations)
+
+    for name in image_names:
+        _measure(client, raw, "GET /api/images/{filename}", "GET", f"/api/images/{name}", iterations)
+        _measure(client, raw, "GET /api/images/{filename}/thumbnail", "GET",
+                 f"/api/images/{name}/thumbnail?size=200", iterations)
+        _measure(client, raw, "GET /api/images/{filename}/scale-bar", "GET",
+                 f"/api/images/{name}/scale-bar", iterations)
+        _measure(client, raw, "GET /api/images/{filename}/analysis", "GET",
+                 f"/api/images/{name}/analysis", iterations)
+        _measure(client, raw, "GET /api/images/{filename}/pages", "GET", f"/api/images/{name}/pages", iterations)
+        _measure(client, raw, "GET /api/images/{filename}/stats", "GET", f"/api/images/{name}/stats", iterations)
+        _measure(client, raw, "GET /api/images/{filename}/view", "GET",
+                 f"/api/images/{name}/view?auto=true&gamma=0.8", iterations)
+        _measure(client, raw, "GET /api/images/{filename}/scale-bars", "GET",
+                 f"/api/images/{name}/scale-bars?stop=4", iterations)
+
+    target = image_names[0]
+    scale_bar = {"x1": 700, "y1": 720, "x2": 860, "y2": 720}
+    _measure(client, raw, "POST /api/images/{filename}/scale-bar-save", "POST",
+             f"/api/images/{target}/scale-bar-save", iterations, json={"scaleBar": scale_bar, "scaleUm": 100})
+    _measure(client, raw, "POST /api/images/{filename}/notes", "POST",
+             f"/api/images/{target}/notes", iterations, json={"notes": "benchmark"})
+
+    square = [{"x": 100, "y": 100}, {"x": 200, "y": 100}, {"x": 200, "y": 200}, {"x": 100, "y": 200}]
+    for version in range(1, iterations + 1):
+        roi = {
+            "selection_number": 100000, "scale_px_per_um": 2.5, "area_um2": 1600.0, "area_px2": 10000.0,
+            "points": square, "version": version, "scale_um": 100, "scale_bar": scale_bar,
+            "is_modification": version > 1,
+        }
+        _measure(client, raw, "POST /api/images/{filename}/roi", "POST", f"/api/images/{target}/roi", 1, json=roi)
+
+    _measure(client, raw, "GET /api/images/{filename}/rois/at", "GET",
+             f"/api/images/{target}/rois/at?x=150&y=150", iterations)
+    _measure(client, raw, "GET /api/images/{filename}/rois/overlaps", "GET",
+             f"/api/images/{target}/rois/overlaps", iterations)
+    _measure(client, raw, "POST /api/images/{filename}/rois/overlaps", "POST",
+             f"/api/images/{target}/rois/overlaps", iterations, json={"points": square, "exclude": 100000})
+    _measure(client, raw, "GET /api/images/{filename}/rois/{selection_number}/versions", "GET",
+             f"/api/images/{target}/rois/100000/versions", iterations)
+
+    _measure(client, raw, "GET /api/analytics", "GET", "/api/analytics", iterations)
+    _measure(client, raw, "GET /api/export", "GET", "/api/export?format=parquet", iterations)
+    _measure(client, raw, "POST /api/jobs", "POST", "/api/jobs", 1, json={"kind": "warm_caches"})
+    _measure(client, raw, "GET /api/jobs", "GET", "/api/jobs", iterations)
+
+    _measure(client, raw, "GET /metrics", "GET", "/metrics", iterations)
+    _measure(client, raw, "POST /api/history/compact", "POST", "/api/history/compact", 1, json={"keep_last": 2})
+    _measure(client, raw, "DELETE /api/images/{filename}/analysis", "DELETE",
+             f"/api/images/{target}/analysis", 1)
+
+    return {
+        "profile": profile_name,
+        "iterations": iterations,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus_seconds": round(corpus_seconds, 3),
+        # Resetting the peak mark per endpoint also resets the process-wide one
+        "peak_rss_mb": round(max([_peak_rss_mb()] + [entry["peak_rss_mb"] for entry in raw.values()]), 1),
+        "results": _summarize(raw),
+    }
+
+
+def compare_to_baseline(current: dict, baseline: dict, tolerance: float):
+    """
+    Returns a list of human-readable regressions (empty if none).
+    """
+    regressions = []
+    for label, base in baseline.get("results", {}).items():
+        now = current["results"].get(label)
+        if now is None:
+            regressions.append(f"{label}: missing from current run")
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if base[key] > 0 and now[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{label}: {key} {now[key]:.1f} > baseline {base[key]:.1f}")
+        if base["throughput_rps"] > 0 and now["throughput_rps"] < base["throughput_rps"] / (1 + tolerance):
+            regressions.append(
+                f"{label}: throughput {now['throughput_rps']:.2f} < baseline {base['throughput_rps']:.2f} rps")
+        base_growth, now_growth = base.get("rss_growth_mb", 0.0), now.get("rss_growth_mb", 0.0)
+        if now_growth > base_growth * (1 + tolerance) and now_growth - base_growth > RSS_NOISE_MB:
+            regressions.append(f"{label}: RSS growth {now_growth:.1f} MB > baseline {base_growth:.1f} MB")
+    base_rss, now_rss = baseline.get("peak_rss_mb") or 0, current.get("peak_rss_mb") or 0
+    if base_rss > 0 and now_rss > base_rss * (1 + tolerance):
+        regressions.append(f"peak RSS {now_rss:.1f} MB > baseline {base_rss:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Pore ROI Analyzer backend end to end.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--iterations", type=int, default=None, help="Override requests per endpoint")
+    parser.add_argument("--workdir", default=None, help="Corpus directory (default: temporary, removed afterwards)")
+    parser.add_argument("--output", default=None, help="Write results JSON here")
+    parser.add_argument("--baseline", default=None, help="Fail if results regress against this JSON")
+    parser.add_argument("--save-baseline", default=None, help="Store results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression (default 0.25)")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("PORES_LOG_LEVEL", "WARNING")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pores-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = run_benchmark(args.profile, workdir, args.iterations)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("profile") != results["profile"]:
+            print(f"Baseline profile {baseline.get('profile')!r} does not match {results['profile']!r}")
+            return 2
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("\nPerformance regressions detected:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,61 @@
-import cv2
-import numpy as np
+import math
+import os
+from typing import Dict, List, Optional
+import memory_service
+import metrics_service
+import tiff_service
 
-def detect_scale_bar(image_path: str):
-    """
-    Detects the scale bar in a microscopy image using multiple detection strategies.
-    Handles graduated scale bars with markings and text (e.g., "100um").
+# Scale-bar detection engines. "components" looks for a saturated bar in the bottom
+# and top bands with connected components; "hough" is the Canny + HoughLinesP
+# detector; "auto" runs components and falls back to Hough below MIN_COMPONENT_CONFIDENCE.
+SCALE_BAR_ENGINES = ("auto", "components", "hough")
+MIN_COMPONENT_CONFIDENCE = 0.5
 
-    Returns:
-        A tuple (x1, y1, x2, y2) of the detected bar's endpoints, or None if not found.
-    """
+# Component engine: grey levels counted as saturated (bright and dark bars), minimum
+# bar length as a fraction of the image width, and minimum length/thickness ratio
+SATURATED_HIGH = 250
+SATURATED_LOW = 5
+MIN_BAR_LENGTH = 0.03
+MIN_BAR_ASPECT = 4
+
+# Planes larger than this are searched on a subsample (every step-th row and column);
+# a bar found there gets its ends refined on the full-resolution rows around it
+DETECT_MAX_PIXELS = int(os.environ.get("PORES_DETECT_MAX_PIXELS", str(4096 * 4096)))
+# 8-bit copies of the searched plane alive during detection (grayscale, masks, labels)
+DETECT_COPIES = 6
+
+def _read_gray(image_path: str, page: int, series: int, step: int = 1):
     try:
-        # 1. Load and preprocess
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            print(f"Error: Could not read image at {image_path}")
-            return None
+        return tiff_service.to_gray8(tiff_service.read_plane(image_path, page=page, series=series, step=step))
+    except (IOError, ValueError) as e:
+        print(f"Error: Could not read image at {image_path}: {e}")
+        return None
 
-        img_height, img_width = img.shape
-        
-        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
+def _hough_scale_bar(img):
+    """
+    Canny + HoughLinesP detector; scores horizontal lines by length and position.
+    Returns (x1, y1, x2, y2) or None.
+    """
+    import cv2
+    import numpy as np
+
+    img_height, img_width = img.shape
+    
+    # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
+    with metrics_service.stage("clahe", bytes_in=img.nbytes):
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         img_clahe = clahe.apply(img)
 
-        # 2. Edge Detection with multiple strategies
+    # 2. Edge Detection with multiple strategies
+    with metrics_service.stage("canny", bytes_in=img_clahe.nbytes):
         edges = cv2.Canny(img_clahe, 50, 150, apertureSize=3)
-        
+
         # Also try morphological operations to enhance scale bar markings
         kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
         edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel, iterations=1)
 
-        # 3. Hough Line Transform - detect all lines
+    # 3. Hough Line Transform - detect all lines
+    with metrics_service.stage("hough", bytes_in=edges.nbytes) as info:
         lines = cv2.HoughLinesP(
             edges,
             1,
@@ -38,85 +64,331 @@ def detect_scale_bar(image_path: str):
             minLineLength=int(img_width * 0.03),  # min length is 3% of image width
             maxLineGap=15
         )
+        info["lines"] = 0 if lines is None else len(lines)
+
+    if lines is None:
+        print("No lines detected via Hough transform")
+        return None
+
+    print(f"Detected {len(lines)} lines")
+
+    # 4. Filtering and Selection
+    best_line = None
+    best_score = -1
+    
+    # Group horizontal lines (potential scale bars)
+    horizontal_lines = []
+
+    # HoughLinesP returns (N, 1, 4) or (N, 4) depending on the OpenCV version
+    for line in lines.reshape(-1, 4):
+        x1, y1, x2, y2 = (int(v) for v in line)
 
-        if lines is None:
-            print("No lines detected via Hough transform")
-            return None
+        # Filter for horizontal lines (angle close to 0 or 180)
+        angle = np.abs(np.arctan2(y2 - y1, x2 - x1) * 180 / np.pi)
+        # Accept angles close to 0 or 180 degrees
+        if angle > 15 and angle < 165:
+            continue
 
-        print(f"Detected {len(lines)} lines")
+        length = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+        
+        # Scale bar should be reasonably long (at least 3% of image width)
+        if length < img_width * 0.03:
+            continue
+        
+        horizontal_lines.append({
+            'line': (x1, y1, x2, y2),
+            'length': length,
+            'y_pos': (y1 + y2) / 2,
+            'x_min': min(x1, x2),
+            'x_max': max(x1, x2)
+        })
+
+    if not horizontal_lines:
+        print("No suitable horizontal lines found")
+        return None
+
+    print(f"Found {len(horizontal_lines)} horizontal line candidates")
 
-        # 4. Filtering and Selection
-        best_line = None
-        best_score = -1
+    # Prefer lines in the bottom part of image (where scale bars typically are)
+    # but also accept lines in corners or edges
+    for hline in horizontal_lines:
+        x1, y1, x2, y2 = hline['line']
+        length = hline['length']
+        y_pos = hline['y_pos']
         
-        # Group horizontal lines (potential scale bars)
-        horizontal_lines = []
-
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
-
-            # Filter for horizontal lines (angle close to 0 or 180)
-            angle = np.abs(np.arctan2(y2 - y1, x2 - x1) * 180 / np.pi)
-            # Accept angles close to 0 or 180 degrees
-            if angle > 15 and angle < 165:
-                continue
-
-            length = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-            
-            # Scale bar should be reasonably long (at least 3% of image width)
-            if length < img_width * 0.03:
-                continue
-            
-            horizontal_lines.append({
-                'line': (x1, y1, x2, y2),
-                'length': length,
-                'y_pos': (y1 + y2) / 2,
-                'x_min': min(x1, x2),
-                'x_max': max(x1, x2)
-            })
-
-        if not horizontal_lines:
-            print("No suitable horizontal lines found")
-            return None
-
-        print(f"Found {len(horizontal_lines)} horizontal line candidates")
-
-        # Prefer lines in the bottom part of image (where scale bars typically are)
-        # but also accept lines in corners or edges
-        for hline in horizontal_lines:
-            x1, y1, x2, y2 = hline['line']
-            length = hline['length']
-            y_pos = hline['y_pos']
-            
-            # Scoring: prioritize lines in lower region and longer lines
-            vertical_pos_score = 0
-            
-            # Bonus for being in bottom 40% of image
-            if y_pos > img_height * 0.6:
-                vertical_pos_score = 1.5
-            # Bonus for being near top (sometimes scale bars are there)
-            elif y_pos < img_height * 0.2:
-                vertical_pos_score = 1.2
-            # Penalty for middle region
-            else:
-                vertical_pos_score = 0.5
-            
-            # Combined score: length with position bonus
-            score = length * vertical_pos_score
-            
-            if score > best_score:
-                best_score = score
-                best_line = hline['line']
-
-        if best_line is None:
-            print("No suitable scale bar found")
-            return None
-
-        print(f"Selected scale bar with score {best_score}: {best_line}")
-        return best_line
+        # Scoring: prioritize lines in lower region and longer lines
+        vertical_pos_score = 0
+        
+        # Bonus for being in bottom 40% of image
+        if y_pos > img_height * 0.6:
+            vertical_pos_score = 1.5
+        # Bonus for being near top (sometimes scale bars are there)
+        elif y_pos < img_height * 0.2:
+            vertical_pos_score = 1.2
+        # Penalty for middle region
+        else:
+            vertical_pos_score = 0.5
+        
+        # Combined score: length with position bonus
+        score = length * vertical_pos_score
+        
+        if score > best_score:
+            best_score = score
+            best_line = hline['line']
+
+    if best_line is None:
+        print("No suitable scale bar found")
+        return None
+
+    print(f"Selected scale bar with score {best_score}: {best_line}")
+    return best_line
+
+def _refine_endpoints(img, x0: int, y0: int, width: int, height: int):
+    """
+    Sub-pixel ends of a horizontal bar: where the intensity profile along the bar rows
+    crosses halfway between bar and background. y is the intensity-weighted centre row.
+    Returns (x1, y, x2, y) in pixel-centre coordinates; x1..x2 spans the bar's full length.
+    """
+    import numpy as np
+
+    img_height, img_width = img.shape
+    profile = img[y0:y0 + height].astype(np.float64).mean(axis=0)
+    bar_level = np.median(profile[x0:x0 + width])
+    margin = max(3, height)
+    outside = np.concatenate([profile[max(x0 - margin, 0):x0], profile[x0 + width:x0 + width + margin]])
+    background = np.median(outside) if outside.size else bar_level
+    if background == bar_level:
+        x1, x2 = x0 - 0.5, x0 + width - 0.5
+    else:
+        # The bar is the run of columns on the bar's side of the half level around its centre,
+        # which also corrects a component that took in neighbouring pixels
+        half = (bar_level + background) / 2
+        on_bar = (profile - half) * (bar_level - half) > 0
+        centre = x0 + width // 2
+        off_left = np.flatnonzero(~on_bar[:centre])
+        off_right = np.flatnonzero(~on_bar[centre:])
+        left = off_left[-1] + 1 if off_left.size else 0
+        right = centre + off_right[0] - 1 if off_right.size else img_width - 1
+
+        def crossing(inside: int, outside: int) -> float:
+            if not 0 <= outside < img_width:
+                return (inside + outside) / 2
+            a, b = profile[inside], profile[outside]
+            return float(inside + (outside - inside) * (a - half) / (a - b))
+
+        x1, x2 = crossing(left, left - 1), crossing(right, right + 1)
+
+    # Rows weighted by their contrast to the rows just outside the bar
+    top, bottom = max(y0 - 1, 0), min(y0 + height + 1, img_height)
+    columns = img[top:bottom, x0:x0 + width].astype(np.float64).mean(axis=1)
+    background = (columns[0] + columns[-1]) / 2
+    weights = np.abs(columns - background)
+    y = top + float((weights * np.arange(len(columns))).sum() / weights.sum()) if weights.sum() else y0 + (height - 1) / 2
+    return x1, y, x2, y
+
+def _component_scale_bar(img) -> Optional[Dict]:
+    """
+    Connected-component detector for a solid (or graduated) saturated bar in the bottom
+    40% or top 20% of the image. Saturated (and Otsu-thresholded) pixels are opened with a horizontal kernel of
+    the minimum bar length, which drops text and tick marks; the remaining components
+    are scored by aspect ratio, fill and contrast to their surroundings.
 
+    Returns:
+        {"coords": (x1, y1, x2, y2), "confidence": 0..1, "box": (x, y, w, h)} with sub-pixel
+        endpoints and the component's bounding box, or None.
+    """
+    import cv2
+    import numpy as np
+
+    img_height, img_width = img.shape
+    # Odd kernel width, so the opening does not shift components by a pixel
+    min_length = max(int(img_width * MIN_BAR_LENGTH), 3) | 1
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (min_length, 1))
+    bands = ((int(img_height * 0.6), img_height), (0, int(img_height * 0.2)))
+
+    candidates = []
+    with metrics_service.stage("components", bytes_in=img.nbytes) as info:
+        for band_top, band_bottom in bands:
+            band = img[band_top:band_bottom]
+            # Saturated pixels first; Otsu classes catch bars of stretched 16-bit or colour data
+            otsu, _ = cv2.threshold(band, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+            seen = set()
+            for mask in (band >= SATURATED_HIGH, band <= SATURATED_LOW, band > otsu, band <= otsu):
+                mask = cv2.morphologyEx(mask.astype(np.uint8), cv2.MORPH_OPEN, kernel)
+                count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+                for label in range(1, count):
+                    x, y, w, h, area = (int(v) for v in stats[label])
+                    # Frame lines of an info panel run to the image edge
+                    if w < min_length or w / h < MIN_BAR_ASPECT or x == 0 or x + w == img_width:
+                        continue
+                    if (x, y, w, h) in seen:
+                        continue
+                    seen.add((x, y, w, h))
+                    fill = area / (w * h)
+                    aspect_score = min(1.0, w / h / (5 * MIN_BAR_ASPECT))
+                    # Contrast to the median of a margin around the bar (robust to ticks and text)
+                    margin = h + 2
+                    top, left = max(y - margin, 0), max(x - margin, 0)
+                    region = band[top:y + h + margin, left:x + w + margin]
+                    outside = region[labels[top:y + h + margin, left:x + w + margin] != label]
+                    inside = band[y:y + h, x:x + w][labels[y:y + h, x:x + w] == label]
+                    contrast = abs(float(inside.mean()) - float(np.median(outside))) / 255 if outside.size else 0.0
+                    confidence = fill * aspect_score * min(1.0, 2 * contrast)
+                    candidates.append((confidence, w, (x, y + band_top, w, h)))
+        info["candidates"] = len(candidates)
+
+    if not candidates:
+        return None
+    candidates.sort(key=lambda c: (c[0], c[1]), reverse=True)
+    confidence, _, (x, y, w, h) = candidates[0]
+    # A separate runner-up of similar quality makes the choice ambiguous (overlapping
+    # candidates are the same bar found by another threshold)
+    others = [c[0] for c in candidates[1:]
+              if c[2][0] >= x + w or c[2][0] + c[2][2] <= x or c[2][1] >= y + h or c[2][1] + c[2][3] <= y]
+    if others and confidence > 0:
+        confidence *= 1 - 0.5 * others[0] / confidence
+    coords = _refine_endpoints(img, x, y, w, h)
+    print(f"Selected scale bar component with confidence {confidence:.2f}: {coords}")
+    return {"coords": coords, "confidence": round(confidence, 3), "box": (x, y, w, h)}
+
+def _refine_full_resolution(image_path: str, page: int, series: int, box, step: int):
+    """
+    Refines the ends of a bar found on a subsample taken with the given step, reading
+    only the full-resolution rows around it. Returns (x1, y1, x2, y2).
+    """
+    width, height = tiff_service.plane_size(image_path, series)
+    x, y, w, h = box
+    margin = (h + 2) * step
+    top, bottom = max(y * step - margin, 0), min((y + h) * step + margin, height)
+    # Called within find_scale_bar's reservation, so this one is added without waiting
+    with memory_service.admit(tiff_service.read_footprint(image_path, series) + width * (bottom - top),
+                              "scale_bar_refine"):
+        strip = tiff_service.to_gray8(tiff_service.read_plane(
+            image_path, page=page, series=series, region=(0, top, width, bottom)))
+        x1, y1, x2, y2 = _refine_endpoints(strip, x * step, y * step - top, w * step, h * step)
+    return x1, y1 + top, x2, y2 + top
+
+def find_scale_bar(image_path: str, page: int = 0, series: int = 0, engine: str = "auto",
+                   min_confidence: float = MIN_COMPONENT_CONFIDENCE) -> Optional[Dict]:
+    """
+    Detects the scale bar of one page with the given engine (see SCALE_BAR_ENGINES).
+    With "auto", the Hough detector only runs when the component engine finds nothing
+    or has a confidence below min_confidence; if Hough finds nothing either, the
+    low-confidence component result is returned.
+    Planes above DETECT_MAX_PIXELS are searched on a subsample.
+
+    Returns:
+        {"coords": (x1, y1, x2, y2), "confidence": 0..1 or None (Hough), "engine": name},
+        or None if not found.
+    """
+    if engine not in SCALE_BAR_ENGINES:
+        raise ValueError(f"engine must be one of {', '.join(SCALE_BAR_ENGINES)}.")
+
+    try:
+        width, height = tiff_service.plane_size(image_path, series)
+        step = max(1, math.ceil(math.sqrt(width * height / DETECT_MAX_PIXELS)))
+        with memory_service.admit(memory_service.estimate(image_path, series, step, copies=DETECT_COPIES),
+                                  "scale_bar"):
+            img = _read_gray(image_path, page, series, step)
+            if img is None:
+                return None
+
+            component = None
+            if engine in ("auto", "components"):
+                component = _component_scale_bar(img)
+                if component is not None:
+                    component["engine"] = "components"
+                    box = component.pop("box")
+                    if step > 1:
+                        component["coords"] = _refine_full_resolution(image_path, page, series, box, step)
+                if engine == "components" or (component is not None and component["confidence"] >= min_confidence):
+                    return component
+
+            coords = _hough_scale_bar(img)
+            if coords is not None:
+                # Centres of the subsampled pixels in full-resolution coordinates
+                coords = coords if step == 1 else tuple(v * step + (step - 1) / 2 for v in coords)
+                return {"coords": coords, "confidence": None, "engine": "hough"}
+            return component
+
+    except memory_service.AdmissionTimeout:
+        raise
     except Exception as e:
         print(f"Error in scale bar detection: {e}")
         import traceback
         traceback.print_exc()
         return None
+
+def detect_scale_bar(image_path: str, page: int = 0, series: int = 0, engine: str = "auto"):
+    """
+    Detects the scale bar in a microscopy image (see find_scale_bar).
+    Handles graduated scale bars with markings and text (e.g., "100um").
+    For multi-page TIFFs only the given page is read.
+
+    Returns:
+        A tuple (x1, y1, x2, y2) of the detected bar's endpoints, or None if not found.
+    """
+    result = find_scale_bar(image_path, page=page, series=series, engine=engine)
+    return result["coords"] if result else None
+
+def detect_scale_bars(image_path: str, pages: List[int], series: int = 0, max_workers: Optional[int] = None,
+                      engine: str = "auto") -> List[Dict]:
+    """
+    Runs scale bar detection on several pages of a stack in parallel.
+    Each worker reads only its own page; OpenCV releases the GIL, so threads scale.
+    Returns [{"page": p, "coords": (x1, y1, x2, y2) or None, "confidence": ..., "engine": ...}, ...]
+    in page order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    max_workers = max_workers or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda p: find_scale_bar(image_path, page=p, series=series, engine=engine), pages))
+    return [{"page": page, **(result or {"coords": None, "confidence": None, "engine": None})}
+            for page, result in zip(pages, results)]
+
+# Automatic segmentation defaults: pores smaller than this are treated as noise
+DEFAULT_MIN_PORE_AREA_PX = 25
+
+def segment_pores(image_path: str, page: int = 0, series: int = 0, min_area_px: float = DEFAULT_MIN_PORE_AREA_PX,
+                  dark_pores: bool = True, exclude_border: bool = True, exclude_box: Optional[tuple] = None) -> List:
+    """
+    Finds pore outlines on one plane with an Otsu threshold.
+    Pores are dark on a bright matrix unless dark_pores=False. Pores touching the
+    image border (cut off, so their area is unknown) are dropped unless
+    exclude_border=False; exclude_box=(x0, y0, x1, y1) masks out a region such
+    as the scale bar and its label.
+
+    Returns:
+        A list of (N, 2) int32 vertex arrays, ordered top to bottom, left to right.
+    """
+    import cv2
+    import numpy as np
+
+    # Grayscale, blurred, mask and the opening's output
+    with memory_service.admit(memory_service.estimate(image_path, series, copies=4), "segmentation"):
+        img = tiff_service.to_gray8(tiff_service.read_plane(image_path, page=page, series=series))
+        img_height, img_width = img.shape
+
+        with metrics_service.stage("segment", bytes_in=img.nbytes) as info:
+            blurred = cv2.GaussianBlur(img, (5, 5), 0)
+            mode = cv2.THRESH_BINARY_INV if dark_pores else cv2.THRESH_BINARY
+            _, mask = cv2.threshold(blurred, 0, 255, mode | cv2.THRESH_OTSU)
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
+            if exclude_box is not None:
+                x0, y0, x1, y1 = (int(v) for v in exclude_box)
+                mask[max(y0, 0):max(y1, 0), max(x0, 0):max(x1, 0)] = 0
+
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            pores = []
+            for contour in contours:
+                if len(contour) < 3 or cv2.contourArea(contour) < min_area_px:
+                    continue
+                x, y, w, h = cv2.boundingRect(contour)
+                if exclude_border and (x == 0 or y == 0 or x + w >= img_width or y + h >= img_height):
+                    continue
+                pores.append((y, x, contour.reshape(-1, 2).astype(np.int32)))
+            pores.sort(key=lambda p: (p[0], p[1]))
+            info["pores"] = len(pores)
+        return [p[2] for p in pores]
@@ -1,10 +1,151 @@
 import os
-import cv2
-import numpy as np
-import openpyxl
 import json
-from openpyxl import Workbook
+import threading
+from functools import wraps
 from typing import List, Dict, Set
+import metrics_service
+import geometry_service
+import history_service
+import memory_service
+import tiff_service
+
+# cv2, numpy and openpyxl are imported inside the functions that use them so that
+# importing this module (and therefore starting the server) stays cheap.
+
+def _load_workbook(filepath: str, **kwargs):
+    """
+    openpyxl.load_workbook wrapped in the "workbook_load" metrics stage.
+    """
+    import openpyxl
+
+    with metrics_service.stage("workbook_load", bytes_in=os.path.getsize(filepath),
+                               read_only=kwargs.get("read_only", False)):
+        return openpyxl.load_workbook(filepath, **kwargs)
+
+def _save_workbook(workbook, filepath: str):
+    """
+    Workbook.save wrapped in the "workbook_save" metrics stage.
+    """
+    with metrics_service.stage("workbook_save") as info:
+        workbook.save(filepath)
+        info["bytes_out"] = os.path.getsize(filepath)
+
+def _save_synced(workbook, filepath: str, row_numbers=None):
+    """
+    Saves the workbook and, if the ROI store (see import_service) matched it before the
+    save, applies the saved rows of the active sheet to the store: the given sheet row
+    numbers, or every row after a rewrite (row_numbers=None).
+    """
+    import import_service
+
+    folder_path = os.path.dirname(filepath)
+    synced = import_service.is_current(folder_path)
+    _save_workbook(workbook, filepath)
+    if not synced:
+        return
+    sheet = workbook.active
+    header = [cell.value for cell in sheet[1]]
+    if row_numbers is None:
+        rows = enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2)
+    else:
+        rows = ((number, [cell.value for cell in sheet[number]]) for number in sorted(row_numbers))
+    import_service.update_store(folder_path, header, rows, replace=row_numbers is None)
+
+# Every write of roi_measurements.xlsx (or of the tombstones purged with it) is a
+# load-modify-save. Job commits run on the jobs dispatcher thread while UI requests
+# save on worker threads, so writers of a folder hold its lock for the whole cycle.
+_workbook_locks: Dict[str, threading.RLock] = {}
+_workbook_locks_guard = threading.Lock()
+
+def workbook_lock(folder_path: str) -> threading.RLock:
+    """
+    The lock serializing writes to a folder's workbook (reentrant, so writers may nest).
+    """
+    key = os.path.normcase(os.path.realpath(folder_path))
+    with _workbook_locks_guard:
+        return _workbook_locks.setdefault(key, threading.RLock())
+
+def _writes_workbook(function):
+    @wraps(function)
+    def locked(folder_path, *args, **kwargs):
+        with workbook_lock(folder_path):
+            return function(folder_path, *args, **kwargs)
+    return locked
+
+# Column layout of roi_measurements.xlsx for newly created workbooks.
+# points_json is kept for older rows; new rows store geometry in points_packed
+# (see geometry_service) and leave points_json empty.
+# The first sheet holds the current state of each ROI; earlier versions live as
+# reverse deltas on the roi_history sheet (see history_service).
+ROI_HEADER = [
+    "image_name", "selection_number", "version", "scale_px_per_um",
+    "scale_um", "scale_bar_x1", "scale_bar_y1", "scale_bar_x2", "scale_bar_y2",
+    "area_um2", "area_px2", "points_json", "notes", "overlay_file", "points_packed",
+    "updated_at", "page"
+]
+
+# Column positions assumed for workbooks whose header lacks a name; columns added
+# later (notes, overlay_file, points_packed, updated_at, page) are only read by name
+HEADER_FALLBACKS = {
+    "image_name": 0, "selection_number": 1, "version": 2, "scale_px_per_um": 3, "scale_um": 4,
+    "scale_bar_x1": 5, "scale_bar_y1": 6, "scale_bar_x2": 7, "scale_bar_y2": 8,
+    "area_um2": 9, "area_px2": 10, "points_json": 11,
+}
+
+# Columns appended (without back-filling) when an older workbook is opened for writing
+# (rows without a page belong to page 0)
+_LATE_COLUMNS = ("points_packed", "updated_at", "page")
+
+def _rewrite_sheet(sheet, rows: List[list]):
+    """
+    Replaces every data row of a sheet in one pass (header row is kept).
+    Unlike repeated delete_rows calls this is linear in the sheet size.
+    """
+    if sheet.max_row >= 2:
+        sheet.delete_rows(2, sheet.max_row - 1)
+    for row in rows:
+        sheet.append(list(row))
+
+# Deleting an image's analysis only records a tombstone (image name -> deletion
+# time) in this sidecar; rows of tombstoned images are skipped by every reader.
+# They are physically removed by the next rewrite that touches them: saving a new
+# ROI for the image, or history compaction.
+TOMBSTONE_FILE = ".pore_analyzer_tombstones.json"
+
+def load_tombstones(folder_path: str) -> Dict[str, str]:
+    """
+    Returns {image_name: deleted_at} for images whose analysis was deleted but whose rows are still on disk.
+    """
+    tombstone_file = os.path.join(folder_path, TOMBSTONE_FILE)
+    if not os.path.exists(tombstone_file):
+        return {}
+    try:
+        with open(tombstone_file, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not load tombstones: {e}")
+        return {}
+
+def _save_tombstones(folder_path: str, tombstones: Dict[str, str]):
+    tombstone_file = os.path.join(folder_path, TOMBSTONE_FILE)
+    if not tombstones:
+        if os.path.exists(tombstone_file):
+            os.remove(tombstone_file)
+        return
+    with open(tombstone_file, 'w') as f:
+        json.dump(tombstones, f, indent=2)
+
+def _purge_tombstoned_rows(workbook, images: Set[str]):
+    """
+    Drops every main-sheet and history row of the given images in one rewrite per sheet.
+    """
+    sheet = workbook.active
+    kept = [row for row in sheet.iter_rows(min_row=2, values_only=True) if row and row[0] not in images]
+    _rewrite_sheet(sheet, kept)
+    history_sheet = history_service.get_history_sheet(workbook, create=False)
+    if history_sheet is not None:
+        kept = [row for row in history_sheet.iter_rows(min_row=2, values_only=True) if row and row[0] not in images]
+        _rewrite_sheet(history_sheet, kept)
 
 def get_analyzed_images(folder_path: str) -> Set[str]:
     """
@@ -16,8 +157,13 @@ def get_analyzed_images(folder_path: str) -> Set[str]:
     if not os.path.exists(filepath):
         return analyzed_files
 
+    import import_service
+    stored = import_service.analyzed_images(folder_path)
+    if stored is not None:
+        return stored - set(load_tombstones(folder_path))
+
     try:
-        workbook = openpyxl.load_workbook(filepath, read_only=True)
+        workbook = _load_workbook(filepath, read_only=True)
         sheet = workbook.active
         # Assuming 'image_name' is the first column
         for row in sheet.iter_rows(min_row=2, values_only=True):
@@ -27,20 +173,21 @@ def get_analyzed_images(folder_path: str) -> Set[str]:
         # If the file is corrupt or unreadable, return an empty set
         return set()
 
-    return analyzed_files
+    return analyzed_files - set(load_tombstones(folder_path))
 
-def update_roi_notes(folder_path: str, image_name: str, selection_number: int, notes: str):
+@_writes_workbook
+def update_roi_notes(folder_path: str, image_name: str, selection_number: int, notes: str, page: int = 0):
     """
     Updates the notes for an existing ROI in-place without creating a new version row.
     This is for notes-only updates that don't change geometry.
     """
     filepath = os.path.join(folder_path, "roi_measurements.xlsx")
     
-    if not os.path.exists(filepath):
-        return  # No Excel file to update
+    if not os.path.exists(filepath) or image_name in load_tombstones(folder_path):
+        return  # No Excel file (or no live rows for this image) to update
     
     try:
-        workbook = openpyxl.load_workbook(filepath)
+        workbook = _load_workbook(filepath)
         sheet = workbook.active
         
         # Get header
@@ -62,10 +209,13 @@ def update_roi_notes(folder_path: str, image_name: str, selection_number: int, n
         # Find the latest version of this ROI for this image
         target_row = None
         target_version = 0
+        page_col = header_keys.index("page") if "page" in header_keys else None
         
         for row_idx, row in enumerate(sheet.iter_rows(min_row=2), start=2):
+            row_page = (row[page_col].value if page_col is not None and page_col < len(row) else None) or 0
             if (row[0].value == image_name and 
-                row[1].value == selection_number):
+                row[1].value == selection_number and
+                row_page == page):
                 # Keep track of the highest version
                 version = row[2].value or 1
                 if version > target_version:
@@ -75,7 +225,7 @@ def update_roi_notes(folder_path: str, image_name: str, selection_number: int, n
         # Update notes in the latest version row
         if target_row:
             sheet.cell(row=target_row, column=notes_col, value=notes)
-            workbook.save(filepath)
+            _save_synced(workbook, filepath, [target_row])
     
     except Exception as e:
         print(f"Warning: Could not update ROI notes: {e}")
@@ -85,24 +235,59 @@ def save_roi_to_excel(folder_path: str, data: Dict):
     Appends a new row with ROI data to the Excel file.
     Creates the file and header if it doesn't exist.
     """
+    save_rois_to_excel(folder_path, [data])
+
+def _roi_data_map(data: Dict) -> Dict:
+    return {
+        "image_name": data["image_name"],
+        "selection_number": data["selection_number"],
+        "version": data.get("version", 1),
+        "scale_px_per_um": data["scale_px_per_um"],
+        "scale_um": data.get("scale_um", 0),
+        "scale_bar_x1": data.get("scale_bar", {}).get("x1") if data.get("scale_bar") else None,
+        "scale_bar_y1": data.get("scale_bar", {}).get("y1") if data.get("scale_bar") else None,
+        "scale_bar_x2": data.get("scale_bar", {}).get("x2") if data.get("scale_bar") else None,
+        "scale_bar_y2": data.get("scale_bar", {}).get("y2") if data.get("scale_bar") else None,
+        "area_um2": data["area_um2"],
+        "area_px2": data["area_px2"],
+        "points_json": None,
+        "points_packed": geometry_service.encode_points(data.get("points", [])),
+        "notes": data.get("notes", ""),
+        "overlay_file": data["overlay_file"],
+        "updated_at": history_service.now_iso(),
+        "page": data.get("page") or 0,
+    }
+
+@_writes_workbook
+def save_rois_to_excel(folder_path: str, rois: List[Dict]):
+    """
+    Saves several ROIs (same fields as save_roi_to_excel) with a single
+    workbook load and save. Existing ROIs are updated in place with a history
+    entry, new ones are appended.
+    """
+    if not rois:
+        return
     filepath = os.path.join(folder_path, "roi_measurements.xlsx")
 
-    header = [
-        "image_name", "selection_number", "version", "scale_px_per_um",
-        "scale_um", "scale_bar_x1", "scale_bar_y1", "scale_bar_x2", "scale_bar_y2",
-        "area_um2", "area_px2", "points_json", "notes", "overlay_file"
-    ]
+    header = ROI_HEADER
 
     try:
         if not os.path.exists(filepath):
+            from openpyxl import Workbook
             workbook = Workbook()
             sheet = workbook.active
             sheet.append(header)
-            workbook.save(filepath)
+            _save_workbook(workbook, filepath)
 
-        workbook = openpyxl.load_workbook(filepath)
+        workbook = _load_workbook(filepath)
         sheet = workbook.active
 
+        # A new ROI for a deleted image: drop the old rows now, since the workbook is rewritten anyway
+        tombstones = load_tombstones(folder_path)
+        revived = {data["image_name"] for data in rois} & set(tombstones)
+        if revived:
+            _purge_tombstoned_rows(workbook, revived)
+
         # Ensure header has notes/overlay columns if file was created with an older schema.
         header_row = next(sheet.iter_rows(min_row=1, max_row=1), None)
         if header_row:
@@ -117,30 +302,55 @@ def save_roi_to_excel(folder_path: str, data: Dict):
                 headers.append("overlay_file")
                 for row_idx in range(2, sheet.max_row + 1):
                     sheet.cell(row=row_idx, column=len(headers), value="")
+            for column_name in _LATE_COLUMNS:
+                if column_name not in headers:
+                    # Older rows simply leave the new column empty
+                    sheet.cell(row=1, column=len(headers) + 1, value=column_name)
+                    headers.append(column_name)
 
         headers = [cell.value for cell in sheet[1]]
         header_keys = [str(name).strip().lower() if name else "" for name in headers]
-        data_map = {
-            "image_name": data["image_name"],
-            "selection_number": data["selection_number"],
-            "version": data.get("version", 1),
-            "scale_px_per_um": data["scale_px_per_um"],
-            "scale_um": data.get("scale_um", 0),
-            "scale_bar_x1": data.get("scale_bar", {}).get("x1") if data.get("scale_bar") else None,
-            "scale_bar_y1": data.get("scale_bar", {}).get("y1") if data.get("scale_bar") else None,
-            "scale_bar_x2": data.get("scale_bar", {}).get("x2") if data.get("scale_bar") else None,
-            "scale_bar_y2": data.get("scale_bar", {}).get("y2") if data.get("scale_bar") else None,
-            "area_um2": data["area_um2"],
-            "area_px2": data["area_px2"],
-            "points_json": json.dumps(data.get("points", [])),
-            "notes": data.get("notes", ""),
-            "overlay_file": data["overlay_file"],
-        }
-        # If modifying existing ROI, append a new row with incremented version (don't delete old rows)
-        # This creates a history of ROI modifications
-        row_to_add = [data_map.get(key, None) for key in header_keys]
-        sheet.append(row_to_add)
-        workbook.save(filepath)
+        image_col = header_keys.index("image_name") if "image_name" in header_keys else 0
+        selection_col = header_keys.index("selection_number") if "selection_number" in header_keys else 1
+        version_col = header_keys.index("version") if "version" in header_keys else 2
+        page_col = header_keys.index("page")
+
+        # If an ROI already exists, its current row is updated in place and a reverse
+        # delta is logged to the history sheet. With legacy append-only data there may
+        # be several rows; the highest version is the current one.
+        images = {data["image_name"] for data in rois}
+        current_rows = {}
+        for row in sheet.iter_rows(min_row=2):
+            if row[image_col].value not in images:
+                continue
+            roi_key = (row[image_col].value, row[selection_col].value, row[page_col].value or 0)
+            current = current_rows.get(roi_key)
+            if current is None or (row[version_col].value or 1) > (current[version_col].value or 1):
+                current_rows[roi_key] = row
+
+        changed_rows = set()
+        for data in rois:
+            data_map = _roi_data_map(data)
+            row_to_add = [data_map.get(key, None) for key in header_keys]
+            roi_key = (data_map["image_name"], data_map["selection_number"], data_map["page"])
+            current_cells = current_rows.get(roi_key)
+            if current_cells is None:
+                sheet.append(row_to_add)
+                current_rows[roi_key] = sheet[sheet.max_row]
+                changed_rows.add(sheet.max_row)
+            else:
+                old_row = {key: cell.value for key, cell in zip(header_keys, current_cells) if key}
+                history_service.append_history(workbook, old_row, data_map)
+                row_idx = current_cells[0].row
+                for col_idx, value in enumerate(row_to_add, start=1):
+                    sheet.cell(row=row_idx, column=col_idx, value=value)
+                changed_rows.add(row_idx)
+        # The purge moved rows, so the store then reloads the whole sheet
+        _save_synced(workbook, filepath, None if revived else changed_rows)
+        if revived:
+            for image_name in revived:
+                del tombstones[image_name]
+            _save_tombstones(folder_path, tombstones)
 
     except PermissionError:
         raise PermissionError("Could not write to Excel. Please close the file and try again.")
@@ -210,74 +420,79 @@ def load_scale_bar(folder_path: str, image_name: str) -> Dict:
     
     return {"scaleBar": None, "scaleUm": 0}
 
-def load_roi_data(folder_path: str, image_name: str) -> Dict:
+def _iter_image_rows(folder_path: str, filepath: str, image_name: str, page: int):
+    """
+    Yields the main-sheet rows of one page of an image as maps of the ROI_HEADER columns,
+    from the imported store (see import_service) when it is current, else from the workbook.
+    """
+    import import_service
+
+    stored_rows = import_service.read_rows(folder_path, image_name, page)
+    if stored_rows is not None:
+        yield from stored_rows
+        return
+
+    workbook = _load_workbook(filepath, read_only=True)
+    try:
+        sheet = workbook.active
+        header_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), None) or []
+        header_map = {str(name).strip().lower(): idx for idx, name in enumerate(header_row) if name}
+        indexes = {key: header_map.get(key, HEADER_FALLBACKS.get(key)) for key in ROI_HEADER}
+
+        for row in sheet.iter_rows(min_row=2, values_only=True):
+            row_map = {key: row[idx] if idx is not None and idx < len(row) else None for key, idx in indexes.items()}
+            if row_map["image_name"] == image_name and (row_map["page"] or 0) == page:
+                yield row_map
+    finally:
+        workbook.close()
+
+def load_roi_data(folder_path: str, image_name: str, points_format: str = "json", page: int = 0) -> Dict:
     """
-    Loads all ROI data for a specific image from the Excel file.
+    Loads all ROI data for one page of an image from the Excel file.
     Returns the latest version of each ROI.
     Also loads scale bar data from config if available.
+
+    points_format="json" returns "points" as a list of {"x", "y"} dicts;
+    "packed" returns "pointsPacked" in the uncompressed p1 format instead
+    (see geometry_service), which avoids building per-vertex dicts.
     """
     filepath = os.path.join(folder_path, "roi_measurements.xlsx")
     roi_data = {"rois": [], "scaleBar": None, "scaleUm": 0}
 
-    if not os.path.exists(filepath):
-        # No Excel file yet, try to load scale bar from config
+    if not os.path.exists(filepath) or image_name in load_tombstones(folder_path):
+        # No (live) ROI rows for this image, try to load scale bar from config
         config_data = load_scale_bar(folder_path, image_name)
         return {**roi_data, **config_data}
 
     try:
-        import json
-        workbook = openpyxl.load_workbook(filepath, read_only=True)
-        sheet = workbook.active
+        roi_dict = {}  # Key: selection_number, Value: latest version row
 
-        header_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), None) or []
-        header_map = {str(name).strip().lower(): idx for idx, name in enumerate(header_row) if name}
+        for row in _iter_image_rows(folder_path, filepath, image_name, page):
+            selection_number = row["selection_number"]
+            version = row["version"] or 1
+
+            # Keep only the latest version
+            if selection_number not in roi_dict or roi_dict[selection_number]["version"] < version:
+                roi_dict[selection_number] = {**row, "version": version, "notes": row["notes"] or ""}
 
-        def get_value(row, key, fallback_idx=None):
-            idx = header_map.get(key)
-            if idx is None:
-                idx = fallback_idx
-            if idx is None or idx >= len(row):
-                return None
-            return row[idx]
-        
-        roi_dict = {}  # Key: selection_number, Value: latest version row
-        
-        for row_idx, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-            if get_value(row, "image_name", 0) == image_name:
-                selection_number = get_value(row, "selection_number", 1)
-                version = get_value(row, "version", 2) or 1
-                
-                # Keep only the latest version
-                if selection_number not in roi_dict or roi_dict[selection_number]["version"] < version:
-                    roi_dict[selection_number] = {
-                        "version": version,
-                        "scale_px_per_um": get_value(row, "scale_px_per_um", 3),
-                        "scale_um": get_value(row, "scale_um", 4),
-                        "scale_bar_x1": get_value(row, "scale_bar_x1", 5),
-                        "scale_bar_y1": get_value(row, "scale_bar_y1", 6),
-                        "scale_bar_x2": get_value(row, "scale_bar_x2", 7),
-                        "scale_bar_y2": get_value(row, "scale_bar_y2", 8),
-                        "area_um2": get_value(row, "area_um2", 9),
-                        "area_px2": get_value(row, "area_px2", 10),
-                        "points_json": get_value(row, "points_json", 11),
-                        "notes": (get_value(row, "notes", None) if "notes" in header_map else "") or "",
-                    }
-        
         # Convert dict to list and parse points
         for roi_id, roi_data_row in roi_dict.items():
-            try:
-                points = json.loads(roi_data_row["points_json"]) if isinstance(roi_data_row["points_json"], str) else []
-            except:
-                points = []
-            
-            roi_data["rois"].append({
+            stored_points = roi_data_row["points_packed"] or roi_data_row["points_json"]
+            if not isinstance(stored_points, str):
+                stored_points = None
+
+            roi_entry = {
                 "id": roi_id,
                 "version": roi_data_row["version"],
-                "points": points,
                 "areaPx2": roi_data_row["area_px2"],
                 "areaUm2": roi_data_row["area_um2"],
                 "notes": roi_data_row.get("notes", ""),
-            })
+            }
+            if points_format == "packed":
+                roi_entry["pointsPacked"] = geometry_service.to_api_encoding(stored_points)
+            else:
+                roi_entry["points"] = geometry_service.array_to_points(geometry_service.decode_points(stored_points))
+            roi_data["rois"].append(roi_entry)
             
             # Set scale bar from first ROI (same for all ROIs in same image)
             if roi_data["scaleBar"] is None and roi_data_row["scale_bar_x1"] is not None:
@@ -307,41 +522,389 @@ def load_roi_data(folder_path: str, image_name: str) -> Dict:
 
     return roi_data
 
-def save_overlay_image(folder_path: str, image_name: str, selection_number: int, points: List[Dict], version: int = 1):
+def load_latest_roi_measurements(folder_path: str) -> Dict:
+    """
+    Reads the measurement columns of the latest version of every ROI in the folder.
+    Returns {(image_name, selection_number, page): {"area_um2", "area_px2", "scale_px_per_um"}}.
+    """
+    filepath = os.path.join(folder_path, "roi_measurements.xlsx")
+    latest = {}
+    if not os.path.exists(filepath):
+        return latest
+
+    columns = ("image_name", "selection_number", "version", "scale_px_per_um", "area_um2", "area_px2", "page")
+    workbook = None
+    try:
+        import import_service
+        stored_rows = import_service.read_rows(folder_path, columns=list(columns))
+        if stored_rows is not None:
+            rows = ([row[column] for column in columns] for row in stored_rows)
+        else:
+            workbook = _load_workbook(filepath, read_only=True)
+            sheet = workbook.active
+            header_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), None) or []
+            header_map = {str(name).strip().lower(): idx for idx, name in enumerate(header_row) if name}
+            indexes = [header_map.get(column, HEADER_FALLBACKS.get(column)) for column in columns]
+            width = max(idx or 0 for idx in indexes) + 1
+            rows = ([row[idx] if idx is not None else None for idx in indexes]
+                    for row in sheet.iter_rows(min_row=2, max_col=width, values_only=True) if row and len(row) >= width)
+
+        tombstones = load_tombstones(folder_path)
+        versions = {}
+        for image_name, selection_number, version, scale_px_per_um, area_um2, area_px2, page in rows:
+            if not image_name or image_name in tombstones:
+                continue
+            key = (image_name, selection_number, page or 0)
+            version = version or 1
+            if key in versions and versions[key] >= version:
+                continue
+            versions[key] = version
+            latest[key] = {
+                "area_um2": area_um2,
+                "area_px2": area_px2,
+                "scale_px_per_um": scale_px_per_um,
+            }
+    except Exception as e:
+        print(f"Error loading ROI measurements: {e}")
+        return {}
+    finally:
+        if workbook is not None:
+            workbook.close()
+
+    return latest
+
+def _read_roi_rows(sheet, image_name: str, selection_number: int = None, page: int = None):
+    """
+    Returns row maps (header key -> value) of the main sheet for an image (optionally one page and ROI).
+    """
+    header_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), None) or []
+    header_keys = [str(name).strip().lower() if name else "" for name in header_row]
+    rows = []
+    for row in sheet.iter_rows(min_row=2, values_only=True):
+        row_map = {key: value for key, value in zip(header_keys, row) if key}
+        if row_map.get("image_name") != image_name:
+            continue
+        if selection_number is not None and row_map.get("selection_number") != selection_number:
+            continue
+        if page is not None and (row_map.get("page") or 0) != page:
+            continue
+        rows.append(row_map)
+    return rows
+
+def list_roi_versions(folder_path: str, image_name: str, selection_number: int, page: int = 0) -> List[Dict]:
+    """
+    Lists the retained versions of one ROI, newest first.
+    """
+    filepath = os.path.join(folder_path, "roi_measurements.xlsx")
+    if not os.path.exists(filepath) or image_name in load_tombstones(folder_path):
+        return []
+
+    workbook = _load_workbook(filepath, read_only=True)
+    rows = _read_roi_rows(workbook.active, image_name, selection_number, page)
+    versions = [{"version": r.get("version") or 1, "saved_at": r.get("updated_at"), "current": False} for r in rows]
+    if versions:
+        max(versions, key=lambda v: v["version"])["current"] = True
+    for entry in history_service.read_history(workbook, image_name, selection_number, page):
+        versions.append({"version": entry["version"] or 1, "saved_at": entry["delta"].get("updated_at"), "current": False})
+    workbook.close()
+
+    unique = {}
+    for v in versions:
+        unique.setdefault(v["version"], v)
+    return sorted(unique.values(), key=lambda v: v["version"], reverse=True)
+
+def load_roi_version(folder_path: str, image_name: str, selection_number: int, version: int,
+                     page: int = 0) -> Dict:
+    """
+    Reconstructs one ROI "as of" a given version from the current row and the
+    reverse deltas on the history sheet. Returns None if the version is not retained.
+    """
+    filepath = os.path.join(folder_path, "roi_measurements.xlsx")
+    if not os.path.exists(filepath) or image_name in load_tombstones(folder_path):
+        return None
+
+    workbook = _load_workbook(filepath, read_only=True)
+    try:
+        rows = _read_roi_rows(workbook.active, image_name, selection_number, page)
+        if not rows:
+            return None
+        # Legacy append-only workbooks may still hold the exact version as its own row
+        row = next((r for r in rows if (r.get("version") or 1) == version), None)
+        if row is None:
+            current = max(rows, key=lambda r: r.get("version") or 1)
+            entries = history_service.read_history(workbook, image_name, selection_number, page)
+            row = history_service.reconstruct_version(current, entries, version)
+        if row is None:
+            return None
+    finally:
+        workbook.close()
+
+    points = geometry_service.decode_points(row.get("points_packed") or row.get("points_json"))
+    return {
+        "id": selection_number,
+        "page": page,
+        "version": row.get("version") or 1,
+        "points": geometry_service.array_to_points(points),
+        "areaPx2": row.get("area_px2"),
+        "areaUm2": row.get("area_um2"),
+        "notes": row.get("notes") or "",
+        "updatedAt": row.get("updated_at"),
+    }
+
+@_writes_workbook
+def compact_roi_history(folder_path: str, keep_last: int = None, max_age_days: float = None) -> Dict:
+    """
+    Applies the history compaction policy in a single rewrite of the workbook:
+    - legacy duplicate rows (one row per version) collapse into the current row
+      plus reverse deltas on the history sheet;
+    - history entries outside the newest keep_last per ROI, or older than
+      max_age_days, are dropped (either limit may be None).
+    Rows of images with a tombstone (deleted analyses) are removed as part of the same rewrite.
+    Returns before/after row counts.
+    """
+    filepath = os.path.join(folder_path, "roi_measurements.xlsx")
+    stats = {"rows_before": 0, "rows_after": 0, "history_before": 0, "history_after": 0}
+    if not os.path.exists(filepath):
+        return stats
+    tombstones = load_tombstones(folder_path)
+
+    try:
+        workbook = _load_workbook(filepath)
+        sheet = workbook.active
+        header_keys = [str(cell.value).strip().lower() if cell.value else "" for cell in sheet[1]]
+
+        # 1. Collapse legacy per-version rows into current rows + reverse deltas
+        groups = {}
+        order = []
+        for row in sheet.iter_rows(min_row=2, values_only=True):
+            stats["rows_before"] += 1
+            row_map = {key: value for key, value in zip(header_keys, row) if key}
+            if row_map.get("image_name") in tombstones:
+                continue
+            key = (row_map.get("image_name"), row_map.get("selection_number"), row_map.get("page") or 0)
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append((row, row_map))
+
+        history_sheet = history_service.get_history_sheet(workbook)
+        history_service.ensure_page_column(history_sheet)
+        migrated = []
+        current_rows = []
+        for key in order:
+            versions = sorted(groups[key], key=lambda item: item[1].get("version") or 1)
+            current_rows.append(versions[-1][0])
+            for (_, older), (_, newer) in zip(versions, versions[1:]):
+                migrated.append([
+                    key[0], key[1], older.get("version") or 1, newer.get("version") or 1,
+                    older.get("updated_at") or history_service.now_iso(),
+                    json.dumps(history_service.make_delta(older, newer), default=str),
+                    key[2],
+                ])
+        stats["rows_after"] = len(current_rows)
+
+        # 2. Apply the retention policy to all history entries
+        history_rows = [list(row) for row in history_sheet.iter_rows(min_row=2, values_only=True)]
+        stats["history_before"] = len(history_rows)
+        history_rows = [row for row in history_rows if row[0] not in tombstones] + migrated
+        entries_by_roi = {}
+        for row_id, row in enumerate(history_rows):
+            entries_by_roi.setdefault((row[0], row[1], history_service.entry_page(row)), []).append(
+                {"row_id": row_id, "version": row[2], "changed_at": row[4]})
+        if keep_last is None and max_age_days is None:
+            kept_ids = set(range(len(history_rows)))
+        else:
+            kept_ids = history_service.select_retained(entries_by_roi, keep_last, max_age_days)
+        kept_history = [row for row_id, row in enumerate(history_rows) if row_id in kept_ids]
+        stats["history_after"] = len(kept_history)
+
+        _rewrite_sheet(sheet, current_rows)
+        _rewrite_sheet(history_sheet, kept_history)
+        _save_synced(workbook, filepath)
+        if tombstones:
+            _save_tombstones(folder_path, {})
+    except PermissionError:
+        raise PermissionError("Could not write to Excel. Please close the file and try again.")
+    except Exception as e:
+        raise IOError(f"Failed to compact ROI history: {e}")
+
+    return stats
+
+# Overlay output modes: "crop" renders only the ROI bounding box plus a margin,
+# "svg" writes a vector polygon in image coordinates without touching pixels,
+# "full" redraws the whole image (opt-in export, O(image) cost).
+OVERLAY_MODES = ("crop", "svg", "full")
+DEFAULT_OVERLAY_MODE = os.environ.get("PORES_OVERLAY_MODE", "crop")
+OVERLAY_CROP_MARGIN = 64
+
+def _image_size(image_path: str):
+    """
+    Returns (width, height) of the image's planes from the file header, without decoding pixels.
+    """
+    return tiff_service.plane_size(image_path)
+
+def _read_image_region(image_path: str, x0: int, y0: int, x1: int, y1: int, page: int = 0):
+    """
+    Reads pixels [y0:y1, x0:x1] of one page.
+    Uncompressed TIFFs are memory-mapped so only the region is paged in;
+    compressed ones decode only that page (see tiff_service.read_plane).
+    """
+    return tiff_service.read_plane(image_path, page=page, region=(x0, y0, x1, y1))
+
+def _to_bgr8(region):
+    """
+    Converts a grayscale/RGB region of any bit depth to 8-bit BGR for drawing.
+    Non-8-bit data is contrast-stretched to the region's own min/max.
+    """
+    import cv2
+    import numpy as np
+
+    if region.dtype != np.uint8:
+        region = cv2.normalize(region, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    if region.ndim == 2:
+        return cv2.cvtColor(region, cv2.COLOR_GRAY2BGR)
+    if region.shape[2] == 4:
+        return cv2.cvtColor(region, cv2.COLOR_RGBA2BGR)
+    return cv2.cvtColor(region, cv2.COLOR_RGB2BGR)
+
+def _render_overlay_svg(output_path: str, image_path: str, label: str, points: List[Dict]):
+    """
+    Writes the polygon as an SVG sized to the image, so it can be composited over it.
+    """
+    width, height = _image_size(image_path)
+    coords = " ".join(f"{float(p['x']):.2f},{float(p['y']):.2f}" for p in points)
+    label_x = float(points[0]["x"]) if points else 0.0
+    label_y = max(float(points[0]["y"]) - 10, 12.0) if points else 12.0
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}">\n'
+        f'  <polygon points="{coords}" fill="none" stroke="#ff0000" stroke-width="2"/>\n'
+        f'  <text x="{label_x:.2f}" y="{label_y:.2f}" fill="#ff0000" font-family="sans-serif" '
+        f'font-size="20">{label}</text>\n'
+        f'</svg>\n'
+    )
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(svg)
+
+def save_overlay_image(folder_path: str, image_name: str, selection_number: int, points: List[Dict],
+                       version: int = 1, mode: str = None, page: int = 0):
     """
-    Draws the ROI polygon on the original image and saves it as a PNG.
-    Filename format: image_roinumber_vversion.png
+    Draws the ROI polygon and saves it in _roi_overlays.
+    Filename format: image_roinumber_vversion.png (crop/full) or .svg (svg);
+    ROIs on later pages of a stack get image_p<page>_roinumber_vversion.
+
+    "crop" (default) reads and writes only the polygon's bounding box plus
+    OVERLAY_CROP_MARGIN pixels; the crop's top-left corner is that box's
+    corner clipped to the image, so it can be recomputed from the stored points.
     """
+    mode = mode or DEFAULT_OVERLAY_MODE
+    if mode not in OVERLAY_MODES:
+        raise ValueError(f"Unknown overlay mode '{mode}'. Expected one of {', '.join(OVERLAY_MODES)}.")
+
     output_dir = os.path.join(folder_path, "_roi_overlays")
     os.makedirs(output_dir, exist_ok=True)
 
     original_image_path = os.path.join(folder_path, image_name)
     base_name, _ = os.path.splitext(image_name)
-    output_filename = f"{base_name}_{selection_number}_v{version}.png"
+    extension = "svg" if mode == "svg" else "png"
+    page_part = f"p{page}_" if page else ""
+    output_filename = f"{base_name}_{page_part}{selection_number}_v{version}.{extension}"
     output_path = os.path.join(output_dir, output_filename)
+    label = f"ROI {selection_number} v{version}"
 
-    try:
-        img = cv2.imread(original_image_path)
-        if img is None:
-            raise IOError("Could not read original image.")
+    import cv2
+    import numpy as np
 
-        # Convert points to the format cv2.polylines needs
-        pts = np.array([[p['x'], p['y']] for p in points], np.int32)
-        pts = pts.reshape((-1, 1, 2))
+    try:
+        # A full overlay holds the plane, its 8-bit BGR copy (3 bytes a pixel) and the PNG being written
+        footprint = memory_service.estimate(original_image_path, copies=4) if mode == "full" else 0
+        with memory_service.admit(footprint, "overlay"), metrics_service.stage("overlay_render", mode=mode) as info:
+            if mode == "svg":
+                _render_overlay_svg(output_path, original_image_path, label, points)
+                info["bytes_out"] = os.path.getsize(output_path)
+                return output_filename
+
+            # Convert points to the format cv2.polylines needs
+            pts = np.array([[p['x'], p['y']] for p in points], np.int32)
+            if len(pts) == 0:
+                raise ValueError("ROI has no points.")
+
+            if mode == "crop":
+                width, height = _image_size(original_image_path)
+                x0 = max(int(pts[:, 0].min()) - OVERLAY_CROP_MARGIN, 0)
+                y0 = max(int(pts[:, 1].min()) - OVERLAY_CROP_MARGIN, 0)
+                x1 = min(int(pts[:, 0].max()) + OVERLAY_CROP_MARGIN + 1, width)
+                y1 = min(int(pts[:, 1].max()) + OVERLAY_CROP_MARGIN + 1, height)
+                if x1 <= x0 or y1 <= y0:
+                    raise ValueError("ROI lies outside the image.")
+                region = _read_image_region(original_image_path, x0, y0, x1, y1, page)
+                info["bytes_in"] = region.nbytes
+                img = _to_bgr8(region)
+                pts = pts - np.array([x0, y0], np.int32)
+            else:
+                img = _to_bgr8(tiff_service.read_plane(original_image_path, page=page))
+                info["bytes_in"] = img.nbytes
+
+            pts = pts.reshape((-1, 1, 2))
+
+            # Draw the polygon
+            cv2.polylines(img, [pts], isClosed=True, color=(0, 0, 255), thickness=2)
+
+            # Add a label with version
+            label_pos = (int(pts[0][0][0]), max(int(pts[0][0][1]) - 10, 20))
+            cv2.putText(img, label, label_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
+
+            cv2.imwrite(output_path, img)
+            info["bytes_out"] = os.path.getsize(output_path)
+        return output_filename
 
-        # Draw the polygon
-        cv2.polylines(img, [pts], isClosed=True, color=(0, 0, 255), thickness=2)
+    except Exception as e:
+        raise IOError(f"Failed to save overlay image: {e}")
 
-        # Add a label with version
-        label = f"ROI {selection_number} v{version}"
-        label_pos = (pts[0][0][0], pts[0][0][1] - 10)
-        cv2.putText(img, label, label_pos, cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
+@_writes_workbook
+def update_overlay_files(folder_path: str, overlay_files: Dict) -> int:
+    """
+    Points the current rows of ROIs at regenerated overlay files:
+    {(image_name, selection_number, page): overlay_filename}. Returns the number of rows changed.
+    """
+    filepath = os.path.join(folder_path, "roi_measurements.xlsx")
+    if not overlay_files or not os.path.exists(filepath):
+        return 0
 
-        cv2.imwrite(output_path, img)
-        return output_filename
+    try:
+        workbook = _load_workbook(filepath)
+        sheet = workbook.active
+        header_keys = [str(cell.value).strip().lower() if cell.value else "" for cell in sheet[1]]
+        image_col = header_keys.index("image_name") if "image_name" in header_keys else 0
+        selection_col = header_keys.index("selection_number") if "selection_number" in header_keys else 1
+        version_col = header_keys.index("version") if "version" in header_keys else 2
+        overlay_col = header_keys.index("overlay_file")
+        page_col = header_keys.index("page") if "page" in header_keys else None
+
+        # Only the current (highest) version of each ROI points at the new file
+        current_rows = {}
+        for row in sheet.iter_rows(min_row=2):
+            roi_key = (row[image_col].value, row[selection_col].value,
+                       (row[page_col].value if page_col is not None else None) or 0)
+            if roi_key not in overlay_files:
+                continue
+            current = current_rows.get(roi_key)
+            if current is None or (row[version_col].value or 1) > (current[version_col].value or 1):
+                current_rows[roi_key] = row
+
+        changed_rows = []
+        for roi_key, row in current_rows.items():
+            if row[overlay_col].value != overlay_files[roi_key]:
+                row[overlay_col].value = overlay_files[roi_key]
+                changed_rows.append(row[overlay_col].row)
+        if changed_rows:
+            _save_synced(workbook, filepath, changed_rows)
+        return len(changed_rows)
 
+    except PermissionError:
+        raise PermissionError("Could not write to Excel. Please close the file and try again.")
     except Exception as e:
-        raise IOError(f"Failed to save overlay image: {e}")
+        raise IOError(f"Failed to write to Excel file: {e}")
 
 def save_notes(folder_path: str, image_name: str, notes: str):
     """
@@ -384,46 +947,28 @@ def load_notes(folder_path: str, image_name: str) -> str:
         print(f"Warning: Could not load notes: {e}")
         return ""
 
-def delete_image_analysis(folder_path: str, image_name: str):
+@_writes_workbook
+def delete_image_analysis(folder_path: str, image_name: str) -> float:
     """
     Deletes all ROI data for a specific image:
-    - Removes all rows from the Excel file for that image
-    - Deletes all overlay images for that image
+    - Records a tombstone so its Excel rows are hidden (they are physically
+      removed by the next save for that image or by compaction)
     - Removes scale bar config for that image
+    Overlay images are left to delete_overlay_files, which callers run in the background.
+    Returns the deletion time (epoch seconds) to pass to delete_overlay_files.
     """
-    # Delete from Excel
+    import time
+
+    deleted_at = time.time()
     excel_path = os.path.join(folder_path, "roi_measurements.xlsx")
     if os.path.exists(excel_path):
         try:
-            workbook = openpyxl.load_workbook(excel_path)
-            sheet = workbook.active
-            
-            # Find and delete all rows for this image (iterate backwards to avoid index issues)
-            rows_to_delete = []
-            for row_idx, row in enumerate(sheet.iter_rows(min_row=2), start=2):
-                if row[0].value == image_name:
-                    rows_to_delete.append(row_idx)
-            
-            # Delete rows in reverse order
-            for row_idx in reversed(rows_to_delete):
-                sheet.delete_rows(row_idx, 1)
-            
-            workbook.save(excel_path)
+            tombstones = load_tombstones(folder_path)
+            tombstones[image_name] = history_service.now_iso()
+            _save_tombstones(folder_path, tombstones)
         except Exception as e:
             raise IOError(f"Failed to delete Excel data: {e}")
-    
-    # Delete overlay images
-    overlay_dir = os.path.join(folder_path, "_roi_overlays")
-    if os.path.exists(overlay_dir):
-        try:
-            base_name = os.path.splitext(image_name)[0]
-            for filename in os.listdir(overlay_dir):
-                if filename.startswith(base_name + "_") and filename.endswith(".png"):
-                    file_path = os.path.join(overlay_dir, filename)
-                    os.remove(file_path)
-        except Exception as e:
-            raise IOError(f"Failed to delete overlay images: {e}")
-    
+
     # Delete scale bar config for this image
     config_file = os.path.join(folder_path, ".pore_analyzer_config.json")
     if os.path.exists(config_file):
@@ -440,3 +985,28 @@ def delete_image_analysis(folder_path: str, image_name: str):
                     json.dump(config, f, indent=2)
         except Exception as e:
             print(f"Warning: Could not delete scale bar config: {e}")
+
+    return deleted_at
+
+def delete_overlay_files(folder_path: str, image_name: str, older_than: float = None) -> int:
+    """
+    Deletes the overlay images of an image. With older_than (epoch seconds), files
+    written after that moment (overlays of ROIs saved since the deletion) are kept.
+    """
+    overlay_dir = os.path.join(folder_path, "_roi_overlays")
+    if not os.path.exists(overlay_dir):
+        return 0
+
+    removed = 0
+    base_name = os.path.splitext(image_name)[0]
+    for filename in os.listdir(overlay_dir):
+        if filename.startswith(base_name + "_") and filename.endswith((".png", ".svg")):
+            file_path = os.path.join(overlay_dir, filename)
+            try:
+                if older_than is not None and os.path.getmtime(file_path) > older_than:
+                    continue
+                os.remove(file_path)
+                removed += 1
+            except OSError as e:
+                print(f"Warning: Could not delete overlay {filename}: {e}")
+    return removed
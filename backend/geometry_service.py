@@ -0,0 +1,296 @@
+import base64
+import json
+import zlib
+from typing import Dict, List, Union
+
+# Packed polygon text format (safe for an Excel cell and a JSON string):
+#
+#     p1:<dtype><flags>:<base64 little-endian payload>
+#
+# dtype "i" = int32 pairs, "f" = float32 pairs.
+# flags: "d" = rows after the first are deltas from the previous vertex,
+#        "z" = payload is zlib-compressed.
+# Integer polygons (the common case for traced pores) are stored as int32 deltas,
+# which zlib shrinks well; anything with fractional coordinates is kept as float32.
+PACKED_PREFIX = "p1:"
+
+def points_to_array(points):
+    """
+    Converts [{"x":..,"y":..}, ...] (or an (N, 2) array) to an (N, 2) float64 array.
+    """
+    import numpy as np
+
+    if isinstance(points, np.ndarray):
+        return points.reshape(-1, 2).astype(np.float64, copy=False)
+    if not points:
+        return np.zeros((0, 2), dtype=np.float64)
+    return np.array([(p["x"], p["y"]) for p in points], dtype=np.float64)
+
+def array_to_points(arr) -> List[Dict[str, float]]:
+    """
+    Converts an (N, 2) array back to the JSON point-list form.
+    """
+    return [{"x": x, "y": y} for x, y in arr.tolist()]
+
+def encode_points(points, compress: bool = True) -> str:
+    """
+    Packs a polygon into the p1 text format.
+    compress=False skips zlib (used for API payloads, which HTTP compression covers).
+    """
+    import numpy as np
+
+    arr = points_to_array(points)
+    rounded = np.rint(arr)
+    if arr.size and np.all(np.abs(arr - rounded) < 1e-6) and np.all(np.abs(rounded) < 2 ** 31):
+        packed = rounded.astype("<i4")
+        packed[1:] = np.diff(packed, axis=0)
+        dtype, flags = "i", "d"
+    else:
+        packed = arr.astype("<f4")
+        dtype, flags = "f", ""
+
+    payload = packed.tobytes()
+    if compress and payload:
+        compressed = zlib.compress(payload, 6)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags += "z"
+
+    return f"{PACKED_PREFIX}{dtype}{flags}:{base64.b64encode(payload).decode('ascii')}"
+
+def decode_points(text: Union[str, bytes, None]):
+    """
+    Decodes a p1 packed string, or a legacy points_json string, into an (N, 2) float64 array.
+    Returns an empty array for None, empty or unparseable input.
+    """
+    import numpy as np
+
+    empty = np.zeros((0, 2), dtype=np.float64)
+    if not text:
+        return empty
+    if isinstance(text, bytes):
+        text = text.decode("ascii")
+
+    if not text.startswith(PACKED_PREFIX):
+        try:
+            return points_to_array(json.loads(text))
+        except (ValueError, TypeError, KeyError):
+            return empty
+
+    try:
+        spec, payload_b64 = text[len(PACKED_PREFIX):].split(":", 1)
+        payload = base64.b64decode(payload_b64)
+        if "z" in spec:
+            payload = zlib.decompress(payload)
+        arr = np.frombuffer(payload, dtype="<i4" if spec[0] == "i" else "<f4").reshape(-1, 2)
+        if "d" in spec:
+            arr = np.cumsum(arr, axis=0, dtype=np.int64)
+        return arr.astype(np.float64)
+    except (ValueError, zlib.error, IndexError):
+        return empty
+
+def to_api_encoding(text: Union[str, None]) -> str:
+    """
+    Re-encodes stored points (packed or legacy JSON) as uncompressed p1 for API responses.
+    """
+    if text and text.startswith(PACKED_PREFIX) and "z" not in text[len(PACKED_PREFIX):].split(":", 1)[0]:
+        return text
+    return encode_points(decode_points(text), compress=False)
+
+# ---------------------------------------------------------------------------
+# Ingest: de-duplication, simplification and validity checks
+# ---------------------------------------------------------------------------
+
+# Default Douglas-Peucker tolerance in image pixels (0 disables simplification)
+DEFAULT_SIMPLIFY_TOLERANCE = 0.5
+# Simplification is undone if it moves the polygon area by more than this fraction
+DEFAULT_MAX_AREA_ERROR = 0.005
+
+def polygon_area(arr) -> float:
+    """
+    Absolute shoelace area of an (N, 2) array in px².
+    """
+    import numpy as np
+
+    if len(arr) < 3:
+        return 0.0
+    x, y = arr[:, 0], arr[:, 1]
+    return abs(0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+
+def remove_duplicate_vertices(arr):
+    """
+    Drops vertices equal to their predecessor, including a closing copy of the first vertex.
+    """
+    import numpy as np
+
+    if len(arr) < 2:
+        return arr
+    keep = np.any(arr != np.roll(arr, 1, axis=0), axis=1)
+    if not keep.any():
+        return arr[:1]
+    return arr[keep]
+
+def _douglas_peucker(chain, tolerance: float):
+    """
+    Douglas-Peucker on an open chain; distances for each segment are computed in one numpy pass.
+    Returns a boolean keep-mask.
+    """
+    import numpy as np
+
+    keep = np.zeros(len(chain), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(chain) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = chain[start], chain[end]
+        inner = chain[start + 1:end]
+        ab = b - a
+        length = np.hypot(ab[0], ab[1])
+        if length == 0:
+            dist = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            dist = np.abs(ab[0] * (inner[:, 1] - a[1]) - ab[1] * (inner[:, 0] - a[0])) / length
+        idx = int(np.argmax(dist))
+        if dist[idx] > tolerance:
+            split = start + 1 + idx
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+def simplify_polygon(arr, tolerance: float):
+    """
+    Simplifies a closed polygon with Douglas-Peucker. The ring is split at its first
+    vertex and the vertex farthest from it, and both chains are simplified.
+    """
+    import numpy as np
+
+    if tolerance <= 0 or len(arr) <= 4:
+        return arr
+    far = int(np.argmax(np.hypot(arr[:, 0] - arr[0, 0], arr[:, 1] - arr[0, 1])))
+    if far == 0:
+        return arr
+    first = arr[:far + 1]
+    second = np.vstack([arr[far:], arr[:1]])
+    keep = np.concatenate([_douglas_peucker(first, tolerance)[:-1], _douglas_peucker(second, tolerance)[:-1]])
+    simplified = arr[keep]
+    # The split vertex is always kept by the chains; drop it too if it lies on the line between its neighbours
+    if len(simplified) > 3:
+        prev, cur, nxt = simplified[-1], simplified[0], simplified[1]
+        ab = nxt - prev
+        length = np.hypot(ab[0], ab[1])
+        if length and abs(ab[0] * (cur[1] - prev[1]) - ab[1] * (cur[0] - prev[0])) / length <= tolerance:
+            simplified = simplified[1:]
+    return simplified if len(simplified) >= 3 else arr
+
+def find_self_intersections(arr, chunk: int = 512) -> List[tuple]:
+    """
+    Returns (i, j) index pairs of non-adjacent edges that cross, where edge k runs
+    from vertex k to vertex k+1 (wrapping). All pairs are tested with vectorized
+    orientation tests, in row chunks to bound memory.
+    """
+    import numpy as np
+
+    n = len(arr)
+    if n < 4:
+        return []
+    p, q = arr, np.roll(arr, -1, axis=0)
+
+    def orient(a, b, c):
+        return np.sign((b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0]))
+
+    pairs = []
+    cols = np.arange(n)
+    for start in range(0, n, chunk):
+        rows = np.arange(start, min(start + chunk, n))
+        p1, q1 = p[rows][:, None, :], q[rows][:, None, :]
+        p2, q2 = p[None, :, :], q[None, :, :]
+        crosses = (orient(p1, q1, p2) * orient(p1, q1, q2) < 0) & (orient(p2, q2, p1) * orient(p2, q2, q1) < 0)
+        # Each pair once, skipping neighbouring edges (they share a vertex)
+        valid = cols[None, :] > rows[:, None] + 1
+        valid &= ~((rows[:, None] == 0) & (cols[None, :] == n - 1))
+        for i, j in zip(*np.nonzero(crosses & valid)):
+            pairs.append((int(rows[i]), int(j)))
+    return pairs
+
+def repair_polygon(arr, tolerance: float):
+    """
+    Replaces a self-intersecting polygon by the outer boundary of its filled area,
+    traced on a raster of the polygon's bounding box.
+    """
+    import cv2
+    import numpy as np
+
+    origin = np.floor(arr.min(axis=0)) - 1
+    shifted = np.rint(arr - origin).astype(np.int32)
+    width, height = shifted.max(axis=0) + 2
+    mask = np.zeros((int(height), int(width)), np.uint8)
+    cv2.fillPoly(mask, [shifted], 1)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return arr
+    outline = max(contours, key=cv2.contourArea).reshape(-1, 2).astype(np.float64) + origin
+    return simplify_polygon(outline, tolerance) if len(outline) >= 3 else arr
+
+def load_ingest_settings(folder_path: str) -> Dict:
+    """
+    Reads the ingest settings: {"simplify_tolerance", "max_area_error", "repair"}.
+    The "geometry" entry of .pore_analyzer_config.json wins over the
+    PORES_SIMPLIFY_TOLERANCE / PORES_MAX_AREA_ERROR / PORES_REPAIR_POLYGONS environment variables.
+    """
+    import os
+
+    settings = {
+        "simplify_tolerance": float(os.environ.get("PORES_SIMPLIFY_TOLERANCE", DEFAULT_SIMPLIFY_TOLERANCE)),
+        "max_area_error": float(os.environ.get("PORES_MAX_AREA_ERROR", DEFAULT_MAX_AREA_ERROR)),
+        "repair": os.environ.get("PORES_REPAIR_POLYGONS", "0").lower() in ("1", "true", "yes"),
+    }
+    config_file = os.path.join(folder_path, ".pore_analyzer_config.json")
+    if os.path.exists(config_file):
+        try:
+            with open(config_file, 'r') as f:
+                config = json.load(f)
+            settings.update({k: v for k, v in config.get("geometry", {}).items() if k in settings})
+        except Exception as e:
+            print(f"Warning: Could not load geometry settings: {e}")
+    return settings
+
+def prepare_polygon(points, simplify_tolerance: float = DEFAULT_SIMPLIFY_TOLERANCE,
+                    max_area_error: float = DEFAULT_MAX_AREA_ERROR, repair: bool = False):
+    """
+    Ingest stage for a traced ROI: removes duplicate vertices, simplifies within
+    simplify_tolerance pixels and checks for self-intersections (repairing them if asked).
+    Returns (array, report); the report gives vertex counts and the area error introduced.
+    If simplification changes the area by more than max_area_error (relative), the
+    de-duplicated polygon is kept instead.
+    """
+    original = points_to_array(points)
+    area_before = polygon_area(original)
+    deduped = remove_duplicate_vertices(original)
+
+    result = simplify_polygon(deduped, simplify_tolerance)
+    if area_before and abs(polygon_area(result) - area_before) / area_before > max_area_error:
+        result = deduped
+
+    intersections = find_self_intersections(result)
+    repaired = False
+    if intersections and repair:
+        result = repair_polygon(result, simplify_tolerance)
+        repaired = True
+        intersections = find_self_intersections(result)
+
+    area_after = polygon_area(result)
+    report = {
+        "vertices_before": int(len(original)),
+        "vertices_after": int(len(result)),
+        "duplicates_removed": int(len(original) - len(deduped)),
+        "area_before_px2": round(area_before, 3),
+        "area_after_px2": round(area_after, 3),
+        "area_error_px2": round(area_after - area_before, 3),
+        "area_error_ratio": round((area_after - area_before) / area_before, 6) if area_before else 0.0,
+        "self_intersections": len(intersections),
+        "repaired": repaired,
+    }
+    return result, report
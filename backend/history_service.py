@@ -0,0 +1,215 @@
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import geometry_service
+
+# roi_measurements.xlsx keeps one row per ROI (the current state) on the first
+# sheet. Every modification appends a reverse delta to this sheet: the values
+# the changed columns had *before* the edit. Walking the deltas backwards from
+# the current row reconstructs any retained version.
+HISTORY_SHEET = "roi_history"
+HISTORY_HEADER = ["image_name", "selection_number", "version", "replaced_by_version", "changed_at", "delta_json", "page"]
+
+# Columns that never change between versions of the same ROI
+_KEY_COLUMNS = ("image_name", "selection_number", "page")
+
+def now_iso() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+def get_history_sheet(workbook, create: bool = True):
+    """
+    Returns the history worksheet, creating it (without changing the active sheet) if asked.
+    """
+    if HISTORY_SHEET in workbook.sheetnames:
+        return workbook[HISTORY_SHEET]
+    if not create:
+        return None
+    sheet = workbook.create_sheet(HISTORY_SHEET)
+    sheet.append(HISTORY_HEADER)
+    return sheet
+
+def ensure_page_column(sheet):
+    """
+    Adds the "page" header to history sheets created before per-page ROIs (older entries are page 0).
+    """
+    if sheet.max_column < len(HISTORY_HEADER) or sheet.cell(row=1, column=len(HISTORY_HEADER)).value != "page":
+        sheet.cell(row=1, column=len(HISTORY_HEADER), value="page")
+
+def entry_page(row) -> int:
+    """
+    Page of a history sheet row (values tuple); rows written before per-page ROIs are page 0.
+    """
+    return (row[6] if len(row) > 6 else None) or 0
+
+def make_delta(old_row: Dict, new_row: Dict) -> Dict:
+    """
+    Builds the reverse delta that turns new_row back into old_row.
+
+    Geometry is stored compactly: when both versions have the same vertex
+    count the per-vertex difference is packed (mostly zeros after small edits,
+    which zlib collapses), otherwise the previous packed polygon is kept.
+    """
+    delta = {}
+    for key, old_value in old_row.items():
+        if key in _KEY_COLUMNS or key in ("points_packed", "points_json", "updated_at"):
+            continue
+        if new_row.get(key) != old_value:
+            delta[key] = old_value
+
+    old_points = old_row.get("points_packed") or old_row.get("points_json")
+    new_points = new_row.get("points_packed") or new_row.get("points_json")
+    if old_points != new_points:
+        old_arr = geometry_service.decode_points(old_points)
+        new_arr = geometry_service.decode_points(new_points)
+        if len(old_arr) and old_arr.shape == new_arr.shape:
+            delta["points_diff"] = geometry_service.encode_points(old_arr - new_arr)
+        else:
+            delta["points_packed"] = geometry_service.encode_points(old_arr)
+    if old_row.get("updated_at"):
+        delta["updated_at"] = old_row["updated_at"]
+    return delta
+
+def apply_delta(row: Dict, delta: Dict) -> Dict:
+    """
+    Applies a reverse delta to a row map and returns the previous version's row map.
+    """
+    previous = dict(row)
+    for key, value in delta.items():
+        if key == "points_diff":
+            current = geometry_service.decode_points(row.get("points_packed") or row.get("points_json"))
+            diff = geometry_service.decode_points(value)
+            previous["points_packed"] = geometry_service.encode_points(current + diff)
+            previous["points_json"] = None
+        elif key == "points_packed":
+            previous["points_packed"] = value
+            previous["points_json"] = None
+        else:
+            previous[key] = value
+    return previous
+
+def append_history(workbook, old_row: Dict, new_row: Dict):
+    """
+    Records the reverse delta for replacing old_row with new_row.
+    """
+    sheet = get_history_sheet(workbook)
+    ensure_page_column(sheet)
+    sheet.append([
+        old_row.get("image_name"),
+        old_row.get("selection_number"),
+        old_row.get("version") or 1,
+        new_row.get("version") or 1,
+        now_iso(),
+        json.dumps(make_delta(old_row, new_row), default=str),
+        old_row.get("page") or 0,
+    ])
+
+def read_history(workbook, image_name: str, selection_number: Optional[int] = None,
+                 page: Optional[int] = None) -> List[Dict]:
+    """
+    Returns the history entries for an image (optionally one page and ROI), newest first.
+    """
+    sheet = get_history_sheet(workbook, create=False)
+    if sheet is None:
+        return []
+    entries = []
+    for row in sheet.iter_rows(min_row=2, values_only=True):
+        if not row or row[0] != image_name:
+            continue
+        if selection_number is not None and row[1] != selection_number:
+            continue
+        if page is not None and entry_page(row) != page:
+            continue
+        try:
+            delta = json.loads(row[5]) if row[5] else {}
+        except ValueError:
+            delta = {}
+        entries.append({
+            "selection_number": row[1],
+            "page": entry_page(row),
+            "version": row[2],
+            "replaced_by_version": row[3],
+            "changed_at": row[4],
+            "delta": delta,
+        })
+    entries.sort(key=lambda e: (e["version"] or 0), reverse=True)
+    return entries
+
+def reconstruct_version(current_row: Dict, entries: List[Dict], version: int) -> Optional[Dict]:
+    """
+    Rebuilds the row map of `version` from the current row and its newest-first entries.
+    Returns None if that version was never stored or has been compacted away.
+    """
+    row = current_row
+    if (row.get("version") or 1) == version:
+        return row
+    for entry in entries:
+        if (entry["version"] or 1) < version:
+            break
+        row = apply_delta(row, entry["delta"])
+        row["version"] = entry["version"]
+        if (entry["version"] or 1) == version:
+            return row
+    return None
+
+# ---------------------------------------------------------------------------
+# Compaction policy
+# ---------------------------------------------------------------------------
+
+def load_policy(folder_path: str) -> Dict:
+    """
+    Reads the compaction policy: {"keep_last": N or None, "max_age_days": T or None}.
+    The "history" entry of .pore_analyzer_config.json wins over the
+    PORES_HISTORY_KEEP_LAST / PORES_HISTORY_MAX_AGE_DAYS environment variables.
+    """
+    policy = {
+        "keep_last": int(os.environ["PORES_HISTORY_KEEP_LAST"]) if os.environ.get("PORES_HISTORY_KEEP_LAST") else None,
+        "max_age_days": float(os.environ["PORES_HISTORY_MAX_AGE_DAYS"]) if os.environ.get("PORES_HISTORY_MAX_AGE_DAYS") else None,
+    }
+    config_file = os.path.join(folder_path, ".pore_analyzer_config.json")
+    if os.path.exists(config_file):
+        try:
+            with open(config_file, 'r') as f:
+                config = json.load(f)
+            policy.update({k: v for k, v in config.get("history", {}).items() if k in policy})
+        except Exception as e:
+            print(f"Warning: Could not load history policy: {e}")
+    return policy
+
+def save_policy(folder_path: str, keep_last: Optional[int], max_age_days: Optional[float]):
+    """
+    Persists the compaction policy next to the scale bar config.
+    """
+    config_file = os.path.join(folder_path, ".pore_analyzer_config.json")
+    config = {}
+    if os.path.exists(config_file):
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+    config["history"] = {"keep_last": keep_last, "max_age_days": max_age_days}
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=2)
+
+def select_retained(entries_by_roi: Dict, keep_last: Optional[int], max_age_days: Optional[float]):
+    """
+    Applies the policy to {roi_key: [{"row_id", "version", "changed_at"}, ...]}, where
+    row_id is any hashable id of the history row and version is the version the entry
+    restores, and returns the set of row ids to keep. An entry survives only if it is
+    within the keep_last highest versions of its ROI and newer than max_age_days (each
+    when set); an entry whose changed_at is not an ISO timestamp is not aged out.
+    """
+    cutoff = datetime.now() - timedelta(days=max_age_days) if max_age_days is not None else None
+    keep = set()
+    for entries in entries_by_roi.values():
+        entries = sorted(entries, key=lambda e: e["version"] or 0, reverse=True)
+        for rank, entry in enumerate(entries):
+            if keep_last is not None and rank >= keep_last:
+                break
+            if cutoff is not None:
+                try:
+                    if datetime.fromisoformat(str(entry["changed_at"])) < cutoff:
+                        break
+                except ValueError:
+                    pass
+            keep.add(entry["row_id"])
+    return keep
@@ -0,0 +1,482 @@
+"""
+Streaming import of roi_measurements.xlsx into an indexed SQLite store.
+
+Large legacy workbooks are slow to open with openpyxl, even read-only. This
+module streams the ROI sheet's XML straight from the xlsx archive (shared
+strings, inline strings and typed numbers), maps the
+columns with the same header names and legacy fallback positions as
+file_service.load_roi_data, and bulk-loads the rows into
+.pore_analyzer_rois.sqlite3 next to the workbook, indexed by image, page and
+ROI.
+
+The store records the size and mtime of the workbook it was built from.
+Readers (load_roi_data, load_latest_roi_measurements, get_analyzed_images)
+use it only while the workbook matches. The app's own writers in file_service
+keep it matching: after each save they upsert the rows they changed (or reload
+every row after a rewrite such as a tombstone purge or compaction) and
+re-stamp the signature, under the same lock as the save, which costs far less
+than re-importing. Edits made outside the app (e.g. in Excel) make the store
+stale, and readers fall back to the workbook until the next import.
+
+    python import_service.py <folder>
+"""
+import argparse
+import datetime
+import os
+import re
+import sqlite3
+import sys
+import time
+import zipfile
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from xml.etree import ElementTree
+
+import metrics_service
+
+STORE_FILE = ".pore_analyzer_rois.sqlite3"
+BATCH_ROWS = 5000
+CHUNK_BYTES = 4 * 1024 * 1024
+
+_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PACKAGE_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_XMLNS = re.compile(rb'xmlns(?::\w+)?="[^"]*"')
+
+
+def _store_path(folder_path: str) -> str:
+    return os.path.join(folder_path, STORE_FILE)
+
+
+def _signature(path: str):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+# ---------------------------------------------------------------------------
+# Sheet XML
+# ---------------------------------------------------------------------------
+
+class _CountingReader:
+    """
+    File wrapper that counts the (uncompressed) bytes read, for progress reporting.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def _first_sheet_path(archive: zipfile.ZipFile) -> str:
+    """
+    Archive path of the workbook's active sheet (the one openpyxl's workbook.active returns).
+    """
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    view = workbook.find(f"{_MAIN_NS}bookViews/{_MAIN_NS}workbookView")
+    active = int(view.get("activeTab", 0)) if view is not None else 0
+    sheets = workbook.findall(f"{_MAIN_NS}sheets/{_MAIN_NS}sheet")
+    if not sheets:
+        raise ValueError("Workbook has no sheets.")
+    rel_id = sheets[min(active, len(sheets) - 1)].get(f"{_REL_NS}id")
+
+    rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels.iter(f"{_PACKAGE_REL_NS}Relationship"):
+        if rel.get("Id") == rel_id:
+            target = rel.get("Target")
+            return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+    raise ValueError(f"Sheet relationship {rel_id} not found.")
+
+
+def _iter_children(stream, parent: bytes, child_end: bytes) -> Iterator:
+    """
+    Yields the child elements of the first <parent> element of an XML stream without
+    building the whole document. The stream is read CHUNK_BYTES at a time and split
+    after the last complete child (child_end); each run of children is parsed by the
+    C tree builder on its own, wrapped in the parent tag with the document's namespace
+    declarations. This avoids iterparse's per-event Python overhead, which dominates
+    on sheets with millions of cells.
+    """
+    buffer = b""
+    opening = None
+    closing = b"</" + parent + b">"
+    eof = False
+    while not eof:
+        data = stream.read(CHUNK_BYTES)
+        eof = not data
+        buffer += data
+        if opening is None:
+            start = buffer.find(b"<" + parent)
+            close = buffer.find(b">", start) if start >= 0 else -1
+            if close < 0:
+                continue
+            opening = b"<" + parent + b" " + b" ".join(_XMLNS.findall(buffer[:close])) + b">"
+            if buffer[close - 1:close] == b"/":
+                return
+            buffer = buffer[close + 1:]
+
+        if eof:
+            end = buffer.find(b"</" + parent)
+            part, buffer = (buffer[:end] if end >= 0 else buffer), b""
+        else:
+            end = buffer.rfind(child_end)
+            if end < 0:
+                continue
+            end += len(child_end)
+            part, buffer = buffer[:end], buffer[end:]
+        if part.strip():
+            yield from ElementTree.fromstring(opening + part + closing)
+
+
+def _shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    with archive.open("xl/sharedStrings.xml") as f:
+        return [_string_item_text(item) for item in _iter_children(f, b"sst", b"</si>")]
+
+
+def _string_item_text(item) -> str:
+    # Plain <t> or rich-text runs <r><t>; phonetic hints (<rPh>) are not part of the value
+    parts = []
+    for child in item:
+        if child.tag == f"{_MAIN_NS}t":
+            parts.append(child.text or "")
+        elif child.tag == f"{_MAIN_NS}r":
+            parts.extend(t.text or "" for t in child.iter(f"{_MAIN_NS}t"))
+    return "".join(parts)
+
+
+def _column_index(ref: str, cache: Dict[str, int]) -> int:
+    letters = ref.rstrip("0123456789")
+    index = cache.get(letters)
+    if index is None:
+        index = 0
+        for letter in letters:
+            index = index * 26 + ord(letter) - 64
+        index -= 1
+        cache[letters] = index
+    return index
+
+
+def _number(text: str):
+    # Same types openpyxl returns: int for integral values written without a decimal part
+    if "." in text or "E" in text or "e" in text:
+        return float(text)
+    return int(text)
+
+
+def iter_sheet_rows(filepath: str, progress: Optional[Callable[[int, int], None]] = None) -> Iterator[List]:
+    """
+    Yields the rows of the workbook's active sheet as lists of cell values (None for
+    empty cells), header row first, streaming the sheet XML.
+    progress(bytes_read, bytes_total) is called every BATCH_ROWS rows with the
+    uncompressed sheet XML position.
+    """
+    with zipfile.ZipFile(filepath) as archive:
+        strings = _shared_strings(archive)
+        sheet_path = _first_sheet_path(archive)
+        total = archive.getinfo(sheet_path).file_size
+        columns: Dict[str, int] = {}
+        value_tag, inline_tag = f"{_MAIN_NS}v", f"{_MAIN_NS}is"
+
+        with archive.open(sheet_path) as raw:
+            reader = _CountingReader(raw)
+            count = 0
+            for row in _iter_children(reader, b"sheetData", b"</row>"):
+                values: List = []
+                for cell in row:
+                    ref = cell.get("r")
+                    index = _column_index(ref, columns) if ref else len(values)
+                    kind = cell.get("t")
+                    if kind == "inlineStr":
+                        inline = cell.find(inline_tag)
+                        value = _string_item_text(inline) if inline is not None else None
+                    else:
+                        v = cell.find(value_tag)
+                        text = v.text if v is not None else None
+                        if text is None:
+                            value = None
+                        elif kind == "s":
+                            value = strings[int(text)]
+                        elif kind in ("str", "e"):
+                            value = text
+                        elif kind == "b":
+                            value = text == "1"
+                        else:
+                            value = _number(text)
+                    if index >= len(values):
+                        values.extend([None] * (index - len(values) + 1))
+                    values[index] = value
+                yield values
+
+                count += 1
+                if progress and count % BATCH_ROWS == 0:
+                    progress(reader.bytes_read, total)
+            if progress:
+                progress(total, total)
+
+
+# ---------------------------------------------------------------------------
+# Store
+# ---------------------------------------------------------------------------
+
+def _schema(columns: List[str]) -> str:
+    return (
+        "CREATE TABLE rois (position INTEGER PRIMARY KEY, "
+        + ", ".join(columns)
+        + ");\nCREATE TABLE meta (key TEXT PRIMARY KEY, value);"
+    )
+
+
+def _column_indexes(header: List, columns: List[str]) -> List[Optional[int]]:
+    """
+    Sheet index of each store column: header names first, then the positions
+    older workbooks used (as in load_roi_data).
+    """
+    import file_service
+
+    header_map = {str(name).strip().lower(): idx for idx, name in enumerate(header) if name}
+    return [header_map.get(column, file_service.HEADER_FALLBACKS.get(column)) for column in columns]
+
+
+def _store_values(row, indexes: List[Optional[int]], page_position: int) -> Optional[List]:
+    """
+    Store column values of one sheet row, or None for a row without an image name.
+    """
+    values = [row[i] if i is not None and i < len(row) else None for i in indexes]
+    if not values[0]:
+        return None
+    # Rows written before the page column existed belong to page 0
+    values[page_position] = values[page_position] or 0
+    return values
+
+
+def import_workbook(folder_path: str, progress: Optional[Callable[[int, int, int], None]] = None) -> Dict:
+    """
+    Rebuilds the store from the folder's roi_measurements.xlsx.
+    progress(rows, bytes_read, bytes_total) is called as the sheet is read.
+    The store is written to a temporary file and moved into place when complete.
+    Returns {"rows", "images", "seconds", "store"}.
+    """
+    import file_service
+
+    filepath = os.path.join(folder_path, "roi_measurements.xlsx")
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"No roi_measurements.xlsx in {folder_path}")
+
+    start = time.time()
+    signature = _signature(filepath)
+    columns = list(file_service.ROI_HEADER)
+    store_path = _store_path(folder_path)
+    temp_path = store_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    rows_done = 0
+
+    def report(bytes_read, bytes_total):
+        if progress:
+            progress(rows_done + len(batch), bytes_read, bytes_total)
+
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.executescript(_schema(columns))
+        insert = (f"INSERT INTO rois (position, {', '.join(columns)}) "
+                  f"VALUES ({', '.join('?' * (len(columns) + 1))})")
+
+        batch = []
+        with metrics_service.stage("workbook_import", bytes_in=signature[0]) as info:
+            rows = iter_sheet_rows(filepath, progress=report)
+            indexes = _column_indexes(next(rows, None) or [], columns)
+            page_position = columns.index("page")
+
+            for position, row in enumerate(rows, start=1):
+                values = _store_values(row, indexes, page_position)
+                if values is None:
+                    continue
+                batch.append([position] + values)
+                if len(batch) >= BATCH_ROWS:
+                    connection.executemany(insert, batch)
+                    rows_done += len(batch)
+                    batch = []
+            if batch:
+                connection.executemany(insert, batch)
+                rows_done += len(batch)
+            info["rows"] = rows_done
+
+        with metrics_service.stage("store_index", rows=rows_done):
+            connection.execute("CREATE INDEX rois_image ON rois (image_name, page, selection_number, version)")
+        images = connection.execute("SELECT COUNT(DISTINCT image_name) FROM rois").fetchone()[0]
+        connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+            ("source_size", signature[0]),
+            ("source_mtime_ns", signature[1]),
+            ("rows", rows_done),
+            ("imported_at", time.time()),
+        ])
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temp_path, store_path)
+    return {"rows": rows_done, "images": images, "seconds": round(time.time() - start, 2), "store": store_path}
+
+
+def _open_current(folder_path: str) -> Optional[sqlite3.Connection]:
+    """
+    Read-only connection to the store if it was built from the current workbook, else None.
+    """
+    store_path = _store_path(folder_path)
+    filepath = os.path.join(folder_path, "roi_measurements.xlsx")
+    if not os.path.exists(store_path) or not os.path.exists(filepath):
+        return None
+    try:
+        connection = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True)
+        connection.row_factory = sqlite3.Row
+        meta = dict(connection.execute("SELECT key, value FROM meta").fetchall())
+    except sqlite3.Error as e:
+        print(f"Warning: Could not open ROI store: {e}")
+        return None
+    if (meta.get("source_size"), meta.get("source_mtime_ns")) != _signature(filepath):
+        connection.close()
+        return None
+    return connection
+
+
+def read_rows(folder_path: str, image_name: Optional[str] = None, page: Optional[int] = None,
+              columns: Optional[List[str]] = None) -> Optional[List[Dict]]:
+    """
+    Row maps (column -> value, sheet order) from the store, optionally for one image
+    and page; None when there is no store for the current workbook.
+    """
+    connection = _open_current(folder_path)
+    if connection is None:
+        return None
+    try:
+        clauses, params = [], []
+        if image_name is not None:
+            clauses.append("image_name = ?")
+            params.append(image_name)
+        if page is not None:
+            clauses.append("page = ?")
+            params.append(page)
+        query = f"SELECT {', '.join(columns) if columns else '*'} FROM rois"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        with metrics_service.stage("store_read") as info:
+            rows = [dict(row) for row in connection.execute(query + " ORDER BY position", params)]
+            info["rows"] = len(rows)
+        return rows
+    finally:
+        connection.close()
+
+
+def analyzed_images(folder_path: str) -> Optional[set]:
+    """
+    Image names with at least one row in the store; None when the store is not current.
+    """
+    connection = _open_current(folder_path)
+    if connection is None:
+        return None
+    try:
+        return {row[0] for row in connection.execute("SELECT DISTINCT image_name FROM rois")}
+    finally:
+        connection.close()
+
+
+def is_current(folder_path: str) -> bool:
+    """
+    Whether the store exists and matches the current workbook.
+    """
+    connection = _open_current(folder_path)
+    if connection is None:
+        return False
+    connection.close()
+    return True
+
+
+def update_store(folder_path: str, header: List, rows: Iterable, replace: bool = False) -> bool:
+    """
+    Applies a save of the workbook to a store that was current before it, and stamps
+    the store with the saved workbook's signature so readers keep using it.
+    rows are (sheet row number, values) pairs of the changed rows, or of every data row
+    with replace=True (after a rewrite, which moves rows). Callers hold the folder's
+    workbook lock and check is_current before saving. Returns False, leaving the store
+    stale, if it could not be updated.
+    """
+    import file_service
+
+    filepath = os.path.join(folder_path, "roi_measurements.xlsx")
+    columns = list(file_service.ROI_HEADER)
+    indexes = _column_indexes(header, columns)
+    page_position = columns.index("page")
+    insert = (f"INSERT OR REPLACE INTO rois (position, {', '.join(columns)}) "
+              f"VALUES ({', '.join('?' * (len(columns) + 1))})")
+    try:
+        connection = sqlite3.connect(_store_path(folder_path))
+        try:
+            with metrics_service.stage("store_update", replace=replace) as info:
+                if replace:
+                    connection.execute("DELETE FROM rois")
+                changed = 0
+                for row_number, row in rows:
+                    # Positions count data rows from 1, as in import_workbook
+                    position = row_number - 1
+                    values = _store_values(row, indexes, page_position)
+                    if values is None:
+                        connection.execute("DELETE FROM rois WHERE position = ?", (position,))
+                        continue
+                    # As the saved cells read back: empty strings are not written, dates as text
+                    values = [None if value == "" else
+                              value.isoformat() if isinstance(value, (datetime.date, datetime.time)) else value
+                              for value in values]
+                    connection.execute(insert, [position] + values)
+                    changed += 1
+                info["rows"] = changed
+                signature = _signature(filepath)
+                total = connection.execute("SELECT COUNT(*) FROM rois").fetchone()[0]
+                connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                    ("source_size", signature[0]),
+                    ("source_mtime_ns", signature[1]),
+                    ("rows", total),
+                    ("updated_at", time.time()),
+                ])
+                connection.commit()
+        finally:
+            connection.close()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Warning: Could not update ROI store: {e}")
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pores-import",
+                                     description="Import roi_measurements.xlsx into the indexed ROI store.")
+    parser.add_argument("folder", help="Folder containing roi_measurements.xlsx")
+    args = parser.parse_args(argv)
+
+    interactive = sys.stderr.isatty()
+
+    def progress(rows, bytes_read, bytes_total):
+        percent = 100 * bytes_read / bytes_total if bytes_total else 100
+        line = f"Importing: {percent:5.1f}% ({rows} rows)"
+        print(f"\r{line}" if interactive else line, end="" if interactive else "\n", file=sys.stderr, flush=True)
+
+    try:
+        summary = import_workbook(args.folder, progress=progress)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        print(f"\nError: {e}" if interactive else f"Error: {e}", file=sys.stderr)
+        return 1
+    if interactive:
+        print(file=sys.stderr)
+    print(f"Imported {summary['rows']} row(s) of {summary['images']} image(s) in {summary['seconds']} s "
+          f"into {summary['store']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import memory_service
+import metrics_service
+import tiff_service
+
+# Per-plane intensity statistics and contrast windowing.
+#
+# Statistics (min/max, mean/std, percentiles and a 256-bin histogram) are
+# computed once per plane from a subsample of about SAMPLE_PIXELS pixels and
+# kept in .pore_analyzer_stats.json next to the images, keyed by the file's
+# size and mtime. An 8-bit view is then one lookup-table application: the LUT
+# for a (window, gamma) is built once and indexed by the raw 8/16-bit values,
+# and the last decoded planes are kept so that adjusting contrast does not
+# decode the file again.
+
+STATS_FILE = ".pore_analyzer_stats.json"
+SAMPLE_PIXELS = 1_000_000
+PERCENTILES = (0.1, 0.5, 1, 2, 5, 25, 50, 75, 95, 98, 99, 99.5, 99.9)
+HISTOGRAM_BINS = 256
+
+# Percentiles used for an automatic window
+AUTO_WINDOW = (1, 99)
+
+# Decoded planes kept for repeated windowing of the same plane. They count against
+# memory_service's budget while cached; larger planes are not kept at all.
+PLANE_CACHE_SIZE = 2
+PLANE_CACHE_MAX_BYTES = int(float(os.environ.get("PORES_PLANE_CACHE_MAX_MB",
+                                                 str(memory_service.BUDGET_BYTES / 4 / 1048576))) * 1048576)
+
+_lock = threading.Lock()
+_folders: Dict[str, Dict] = {}
+_planes: "OrderedDict[Tuple, object]" = OrderedDict()
+
+
+def _signature(image_path: str):
+    stat = os.stat(image_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _plane_id(page: int, series: int, channel: Optional[int]) -> str:
+    return f"{series}:{page}:{'' if channel is None else channel}"
+
+
+def _load_folder_stats(folder_path: str) -> Dict:
+    # Called with _lock held
+    if folder_path not in _folders:
+        stats_file = os.path.join(folder_path, STATS_FILE)
+        data = {}
+        if os.path.exists(stats_file):
+            try:
+                with open(stats_file, 'r') as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Warning: Could not load intensity statistics: {e}")
+        _folders[folder_path] = data
+    return _folders[folder_path]
+
+
+def _save_folder_stats(folder_path: str):
+    # Called with _lock held
+    stats_file = os.path.join(folder_path, STATS_FILE)
+    try:
+        with open(stats_file, 'w') as f:
+            json.dump(_folders[folder_path], f)
+    except OSError as e:
+        print(f"Warning: Could not save intensity statistics: {e}")
+
+
+def compute_stats(image_path: str, page: int = 0, series: int = 0, channel: Optional[int] = None) -> Dict:
+    """
+    Intensity statistics of one plane from a regular subsample of about SAMPLE_PIXELS pixels.
+    8/16-bit data is counted exactly per value, so its percentiles are exact for the subsample.
+    """
+    import numpy as np
+
+    width, height = tiff_service.plane_size(image_path, series)
+    step = max(1, math.ceil(math.sqrt(width * height / SAMPLE_PIXELS)))
+    with memory_service.admit(memory_service.estimate(image_path, series, step, copies=2), "statistics"):
+        with metrics_service.stage("intensity_stats", step=step) as info:
+            sample = tiff_service.read_plane(image_path, page=page, series=series, channel=channel, step=step)
+            values = sample.ravel()
+            if values.dtype.kind == "f":
+                values = values[np.isfinite(values)]
+            if values.size == 0:
+                raise ValueError("Plane has no finite values.")
+            info["bytes_in"] = sample.nbytes
+
+            if values.dtype in (np.uint8, np.uint16):
+                counts = np.bincount(values, minlength=256 if values.dtype == np.uint8 else 0)
+                cumulative = np.cumsum(counts)
+                low, high = int(values.min()), int(values.max())
+                percentiles = [int(np.searchsorted(cumulative, p / 100 * values.size)) for p in PERCENTILES]
+            else:
+                low, high = float(values.min()), float(values.max())
+                percentiles = [float(v) for v in np.percentile(values, PERCENTILES)]
+            histogram, edges = np.histogram(values, bins=HISTOGRAM_BINS, range=(low, high if high > low else low + 1))
+
+    return {
+        "dtype": str(sample.dtype),
+        "width": width,
+        "height": height,
+        "step": step,
+        "samples": int(values.size),
+        "min": low,
+        "max": high,
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "percentiles": {str(p): v for p, v in zip(PERCENTILES, percentiles)},
+        "histogram": {"counts": histogram.tolist(), "edges": [float(e) for e in edges]},
+    }
+
+
+def get_stats(image_path: str, page: int = 0, series: int = 0, channel: Optional[int] = None) -> Dict:
+    """
+    Cached compute_stats; recomputed when the image file changes.
+    """
+    folder_path, image_name = os.path.split(image_path)
+    signature = _signature(image_path)
+    plane_id = _plane_id(page, series, channel)
+    with _lock:
+        entry = _load_folder_stats(folder_path).get(image_name)
+        cached = entry["planes"].get(plane_id) if entry and entry.get("signature") == signature else None
+    metrics_service.record_cache("intensity_stats", cached is not None)
+    if cached is not None:
+        return cached
+
+    stats = compute_stats(image_path, page, series, channel)
+    with _lock:
+        folder_stats = _load_folder_stats(folder_path)
+        entry = folder_stats.get(image_name)
+        if not entry or entry.get("signature") != signature:
+            entry = folder_stats[image_name] = {"signature": signature, "planes": {}}
+        entry["planes"][plane_id] = stats
+        _save_folder_stats(folder_path)
+    return stats
+
+
+def resolve_window(stats: Dict, low: Optional[float] = None, high: Optional[float] = None,
+                   window: Optional[float] = None, level: Optional[float] = None,
+                   auto: bool = False) -> Tuple[float, float]:
+    """
+    Picks the display range: explicit low/high, else window (width) and level (centre),
+    else the AUTO_WINDOW percentiles with auto=True, else the plane's min..max.
+    Missing ends are taken from the default range.
+    """
+    if auto:
+        default_low, default_high = (stats["percentiles"][str(p)] for p in AUTO_WINDOW)
+    else:
+        default_low, default_high = stats["min"], stats["max"]
+    if window is not None or level is not None:
+        width = window if window is not None else default_high - default_low
+        centre = level if level is not None else (default_low + default_high) / 2
+        default_low, default_high = centre - width / 2, centre + width / 2
+    return (low if low is not None else default_low), (high if high is not None else default_high)
+
+
+@lru_cache(maxsize=64)
+def build_lut(levels: int, low: float, high: float, gamma: float = 1.0):
+    """
+    uint8 lookup table over raw values 0..levels-1: linear from low (0) to high (255),
+    clipped, then raised to 1/gamma (gamma > 1 brightens the mid-tones).
+    """
+    import numpy as np
+
+    values = np.arange(levels, dtype=np.float64)
+    if high > low:
+        scaled = np.clip((values - low) / (high - low), 0.0, 1.0)
+    else:
+        scaled = (values > low).astype(np.float64)
+    if gamma != 1.0:
+        scaled = scaled ** (1.0 / gamma)
+    lut = np.round(scaled * 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def apply_window(plane, low: float, high: float, gamma: float = 1.0):
+    """
+    Maps a plane to uint8 through the window. 8/16-bit data goes through a cached LUT;
+    other dtypes are scaled block by block (still without scanning for a range).
+    """
+    import numpy as np
+
+    if plane.dtype in (np.uint8, np.uint16):
+        levels = 256 if plane.dtype == np.uint8 else 65536
+        return build_lut(levels, float(low), float(high), float(gamma))[plane]
+    return tiff_service.stretch_to_uint8(plane, low, high, gamma)
+
+
+def read_plane_cached(image_path: str, page: int = 0, series: int = 0, channel: Optional[int] = None):
+    """
+    tiff_service.read_plane, keeping the last PLANE_CACHE_SIZE planes of at most
+    PLANE_CACHE_MAX_BYTES decoded.
+    """
+    key = (image_path, tuple(_signature(image_path)), page, series, channel)
+    with _lock:
+        plane = _planes.get(key)
+        if plane is not None:
+            _planes.move_to_end(key)
+    metrics_service.record_cache("decoded_plane", plane is not None)
+    if plane is not None:
+        return plane
+    plane = tiff_service.read_plane(image_path, page=page, series=series, channel=channel)
+    plane.flags.writeable = False
+    if plane.nbytes > PLANE_CACHE_MAX_BYTES:
+        return plane
+    memory_service.retain(plane.nbytes)
+    with _lock:
+        evicted = [_planes.pop(key)] if key in _planes else []
+        _planes[key] = plane
+        while len(_planes) > PLANE_CACHE_SIZE:
+            evicted.append(_planes.popitem(last=False)[1])
+    for dropped in evicted:
+        memory_service.release(dropped.nbytes)
+    return plane
+
+
+def render_view(image_path: str, page: int = 0, series: int = 0, channel: Optional[int] = None,
+                low: Optional[float] = None, high: Optional[float] = None, window: Optional[float] = None,
+                level: Optional[float] = None, auto: bool = False, gamma: float = 1.0):
+    """
+    8-bit windowed view of one plane. Returns (uint8 array, (low, high)).
+    """
+    stats = get_stats(image_path, page, series, channel)
+    window_range = resolve_window(stats, low, high, window, level, auto)
+    with memory_service.admit(memory_service.estimate(image_path, series, copies=1), "view"):
+        plane = read_plane_cached(image_path, page, series, channel)
+        with metrics_service.stage("window_lut", bytes_in=plane.nbytes) as info:
+            view = apply_window(plane, window_range[0], window_range[1], gamma)
+            info["bytes_out"] = view.nbytes
+    return view, window_range
+
@@ -0,0 +1,569 @@
+"""
+Persistent background jobs.
+
+Jobs live in a SQLite database (PORES_JOBS_DB, by default
+~/.pore_analyzer/jobs.sqlite3) so they survive a server restart. A job is
+split into items (usually one per image) when it first runs; each item's
+outcome is recorded as soon as its result has been saved, so a job that is
+interrupted resumes with the items that are still pending.
+
+One job runs at a time, highest priority first (then oldest). Its items run
+in parallel on a worker process pool (PORES_JOB_WORKERS processes), or on
+threads for kinds that fill the server's in-memory caches. Results are
+written back to the workbook from the server process only, a few items at a
+time.
+
+Cancelling a job stops it from starting further items; items already running
+finish and are kept. A job whose items failed is run again (failed items
+only) up to max_attempts times, each retry waiting twice as long as the one
+before (RETRY_DELAY_S, then 2x, 4x, ... up to RETRY_MAX_DELAY_S) so that a
+missing file or a locked workbook has time to be fixed; afterwards it can be
+retried by hand, which runs it at once.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import metrics_service
+
+DB_PATH = os.environ.get("PORES_JOBS_DB") or os.path.join(os.path.expanduser("~"), ".pore_analyzer", "jobs.sqlite3")
+WORKERS = int(os.environ.get("PORES_JOB_WORKERS") or max(1, (os.cpu_count() or 2) - 1))
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINAL_STATUSES = ("succeeded", "failed", "cancelled")
+DEFAULT_MAX_ATTEMPTS = 2
+RETRY_DELAY_S = float(os.environ.get("PORES_JOB_RETRY_DELAY_S", "30"))
+RETRY_MAX_DELAY_S = 3600.0
+
+# Finished items are saved (workbook write + item status) in groups of this many,
+# or after this many seconds, whichever comes first
+FLUSH_EVERY = 10
+FLUSH_SECONDS = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 1,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    total_items INTEGER,
+    error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    not_before REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, id);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    result TEXT,
+    error TEXT,
+    finished_at REAL,
+    PRIMARY KEY (job_id, item)
+);
+"""
+
+_state = {"started": False, "db_path": None, "process_pool": None, "thread_pool": None}
+_lock = threading.Lock()
+_wake = threading.Event()
+
+
+@contextmanager
+def _db():
+    connection = sqlite3.connect(_state["db_path"] or DB_PATH, timeout=30)
+    connection.row_factory = sqlite3.Row
+    try:
+        yield connection
+        connection.commit()
+    finally:
+        connection.close()
+
+
+# ---------------------------------------------------------------------------
+# Job kinds
+#
+# Each kind has default params, prepare(folder, params) -> [(item, payload)],
+# run(folder, item, payload, params) -> result (in a worker), an optional
+# commit(folder, [(item, payload, result)], params) that saves results from the
+# server process, an optional finish(folder, params) -> job result, and
+# in_process=True to run items on threads of the server process.
+# ---------------------------------------------------------------------------
+
+def _prepare_analyze(folder_path: str, params: Dict):
+    import batch_service
+    import file_service
+
+    # Hand-drawn ROIs are never overwritten: segmentation only runs on images without any
+    analyzed = file_service.get_analyzed_images(folder_path) if params["segment"] else set()
+    return [(name, {"segment": params["segment"] and name not in analyzed}) for name in batch_service.list_images(folder_path)]
+
+
+def _run_analyze(folder_path: str, image_name: str, payload: Dict, params: Dict):
+    import batch_service
+    return batch_service.analyze_image(folder_path, image_name, dict(params, **payload))
+
+
+def _commit_analyze(folder_path: str, finished: List, params: Dict):
+    import batch_service
+    batch_service.save_results(folder_path, [result for _, _, result in finished])
+
+
+def _prepare_overlays(folder_path: str, params: Dict):
+    import export_service
+
+    items = []
+    for image_name, rows in sorted(export_service.read_rows_by_image(folder_path, history=False).items()):
+        items.append((image_name, [
+            {"selection_number": r.get("selection_number"), "page": r.get("page") or 0, "version": r.get("version") or 1,
+             "points": r.get("points_packed") or r.get("points_json")}
+            for r in rows
+        ]))
+    return items
+
+
+def _run_overlays(folder_path: str, image_name: str, payload: List[Dict], params: Dict):
+    import file_service
+    import geometry_service
+
+    written = []
+    for roi in payload:
+        points = geometry_service.array_to_points(geometry_service.decode_points(roi["points"]))
+        overlay_file = file_service.save_overlay_image(
+            folder_path, image_name, roi["selection_number"], points, roi["version"], params["mode"], roi["page"]
+        )
+        written.append([roi["selection_number"], roi["page"], overlay_file])
+    return written
+
+
+def _commit_overlays(folder_path: str, finished: List, params: Dict):
+    import file_service
+
+    file_service.update_overlay_files(folder_path, {
+        (image_name, selection_number, page): overlay_file
+        for image_name, _, result in finished for selection_number, page, overlay_file in result
+    })
+
+
+def _run_export(folder_path: str, item: str, payload, params: Dict):
+    import export_service
+
+    extension = "parquet" if params["format"] == "parquet" else "arrow"
+    output = params["output"] or os.path.join(folder_path, f"roi_measurements.{extension}")
+    rows = export_service.export_to_path(folder_path, output, params["format"], params["history"], params["partition"])
+    return {"output": output, "rows": rows}
+
+
+def _run_import(folder_path: str, item: str, payload, params: Dict):
+    import import_service
+    return import_service.import_workbook(folder_path)
+
+
+def _run_warm_caches(folder_path: str, image_name: str, payload, params: Dict):
+    import spatial_service
+    return {"rois": len(spatial_service.get_index(folder_path, image_name).polygons)}
+
+
+def _finish_warm_caches(folder_path: str, params: Dict):
+    import analytics_service
+    analytics = analytics_service.compute_analytics(folder_path)
+    return {"images": analytics["images"], "rois": analytics["count"]}
+
+
+def _list_images(folder_path: str, params: Dict):
+    import batch_service
+    return [(name, None) for name in batch_service.list_images(folder_path)]
+
+
+def _validate_export(params: Dict):
+    import export_service
+    if params["format"] not in export_service.EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(export_service.EXPORT_FORMATS)}.")
+
+
+def _validate_overlays(params: Dict):
+    import file_service
+    if params["mode"] not in file_service.OVERLAY_MODES:
+        raise ValueError(f"mode must be one of {', '.join(file_service.OVERLAY_MODES)}.")
+
+
+def _analyze_defaults():
+    import batch_service
+    return dict(batch_service.DEFAULT_OPTIONS)
+
+
+JOB_KINDS = {
+    # Scale-bar detection (and optionally segmentation) on every image of the folder
+    "analyze": {
+        "defaults": _analyze_defaults, "prepare": _prepare_analyze, "run": _run_analyze, "commit": _commit_analyze,
+    },
+    # Re-render the overlay of the current version of every ROI
+    "overlays": {
+        "defaults": lambda: {"mode": "crop"}, "validate": _validate_overlays,
+        "prepare": _prepare_overlays, "run": _run_overlays, "commit": _commit_overlays,
+    },
+    # Parquet/Arrow export to a file (next to the workbook unless "output" is given)
+    "export": {
+        "defaults": lambda: {"format": "parquet", "history": False, "partition": False, "output": None},
+        "validate": _validate_export, "prepare": lambda folder, params: [("export", None)], "run": _run_export,
+    },
+    # Stream roi_measurements.xlsx into the indexed ROI store (see import_service)
+    "import": {
+        "defaults": dict, "prepare": lambda folder, params: [("import", None)], "run": _run_import,
+    },
+    # Build the ROI spatial indexes and analytics of the folder in the server's memory
+    "warm_caches": {
+        "defaults": dict, "prepare": _list_images, "run": _run_warm_caches, "finish": _finish_warm_caches,
+        "in_process": True,
+    },
+}
+
+
+# ---------------------------------------------------------------------------
+# Queue
+# ---------------------------------------------------------------------------
+
+def start(db_path: Optional[str] = None):
+    """
+    Opens the job database and starts the dispatcher thread (once). Jobs that
+    were running when the server stopped are queued again.
+    """
+    with _lock:
+        if _state["started"]:
+            return
+        _state["db_path"] = db_path or DB_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(_state["db_path"])), exist_ok=True)
+        with _db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            # Databases created before automatic retries were delayed
+            if "not_before" not in {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}:
+                db.execute("ALTER TABLE jobs ADD COLUMN not_before REAL")
+            # An interrupted run does not count as an attempt
+            db.execute("UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0) WHERE status = 'running'")
+        _state["started"] = True
+    threading.Thread(target=_dispatch_loop, name="jobs-dispatcher", daemon=True).start()
+    _wake.set()
+
+
+def submit(kind: str, folder_path: str, params: Optional[Dict] = None, priority: int = 0,
+           max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+    """
+    Queues a job and returns its id. Raises ValueError for an unknown kind or parameter.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind '{kind}'. Expected one of {', '.join(JOB_KINDS)}.")
+    spec = JOB_KINDS[kind]
+    merged = spec["defaults"]()
+    unknown = set(params or {}) - set(merged)
+    if unknown:
+        raise ValueError(f"Unknown parameter(s) for {kind}: {', '.join(sorted(unknown))}.")
+    merged.update(params or {})
+    if spec.get("validate"):
+        spec["validate"](merged)
+
+    start()
+    with _db() as db:
+        cursor = db.execute(
+            "INSERT INTO jobs (kind, folder, params, status, priority, max_attempts, created_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (kind, folder_path, json.dumps(merged), priority, max(1, max_attempts), time.time()),
+        )
+        job_id = cursor.lastrowid
+    _update_queue_depth()
+    _wake.set()
+    return job_id
+
+
+def _job_dict(row, counts: Dict) -> Dict:
+    total = row["total_items"]
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "folder": row["folder"],
+        "params": json.loads(row["params"]),
+        "status": row["status"],
+        "priority": row["priority"],
+        "attempts": row["attempts"],
+        "max_attempts": row["max_attempts"],
+        "cancel_requested": bool(row["cancel_requested"]),
+        "progress": {
+            "total": total,
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0),
+            "fraction": round(counts.get("done", 0) / total, 4) if total else (1.0 if row["status"] == "succeeded" else 0.0),
+        },
+        "error": row["error"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+        "not_before": row["not_before"],
+    }
+
+
+def _item_counts(db, job_id: int) -> Dict:
+    return {r["status"]: r["n"] for r in db.execute(
+        "SELECT status, COUNT(*) AS n FROM job_items WHERE job_id = ? GROUP BY status", (job_id,))}
+
+
+def get_job(job_id: int, items: bool = False) -> Optional[Dict]:
+    """
+    Returns a job with its progress (and with items=True, every item's status), or None.
+    """
+    start()
+    with _db() as db:
+        row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = _job_dict(row, _item_counts(db, job_id))
+        if items:
+            job["items"] = [
+                {"item": r["item"], "status": r["status"], "error": r["error"],
+                 "result": json.loads(r["result"]) if r["result"] else None}
+                for r in db.execute("SELECT item, status, error, result FROM job_items WHERE job_id = ? ORDER BY item", (job_id,))
+            ]
+    return job
+
+
+def list_jobs(status: Optional[str] = None, limit: int = 50) -> List[Dict]:
+    """
+    Newest jobs first, optionally only those with the given status.
+    """
+    start()
+    with _db() as db:
+        if status:
+            rows = db.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit)).fetchall()
+        else:
+            rows = db.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [_job_dict(row, _item_counts(db, row["id"])) for row in rows]
+
+
+def cancel(job_id: int) -> Optional[Dict]:
+    """
+    Cancels a queued job at once; a running one stops after the items in progress.
+    """
+    start()
+    with _db() as db:
+        db.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                   (time.time(), job_id))
+        db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+    _update_queue_depth()
+    return get_job(job_id)
+
+
+def retry(job_id: int) -> Optional[Dict]:
+    """
+    Queues a failed or cancelled job again; only its unfinished and failed items are run.
+    Raises ValueError if the job is not failed or cancelled.
+    """
+    job = get_job(job_id)
+    if job is None:
+        return None
+    if job["status"] not in ("failed", "cancelled"):
+        raise ValueError(f"Only failed or cancelled jobs can be retried (job {job_id} is {job['status']}).")
+    with _db() as db:
+        db.execute("UPDATE job_items SET status = 'pending', error = NULL WHERE job_id = ? AND status = 'failed'", (job_id,))
+        db.execute(
+            "UPDATE jobs SET status = 'queued', cancel_requested = 0, error = NULL, finished_at = NULL, "
+            "not_before = NULL, max_attempts = attempts + 1 WHERE id = ?", (job_id,))
+    _update_queue_depth()
+    _wake.set()
+    return get_job(job_id)
+
+
+def iter_progress(job_id: int, interval: float = 0.5) -> Iterator[str]:
+    """
+    Server-sent events with the job's state: one event whenever its status or
+    progress changes, ending once the job has finished.
+    """
+    last = None
+    while True:
+        job = get_job(job_id)
+        if job is None:
+            return
+        state = (job["status"], job["progress"]["done"], job["progress"]["failed"], job["progress"]["total"])
+        if state != last:
+            last = state
+            yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+        if job["status"] in FINAL_STATUSES:
+            return
+        time.sleep(interval)
+
+
+def _update_queue_depth():
+    with _db() as db:
+        depth = db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+    metrics_service.set_queue_depth("jobs", depth)
+
+
+# ---------------------------------------------------------------------------
+# Dispatcher
+# ---------------------------------------------------------------------------
+
+def _executor(in_process: bool):
+    if in_process:
+        if _state["thread_pool"] is None:
+            _state["thread_pool"] = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="jobs")
+        return _state["thread_pool"]
+    if _state["process_pool"] is None:
+        import multiprocessing
+        # Forking a multi-threaded server is unsafe; workers start fresh and import what they need
+        _state["process_pool"] = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _state["process_pool"]
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Seconds before the automatic retry that follows the given number of failed attempts.
+    """
+    return min(RETRY_MAX_DELAY_S, RETRY_DELAY_S * 2 ** max(0, attempts - 1))
+
+
+def _claim_next() -> Optional[sqlite3.Row]:
+    with _db() as db:
+        # Jobs waiting out a retry delay do not hold back the rest of the queue
+        row = db.execute("SELECT * FROM jobs WHERE status = 'queued' AND (not_before IS NULL OR not_before <= ?) "
+                         "ORDER BY priority DESC, id LIMIT 1", (time.time(),)).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+                   (time.time(), row["id"]))
+        return db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+
+def _dispatch_loop():
+    while True:
+        _wake.wait(timeout=5)
+        _wake.clear()
+        while True:
+            job = _claim_next()
+            if job is None:
+                break
+            _update_queue_depth()
+            try:
+                _run_job(job)
+            except Exception as e:
+                with _db() as db:
+                    db.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                               (str(e), time.time(), job["id"]))
+            _update_queue_depth()
+
+
+def _save_items(job_id: int, spec: Dict, folder_path: str, params: Dict, finished: List, failed: List):
+    """
+    Commits finished results (if the kind saves any) and records item outcomes.
+    If the commit fails, the items of that group are failed with its error.
+    """
+    if finished and spec.get("commit"):
+        try:
+            spec["commit"](folder_path, finished, params)
+        except Exception as e:
+            failed.extend((item, str(e)) for item, _, _ in finished)
+            finished.clear()
+    now = time.time()
+    with _db() as db:
+        db.executemany(
+            "UPDATE job_items SET status = 'done', result = ?, error = NULL, finished_at = ? WHERE job_id = ? AND item = ?",
+            [(json.dumps(result, default=str), now, job_id, item) for item, _, result in finished],
+        )
+        db.executemany(
+            "UPDATE job_items SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ? AND item = ?",
+            [(error, now, job_id, item) for item, error in failed],
+        )
+    finished.clear()
+    failed.clear()
+
+
+def _cancel_requested(job_id: int) -> bool:
+    with _db() as db:
+        return bool(db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+
+
+def _run_job(job: sqlite3.Row):
+    from concurrent.futures.process import BrokenProcessPool
+
+    job_id, folder_path = job["id"], job["folder"]
+    spec = JOB_KINDS[job["kind"]]
+    params = json.loads(job["params"])
+
+    if job["total_items"] is None:
+        # Items are listed when the job first runs, so submitting never waits for it
+        items = spec["prepare"](folder_path, params)
+        with _db() as db:
+            db.executemany("INSERT OR IGNORE INTO job_items (job_id, item, payload) VALUES (?, ?, ?)",
+                           [(job_id, item, json.dumps(payload)) for item, payload in items])
+            db.execute("UPDATE jobs SET total_items = ? WHERE id = ?", (len(items), job_id))
+    with _db() as db:
+        db.execute("UPDATE job_items SET status = 'pending', error = NULL WHERE job_id = ? AND status = 'failed'", (job_id,))
+        pending_items = db.execute("SELECT item, payload FROM job_items WHERE job_id = ? AND status = 'pending' ORDER BY item",
+                                   (job_id,)).fetchall()
+
+    executor = _executor(spec.get("in_process", False))
+    futures = {
+        executor.submit(spec["run"], folder_path, row["item"], json.loads(row["payload"]), params): row["item"]
+        for row in pending_items
+    }
+    finished, failed = [], []
+    cancelled = False
+    last_save = time.time()
+    with metrics_service.stage("job", kind=job["kind"], items=len(futures)):
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = futures[future]
+                    error = future.exception()
+                    if error is None:
+                        finished.append((item, None, future.result()))
+                    else:
+                        if isinstance(error, BrokenProcessPool):
+                            # A worker died (e.g. out of memory); the next job gets a fresh pool
+                            _state["process_pool"] = None
+                        failed.append((item, str(error) or type(error).__name__))
+                if (finished or failed) and (len(finished) + len(failed) >= FLUSH_EVERY
+                                             or time.time() - last_save >= FLUSH_SECONDS):
+                    _save_items(job_id, spec, folder_path, params, finished, failed)
+                    last_save = time.time()
+                if not cancelled and _cancel_requested(job_id):
+                    cancelled = True
+                    pending = {future for future in pending if not future.cancel()}
+        finally:
+            _save_items(job_id, spec, folder_path, params, finished, failed)
+
+    with _db() as db:
+        counts = _item_counts(db, job_id)
+        attempts, max_attempts = db.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if cancelled:
+        status, error, result = "cancelled", None, None
+    elif counts.get("failed"):
+        error, result = f"{counts['failed']} item(s) failed.", None
+        # Failed items are tried again automatically while attempts remain, after a growing delay
+        status = "queued" if attempts < max_attempts else "failed"
+    else:
+        status, error = "succeeded", None
+        result = spec["finish"](folder_path, params) if spec.get("finish") else None
+
+    not_before = time.time() + retry_delay(attempts) if status == "queued" else None
+    with _db() as db:
+        db.execute(
+            "UPDATE jobs SET status = ?, error = ?, result = ?, cancel_requested = 0, finished_at = ?, not_before = ? "
+            "WHERE id = ?",
+            (status, error, json.dumps(result) if result is not None else None,
+             None if status == "queued" else time.time(), not_before, job_id),
+        )
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import metrics_service
+import tiff_service
+
+# Memory admission control for decoding.
+#
+# Before a plane is read, its working set is estimated from the TIFF header
+# (see tiff_service.read_footprint, plus one byte per pixel for each 8-bit copy
+# the caller makes) and reserved against a global BUDGET_BYTES. Work that does
+# not fit waits until running work releases its reservation, for up to
+# WAIT_SECONDS; a reservation larger than the whole budget is admitted once
+# nothing else runs, so an oversized image is still served, alone. Nested
+# reservations on a thread that already holds one are added without waiting,
+# which keeps two admitted requests from blocking each other. Caches that keep
+# decoded data after the work is done count it with retain/release, so later
+# admissions see it as used.
+
+BUDGET_BYTES = int(float(os.environ.get("PORES_MEMORY_BUDGET_MB", "2048")) * 1024 * 1024)
+WAIT_SECONDS = float(os.environ.get("PORES_MEMORY_WAIT_S", "60"))
+
+
+class AdmissionTimeout(TimeoutError):
+    pass
+
+
+_cond = threading.Condition()
+_local = threading.local()
+_state = {"reserved": 0, "retained": 0, "active": 0, "waiting": 0, "peak": 0,
+          "admitted": 0, "waited": 0, "oversized": 0, "rejected": 0}
+
+
+def estimate(image_path: str, series: int = 0, step: int = 1, copies: float = 1.0) -> int:
+    """
+    Working set of reading one plane with the given step and making `copies` 8-bit
+    copies of it (normalization, grayscale, masks, encoder buffers).
+    """
+    width, height = tiff_service.plane_size(image_path, series)
+    pixels = -(-width // step) * -(-height // step)
+    return tiff_service.read_footprint(image_path, series, step) + int(copies * pixels)
+
+
+def _fits(nbytes: int) -> bool:
+    # Called with _cond held
+    return _state["active"] == 0 or _state["reserved"] + nbytes <= BUDGET_BYTES
+
+
+@contextmanager
+def admit(nbytes: int, label: str = "decode", timeout: Optional[float] = None):
+    """
+    Holds a reservation of nbytes for the duration of the block.
+    Raises AdmissionTimeout if it cannot be granted within timeout seconds
+    (WAIT_SECONDS by default; 0 fails at once, as background work should).
+    """
+    nbytes = max(0, int(nbytes))
+    timeout = WAIT_SECONDS if timeout is None else timeout
+    nested = getattr(_local, "depth", 0) > 0
+    with _cond:
+        if not nested and not _fits(nbytes):
+            _state["waiting"] += 1
+            metrics_service.set_queue_depth("memory_admission", _state["waiting"])
+            start = time.perf_counter()
+            try:
+                granted = _cond.wait_for(lambda: _fits(nbytes), timeout) if timeout > 0 else False
+            finally:
+                _state["waiting"] -= 1
+                metrics_service.set_queue_depth("memory_admission", _state["waiting"])
+            if not granted:
+                _state["rejected"] += 1
+                raise AdmissionTimeout(
+                    f"Not enough memory for {label}: needs {nbytes / 1048576:.0f} MB, "
+                    f"{_state['reserved'] / 1048576:.0f} of {BUDGET_BYTES / 1048576:.0f} MB are in use; try again later.")
+            _state["waited"] += 1
+            metrics_service.observe_stage("memory_wait", time.perf_counter() - start, bytes_in=nbytes)
+        if nbytes > BUDGET_BYTES:
+            _state["oversized"] += 1
+        _state["reserved"] += nbytes
+        _state["active"] += 1
+        _state["admitted"] += 1
+        _state["peak"] = max(_state["peak"], _state["reserved"])
+    _local.depth = getattr(_local, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _local.depth -= 1
+        with _cond:
+            _state["reserved"] -= nbytes
+            _state["active"] -= 1
+            _cond.notify_all()
+
+
+def retain(nbytes: int):
+    """
+    Counts nbytes kept by a cache against the budget, without waiting; the cache
+    calls release with the same amount when it drops the data.
+    """
+    nbytes = max(0, int(nbytes))
+    with _cond:
+        _state["reserved"] += nbytes
+        _state["retained"] += nbytes
+        _state["peak"] = max(_state["peak"], _state["reserved"])
+
+
+def release(nbytes: int):
+    nbytes = max(0, int(nbytes))
+    with _cond:
+        _state["reserved"] -= nbytes
+        _state["retained"] -= nbytes
+        _cond.notify_all()
+
+
+def stats() -> Dict:
+    with _cond:
+        return {"budget_bytes": BUDGET_BYTES, **_state}
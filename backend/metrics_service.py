@@ -0,0 +1,297 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# Histogram bucket upper bounds (Prometheus "le" labels)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 16384, 262144, 1048576, 16777216, 268435456, 1073741824, 4294967296)
+
+logger = logging.getLogger("pores.metrics")
+
+_lock = threading.Lock()
+
+
+class _Histogram:
+    """
+    Cumulative histogram keyed by a tuple of label values.
+    """
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series: Dict[Tuple[str, ...], Dict] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        with _lock:
+            entry = self.series.get(labels)
+            if entry is None:
+                entry = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self.series[labels] = entry
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["counts"][idx] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            items = sorted(self.series.items())
+            for labels, entry in items:
+                base = _format_labels(self.label_names, labels)
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry["counts"]):
+                    cumulative += count
+                    le_label = _join_labels(base, 'le="%g"' % bound)
+                    lines.append(f"{self.name}_bucket{le_label} {cumulative}")
+                inf_label = _join_labels(base, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf_label} {entry['count']}")
+                lines.append(f"{self.name}_sum{_wrap(base)} {entry['sum']:.6f}")
+                lines.append(f"{self.name}_count{_wrap(base)} {entry['count']}")
+        return lines
+
+
+class _Counter:
+    """
+    Monotonic counter keyed by a tuple of label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1):
+        with _lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            for labels, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{_wrap(_format_labels(self.label_names, labels))} {value:g}")
+        return lines
+
+
+class _Gauge(_Counter):
+    """
+    Value that can go up and down (queue depth, in-flight requests).
+    """
+
+    kind = "gauge"
+
+    def set(self, labels: Tuple[str, ...], value: float):
+        with _lock:
+            self.series[labels] = value
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _wrap(labels: str) -> str:
+    return "{" + labels + "}" if labels else ""
+
+
+def _join_labels(base: str, extra: str) -> str:
+    return "{" + (base + "," + extra if base else extra) + "}"
+
+
+REQUEST_LATENCY = _Histogram(
+    "pores_request_duration_seconds", "HTTP request latency by route.",
+    ("method", "route", "status"), LATENCY_BUCKETS)
+REQUEST_BYTES = _Histogram(
+    "pores_request_bytes", "HTTP request body size by route.", ("method", "route"), BYTES_BUCKETS)
+RESPONSE_BYTES = _Histogram(
+    "pores_response_bytes", "HTTP response body size by route.", ("method", "route"), BYTES_BUCKETS)
+STAGE_LATENCY = _Histogram(
+    "pores_stage_duration_seconds", "Internal processing stage latency.", ("stage",), LATENCY_BUCKETS)
+STAGE_BYTES_IN = _Histogram(
+    "pores_stage_bytes_in", "Bytes consumed by an internal stage.", ("stage",), BYTES_BUCKETS)
+STAGE_BYTES_OUT = _Histogram(
+    "pores_stage_bytes_out", "Bytes produced by an internal stage.", ("stage",), BYTES_BUCKETS)
+STAGE_ERRORS = _Counter(
+    "pores_stage_errors_total", "Internal stages that raised an exception.", ("stage",))
+CACHE_REQUESTS = _Counter(
+    "pores_cache_requests_total", "Cache lookups by cache name and result (hit/miss).", ("cache", "result"))
+QUEUE_DEPTH = _Gauge(
+    "pores_queue_depth", "Work items waiting or running per queue.", ("queue",))
+
+_ALL_METRICS = (
+    REQUEST_LATENCY, REQUEST_BYTES, RESPONSE_BYTES,
+    STAGE_LATENCY, STAGE_BYTES_IN, STAGE_BYTES_OUT, STAGE_ERRORS,
+    CACHE_REQUESTS, QUEUE_DEPTH,
+)
+
+
+class _JsonFormatter(logging.Formatter):
+    """
+    Renders log records as one JSON object per line.
+    """
+
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 6),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            payload.update(fields)
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+def configure_logging():
+    """
+    Attaches a JSON-lines handler to the "pores" logger hierarchy.
+    The level comes from PORES_LOG_LEVEL (default INFO); set it to WARNING to silence stage logs.
+    """
+    root = logging.getLogger("pores")
+    if any(getattr(h, "_pores_json", False) for h in root.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(_JsonFormatter())
+    handler._pores_json = True
+    root.addHandler(handler)
+    root.setLevel(os.environ.get("PORES_LOG_LEVEL", "INFO").upper())
+    root.propagate = False
+
+
+def observe_stage(stage_name: str, seconds: float, bytes_in: Optional[int] = None,
+                  bytes_out: Optional[int] = None, error: bool = False, **fields):
+    """
+    Records one execution of an internal stage and emits a structured log line.
+    """
+    STAGE_LATENCY.observe((stage_name,), seconds)
+    if bytes_in is not None:
+        STAGE_BYTES_IN.observe((stage_name,), bytes_in)
+    if bytes_out is not None:
+        STAGE_BYTES_OUT.observe((stage_name,), bytes_out)
+    if error:
+        STAGE_ERRORS.inc((stage_name,))
+    if logger.isEnabledFor(logging.INFO):
+        log_fields = {"event": "stage", "stage": stage_name, "seconds": round(seconds, 6),
+                      "bytes_in": bytes_in, "bytes_out": bytes_out, "error": error}
+        log_fields.update(fields)
+        logger.info("stage %s", stage_name, extra={"fields": log_fields})
+
+
+@contextmanager
+def stage(stage_name: str, bytes_in: Optional[int] = None, **fields):
+    """
+    Times the enclosed block as an internal stage.
+
+    Yields a dict; set "bytes_in"/"bytes_out" (or any extra log field) on it
+    when the sizes are only known inside the block.
+    """
+    info = {"bytes_in": bytes_in, "bytes_out": None}
+    info.update(fields)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield info
+    except BaseException:
+        error = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        extra = {k: v for k, v in info.items() if k not in ("bytes_in", "bytes_out")}
+        observe_stage(stage_name, elapsed, info["bytes_in"], info["bytes_out"], error, **extra)
+
+
+def record_cache(cache_name: str, hit: bool):
+    """
+    Counts one cache lookup; hit rate is hit / (hit + miss) per cache.
+    """
+    CACHE_REQUESTS.inc((cache_name, "hit" if hit else "miss"))
+
+
+def set_queue_depth(queue_name: str, depth: int):
+    """
+    Publishes the current depth of a work queue.
+    """
+    QUEUE_DEPTH.set((queue_name,), depth)
+
+
+def adjust_queue_depth(queue_name: str, delta: int):
+    """
+    Adds delta to the current depth of a work queue.
+    """
+    QUEUE_DEPTH.inc((queue_name,), delta)
+
+
+def render_prometheus() -> str:
+    """
+    Renders all metrics in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for metric in _ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, request/response body size and
+    in-flight depth for every HTTP request, labelled by route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        counters = {"in": 0, "out": 0, "status": 500}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                counters["in"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                counters["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                counters["out"] += len(message.get("body", b""))
+            await send(message)
+
+        adjust_queue_depth("http_inflight", 1)
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            adjust_queue_depth("http_inflight", -1)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            REQUEST_LATENCY.observe((method, route_path, str(counters["status"])), elapsed)
+            REQUEST_BYTES.observe((method, route_path), counters["in"])
+            RESPONSE_BYTES.observe((method, route_path), counters["out"])
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("request %s %s", method, route_path, extra={"fields": {
+                    "event": "request", "method": method, "route": route_path,
+                    "path": scope.get("path"), "status": counters["status"],
+                    "seconds": round(elapsed, 6), "bytes_in": counters["in"], "bytes_out": counters["out"],
+                }})
@@ -0,0 +1,360 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import memory_service
+import metrics_service
+import tiff_service
+
+# Speculative prefetch of the images next to the one being viewed.
+#
+# Analysts step through the sorted image list one image at a time. When an
+# image is opened, the next and previous NEIGHBORS images (nearest first, next
+# before previous) are decoded and PNG-encoded, their scale bar is detected
+# (only when none is saved, as the UI would) and their saved analysis is
+# loaded, on background threads. Results go into a byte-budgeted LRU cache that
+# the image, scale-bar and analysis endpoints read first.
+#
+# Opening another image starts a new generation: queued work for the old
+# neighbourhood is dropped (work already running finishes and is kept).
+# Prefetch only runs while no foreground render is in progress.
+#
+# Cache keys include the image file's and the sidecar files' size and mtime,
+# so a changed image, a saved ROI or a new scale bar never serves stale data.
+
+NEIGHBORS = int(os.environ.get("PORES_PREFETCH_NEIGHBORS", "2"))
+BUDGET_BYTES = int(float(os.environ.get("PORES_PREFETCH_BUDGET_MB", "256")) * 1024 * 1024)
+WORKERS = int(os.environ.get("PORES_PREFETCH_WORKERS", "2"))
+
+# Sidecar files whose changes invalidate a cached analysis
+_ANALYSIS_FILES = ("roi_measurements.xlsx", ".pore_analyzer_config.json", ".pore_analyzer_notes.json",
+                   ".pore_analyzer_tombstones.json")
+
+_lock = threading.Lock()
+_cache: "OrderedDict[Tuple, Tuple[object, int]]" = OrderedDict()
+_state = {"bytes": 0, "generation": 0, "foreground": 0, "executor": None,
+          "prefetched": 0, "cancelled": 0, "skipped": 0}
+_idle = threading.Condition(_lock)
+
+
+def _signature(path: str) -> Tuple:
+    try:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None, None
+
+
+def _get(key: Tuple, cache_name: str):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+    metrics_service.record_cache(cache_name, entry is not None)
+    return entry
+
+
+def _put(key: Tuple, value, size: int):
+    if size > BUDGET_BYTES:
+        return
+    with _lock:
+        old = _cache.pop(key, None)
+        if old is not None:
+            _state["bytes"] -= old[1]
+        _cache[key] = (value, size)
+        _state["bytes"] += size
+        while _state["bytes"] > BUDGET_BYTES and _cache:
+            _, (_, evicted_size) = _cache.popitem(last=False)
+            _state["bytes"] -= evicted_size
+
+
+class _Foreground:
+    """
+    Marks a request-path render so background prefetch waits until it is done.
+    """
+
+    def __enter__(self):
+        with _lock:
+            _state["foreground"] += 1
+
+    def __exit__(self, *exc):
+        with _lock:
+            _state["foreground"] -= 1
+            if _state["foreground"] == 0:
+                _idle.notify_all()
+
+
+def _wait_idle(generation: int, timeout: float = 10.0) -> bool:
+    """
+    Blocks a prefetch task until no foreground render runs. Returns False if the
+    task's generation is outdated by then.
+    """
+    deadline = time.time() + timeout
+    with _lock:
+        while _state["foreground"] and time.time() < deadline:
+            _idle.wait(timeout=deadline - time.time())
+        return generation == _state["generation"]
+
+
+# ---------------------------------------------------------------------------
+# Cached renders (used by the endpoints and by the prefetcher)
+# ---------------------------------------------------------------------------
+
+def render_png(image_path: str, page: int = 0, series: int = 0, channel: Optional[int] = None) -> bytes:
+    """
+    Decodes one plane and encodes it as PNG (8/16-bit grayscale or 8-bit colour;
+    other data is stretched to 8 bits). Waits for memory_service to admit the working set.
+    """
+    import io
+    import numpy as np
+    from PIL import Image
+
+    # The plane, an 8-bit copy and the PNG being written
+    with memory_service.admit(memory_service.estimate(image_path, series, copies=2), "image"):
+        image_array = tiff_service.read_plane(image_path, page=page, series=series, channel=channel)
+
+        # PIL writes 8/16-bit grayscale and 8-bit colour PNGs; stretch anything else to 8 bits
+        # over the plane's cached min..max
+        if not (image_array.dtype == np.uint8 or (image_array.dtype == np.uint16 and image_array.ndim == 2)):
+            import intensity_service
+            stats = intensity_service.get_stats(image_path, page, series, channel)
+            with metrics_service.stage("normalize", bytes_in=image_array.nbytes) as info:
+                image_array = intensity_service.apply_window(image_array, stats["min"], stats["max"])
+                info["bytes_out"] = image_array.nbytes
+
+        img = Image.fromarray(image_array)
+        with metrics_service.stage("png_encode", bytes_in=image_array.nbytes) as info:
+            buffer = io.BytesIO()
+            img.save(buffer, format='PNG')
+            info["bytes_out"] = buffer.tell()
+        return buffer.getvalue()
+
+
+def get_png(image_path: str, page: int = 0, series: int = 0, channel: Optional[int] = None,
+            foreground: bool = True) -> bytes:
+    """
+    PNG of one plane, from the cache when it was rendered (or prefetched) before.
+    """
+    key = ("png", image_path, _signature(image_path), page, series, channel)
+    entry = _get(key, "image_png")
+    if entry is not None:
+        return entry[0]
+    if foreground:
+        with _Foreground():
+            data = render_png(image_path, page, series, channel)
+    else:
+        data = render_png(image_path, page, series, channel)
+    _put(key, data, len(data))
+    return data
+
+
+def render_thumbnail(image_path: str, size: int = 200, page: int = 0, series: int = 0,
+                     channel: Optional[int] = None, fmt: str = "png") -> Tuple[bytes, int, int]:
+    """
+    Thumbnail of one plane fitting in size x size, encoded as PNG or WebP.
+    Large planes are read with a row/column step of about twice the reduction, so
+    only a fraction of the pixels is decoded. Returns (data, width, height).
+    """
+    import io
+    import numpy as np
+    from PIL import Image
+
+    width, height = tiff_service.plane_size(image_path, series)
+    step = max(1, max(width, height) // (2 * size))
+    with memory_service.admit(memory_service.estimate(image_path, series, step, copies=2), "thumbnail"):
+        image_array = tiff_service.read_plane(image_path, page=page, series=series, channel=channel, step=step)
+
+        # Colour is kept for 8-bit RGB(A); other multi-sample data uses its first sample
+        if image_array.ndim == 3 and image_array.dtype != np.uint8:
+            image_array = image_array[:, :, 0]
+
+        # Normalize to 0-255 over the plane's cached min..max (no full-array scan)
+        if image_array.dtype != np.uint8:
+            import intensity_service
+            stats = intensity_service.get_stats(image_path, page, series, channel)
+            with metrics_service.stage("normalize", bytes_in=image_array.nbytes) as info:
+                image_array = intensity_service.apply_window(image_array, stats["min"], stats["max"])
+                info["bytes_out"] = image_array.nbytes
+
+        with metrics_service.stage("resize", bytes_in=image_array.nbytes) as info:
+            img = Image.fromarray(image_array)
+            img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            info["bytes_out"] = img.width * img.height * len(img.getbands())
+
+    with metrics_service.stage(f"{fmt}_encode") as info:
+        buffer = io.BytesIO()
+        if fmt == "webp":
+            img.save(buffer, format='WEBP', quality=80, method=4)
+        else:
+            img.save(buffer, format='PNG')
+        info["bytes_out"] = buffer.tell()
+    return buffer.getvalue(), img.width, img.height
+
+
+def get_thumbnail(image_path: str, size: int = 200, page: int = 0, series: int = 0,
+                  channel: Optional[int] = None, fmt: str = "png") -> Tuple[bytes, int, int]:
+    """
+    render_thumbnail, from the cache when the same thumbnail was rendered before.
+    """
+    key = ("thumbnail", image_path, _signature(image_path), size, page, series, channel, fmt)
+    entry = _get(key, "thumbnail")
+    if entry is not None:
+        return entry[0]
+    with _Foreground():
+        result = render_thumbnail(image_path, size, page, series, channel, fmt)
+    _put(key, result, len(result[0]) + 64)
+    return result
+
+
+def get_scale_bar(image_path: str, page: int = 0, series: int = 0, engine: str = "auto",
+                  foreground: bool = True) -> Optional[Dict]:
+    """
+    cv_service.find_scale_bar with caching (a failed detection is cached too).
+    """
+    from cv_service import find_scale_bar
+
+    key = ("scale_bar", image_path, _signature(image_path), page, series, engine)
+    entry = _get(key, "scale_bar")
+    if entry is not None:
+        return entry[0]
+    if foreground:
+        with _Foreground():
+            result = find_scale_bar(image_path, page=page, series=series, engine=engine)
+    else:
+        result = find_scale_bar(image_path, page=page, series=series, engine=engine)
+    _put(key, result, 128)
+    return result
+
+
+def _analysis_key(folder_path: str, image_name: str, points_format: str, page: int) -> Tuple:
+    return ("analysis", folder_path, image_name, points_format, page,
+            tuple(_signature(os.path.join(folder_path, name)) for name in _ANALYSIS_FILES))
+
+
+def analysis_version(folder_path: str, image_name: str, points_format: str = "packed", page: int = 0) -> Tuple:
+    """
+    Changes whenever get_analysis may return something different (used as an ETag source).
+    """
+    return _analysis_key(folder_path, image_name, points_format, page)
+
+
+def listing_version(folder_path: str) -> Tuple:
+    """
+    Changes when images are added, removed or renamed, or when the saved ROIs change.
+    """
+    return (("listing", folder_path, _signature(folder_path))
+            + tuple(_signature(os.path.join(folder_path, name)) for name in _ANALYSIS_FILES))
+
+
+def get_analysis(folder_path: str, image_name: str, points_format: str = "packed", page: int = 0) -> Dict:
+    """
+    Saved ROIs, scale bar and notes of one page of an image (file_service.load_roi_data
+    plus load_notes), cached until one of the sidecar files changes.
+    """
+    import file_service
+
+    key = _analysis_key(folder_path, image_name, points_format, page)
+    entry = _get(key, "analysis")
+    if entry is not None:
+        return entry[0]
+    analysis_data = file_service.load_roi_data(folder_path, image_name, points_format=points_format, page=page)
+    analysis_data["notes"] = file_service.load_notes(folder_path, image_name)
+    # Rough size: geometry dominates, and packed strings are about 8 bytes per vertex
+    size = 256 + sum(len(str(roi.get("pointsPacked") or roi.get("points") or "")) for roi in analysis_data["rois"])
+    _put(key, analysis_data, size)
+    return analysis_data
+
+
+# ---------------------------------------------------------------------------
+# Prefetch scheduling
+# ---------------------------------------------------------------------------
+
+def neighbors(images: List[str], current: str, count: int = NEIGHBORS) -> List[str]:
+    """
+    The count images after and before current in the list, nearest first (next before previous).
+    """
+    if current not in images:
+        return []
+    index = images.index(current)
+    order = []
+    for distance in range(1, count + 1):
+        if index + distance < len(images):
+            order.append(images[index + distance])
+        if index - distance >= 0:
+            order.append(images[index - distance])
+    return order
+
+
+def _prefetch_image(folder_path: str, image_name: str, generation: int):
+    import file_service
+
+    image_path = os.path.join(folder_path, image_name)
+    with metrics_service.stage("prefetch", image=image_name):
+        try:
+            # The decoded plane is transient, but a PNG of a plane this large would push
+            # everything else out of the cache; such images are left cold
+            footprint = memory_service.estimate(image_path, copies=2)
+            if tiff_service.read_footprint(image_path) > BUDGET_BYTES // 2:
+                with _lock:
+                    _state["skipped"] += 1
+                return
+
+            steps = (
+                lambda: get_png(image_path, foreground=False),
+                lambda: get_analysis(folder_path, image_name),
+                # Detection only runs in the UI when no scale bar is saved for the image
+                lambda: file_service.load_scale_bar(folder_path, image_name)["scaleBar"]
+                or get_scale_bar(image_path, foreground=False),
+            )
+            for step in steps:
+                if not _wait_idle(generation):
+                    with _lock:
+                        _state["cancelled"] += 1
+                    return
+                # Background work never waits for memory: it gives way to foreground requests
+                with memory_service.admit(footprint, "prefetch", timeout=0):
+                    step()
+        except memory_service.AdmissionTimeout:
+            with _lock:
+                _state["skipped"] += 1
+            return
+        except Exception as e:
+            # Prefetch is best effort; the foreground request reports real errors
+            print(f"Warning: Prefetch of {image_name} failed: {e}")
+            return
+    with _lock:
+        _state["prefetched"] += 1
+
+
+def schedule(folder_path: str, images: List[str], current: str):
+    """
+    Starts prefetching the neighbours of current and cancels queued work for earlier images.
+    """
+    if NEIGHBORS <= 0 or WORKERS <= 0:
+        return
+    from concurrent.futures import ThreadPoolExecutor
+
+    with _lock:
+        _state["generation"] += 1
+        generation = _state["generation"]
+        if _state["executor"] is None:
+            _state["executor"] = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="prefetch")
+        executor = _state["executor"]
+    for image_name in neighbors(images, current):
+        executor.submit(_prefetch_image, folder_path, image_name, generation)
+
+
+def stats() -> Dict:
+    with _lock:
+        return {
+            "neighbors": NEIGHBORS,
+            "workers": WORKERS,
+            "budget_bytes": BUDGET_BYTES,
+            "used_bytes": _state["bytes"],
+            "entries": len(_cache),
+            "prefetched": _state["prefetched"],
+            "cancelled": _state["cancelled"],
+            "skipped": _state["skipped"],
+        }
@@ -0,0 +1,377 @@
+"""
+On-demand sampling profiles of single requests or calls.
+
+With PORES_PROFILING=1, a request carrying an "X-Profile: 1" header or a
+profile=1 query parameter is run under a sampling profiler: a thread records
+the Python stacks of all busy threads every INTERVAL_MS while the request is
+in flight (sync endpoints run on a worker thread, so the endpoint's thread is
+not known in advance; threads idle in a wait are left out). Each profile is
+stored in PROFILE_DIR in the speedscope format (https://www.speedscope.app),
+its id returned in the X-Profile-Id response header, and only the newest
+MAX_PROFILES are kept. /api/profiles lists them and serves them as speedscope
+JSON or as collapsed stacks for flamegraph.pl / inferno.
+
+The command line profiles one scale bar detection or ROI save:
+
+    python backend/profile_service.py detect-scale-bar image.tif --page 0
+    python backend/profile_service.py save-roi <folder> roi.json
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+ENABLED = os.environ.get("PORES_PROFILING", "0").lower() in ("1", "true", "yes", "on")
+PROFILE_DIR = os.environ.get("PORES_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "pores-profiles"))
+INTERVAL_MS = float(os.environ.get("PORES_PROFILE_INTERVAL_MS", "5"))
+MAX_PROFILES = int(os.environ.get("PORES_PROFILE_KEEP", "50"))
+# Deepest stack recorded; deeper frames are cut at the root end
+MAX_DEPTH = 256
+
+PROFILE_HEADER = "x-profile"
+PROFILE_SUFFIX = ".speedscope.json"
+_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# Leaf functions of threads parked in the standard library, by module file name
+_IDLE_FUNCTIONS = {
+    "threading.py": {"wait", "_wait_for_tstate_lock"},
+    "queue.py": {"get"},
+    "selectors.py": {"select"},
+    "thread.py": {"_worker"},
+}
+
+_counter = {"n": 0}
+_counter_lock = threading.Lock()
+
+
+def _is_idle(frame) -> bool:
+    functions = _IDLE_FUNCTIONS.get(os.path.basename(frame.f_code.co_filename))
+    return functions is not None and frame.f_code.co_name in functions
+
+
+class Sampler:
+    """
+    Samples the stacks of all threads but its own until stopped.
+    """
+
+    def __init__(self, interval_ms: float = INTERVAL_MS):
+        self.interval = max(interval_ms, 0.5) / 1000
+        self.stacks: Counter = Counter()
+        self.frames: Dict = {}
+        self.samples = 0
+        self.start_time = self.end_time = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _frame_index(self, code, thread_name: Optional[str] = None) -> int:
+        key = thread_name if thread_name is not None else (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self.frames.get(key)
+        if index is None:
+            index = self.frames[key] = len(self.frames)
+        return index
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or _is_idle(frame):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(self._frame_index(frame.f_code))
+                    frame = frame.f_back
+                # Root first, under a pseudo-frame naming the thread
+                stack.append(self._frame_index(None, f"thread {names.get(ident, ident)}"))
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.end_time = time.perf_counter()
+
+    def to_speedscope(self, name: str) -> Dict:
+        frames = [None] * len(self.frames)
+        for key, index in self.frames.items():
+            if isinstance(key, str):
+                frames[index] = {"name": key}
+            else:
+                function, filename, line = key
+                frames[index] = {"name": f"{function} ({os.path.basename(filename)}:{line})",
+                                 "file": filename, "line": line}
+        interval_ms = self.interval * 1000
+        stacks = sorted(self.stacks.items())
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "pores profile_service",
+            # Weights are sample counts times this; collapsed() divides it back out
+            "interval_ms": interval_ms,
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round((self.end_time - self.start_time) * 1000, 3),
+                "samples": [list(stack) for stack, _ in stacks],
+                "weights": [count * interval_ms for _, count in stacks],
+            }],
+        }
+
+
+def _new_id(label: str) -> str:
+    with _counter_lock:
+        _counter["n"] += 1
+        n = _counter["n"]
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", label).strip("-")[:60] or "profile"
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{n:04d}-{slug}"
+
+
+def _prune():
+    try:
+        names = sorted((n for n in os.listdir(PROFILE_DIR) if n.endswith(PROFILE_SUFFIX)),
+                       key=lambda n: os.path.getmtime(os.path.join(PROFILE_DIR, n)))
+    except OSError:
+        return
+    for name in names[:max(0, len(names) - MAX_PROFILES)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+
+def save(sampler: Sampler, label: str, profile_id: Optional[str] = None) -> str:
+    """
+    Writes a stopped sampler's profile to PROFILE_DIR and returns its id.
+    """
+    profile_id = profile_id or _new_id(label)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, profile_id + PROFILE_SUFFIX)
+    with open(path + ".tmp", "w") as f:
+        json.dump(sampler.to_speedscope(label), f)
+    os.replace(path + ".tmp", path)
+    _prune()
+    return profile_id
+
+
+def profile_path(profile_id: str) -> str:
+    """
+    File of a stored profile; FileNotFoundError for an unknown (or malformed) id.
+    """
+    if not _ID_PATTERN.match(profile_id):
+        raise FileNotFoundError(profile_id)
+    path = os.path.join(PROFILE_DIR, profile_id + PROFILE_SUFFIX)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(profile_id)
+    return path
+
+
+def load(profile_id: str) -> Dict:
+    with open(profile_path(profile_id), "r") as f:
+        return json.load(f)
+
+
+def list_profiles() -> List[Dict]:
+    """
+    Stored profiles, newest first: {"id", "name", "created", "duration_ms", "bytes"}.
+    """
+    try:
+        names = [n for n in os.listdir(PROFILE_DIR) if n.endswith(PROFILE_SUFFIX)]
+    except OSError:
+        return []
+    profiles = []
+    for name in names:
+        path = os.path.join(PROFILE_DIR, name)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            continue
+        sampled = data["profiles"][0]
+        profiles.append({
+            "id": name[:-len(PROFILE_SUFFIX)],
+            "name": data.get("name", ""),
+            "created": stat.st_mtime,
+            "duration_ms": sampled["endValue"],
+            "bytes": stat.st_size,
+        })
+    profiles.sort(key=lambda p: p["created"], reverse=True)
+    return profiles
+
+
+def collapsed(data: Dict) -> str:
+    """
+    A speedscope profile as collapsed stacks ("root;caller;callee weight" lines).
+    """
+    frames = [frame["name"].replace(";", ",") for frame in data["shared"]["frames"]]
+    sampled = data["profiles"][0]
+    interval = data.get("interval_ms") or INTERVAL_MS
+    totals = Counter()
+    for stack, weight in zip(sampled["samples"], sampled["weights"]):
+        totals[";".join(frames[i] for i in stack)] += round(weight / interval)
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(totals.items()))
+
+
+def wants_profile(scope) -> bool:
+    """
+    Whether profiling is enabled and the request asks for it (header or query flag).
+    """
+    if not ENABLED:
+        return False
+    for name, value in scope.get("headers", ()):
+        if name.decode("latin-1").lower() == PROFILE_HEADER and value.strip() not in (b"", b"0", b"false"):
+            return True
+    query = scope.get("query_string", b"").decode("latin-1")
+    return bool(re.search(r"(^|&)profile=(1|true|yes)(&|$)", query))
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests that ask for it (see wants_profile).
+    The profile id is sent in the X-Profile-Id header; for a streamed response the
+    profile covers the whole body, and the header carries the id it will be saved under.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        label = f"{scope.get('method', '')} {scope.get('path', '')}"
+        profile_id = _new_id(label)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode("latin-1"))]
+            await send(message)
+
+        sampler = Sampler()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            try:
+                save(sampler, label, profile_id)
+            except OSError as e:
+                print(f"Warning: Could not save profile: {e}")
+
+
+def _top_functions(data: Dict, count: int = 15) -> List[str]:
+    frames = data["shared"]["frames"]
+    sampled = data["profiles"][0]
+    total = sum(sampled["weights"]) or 1
+    inclusive, own = Counter(), Counter()
+    for stack, weight in zip(sampled["samples"], sampled["weights"]):
+        for index in set(stack[1:]):
+            inclusive[index] += weight
+        own[stack[-1]] += weight
+    lines = [f"{'total':>7} {'self':>7}  function"]
+    # The command line's own frames are in every sample
+    ranked = [(i, w) for i, w in inclusive.most_common() if frames[i].get("file") != os.path.abspath(__file__)]
+    for index, weight in ranked[:count]:
+        lines.append(f"{100 * weight / total:6.1f}% {100 * own[index] / total:6.1f}%  {frames[index]['name']}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pores-profile",
+                                     description="Profile one scale bar detection or ROI save.")
+    parser.add_argument("--interval-ms", type=float, default=INTERVAL_MS, help="Sampling interval")
+    parser.add_argument("--out", help="Write the speedscope profile here instead of PROFILE_DIR")
+    parser.add_argument("--collapsed", help="Also write collapsed stacks to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    detect = commands.add_parser("detect-scale-bar", help="Profile cv_service.detect_scale_bar on an image")
+    detect.add_argument("image")
+    detect.add_argument("--page", type=int, default=0)
+    detect.add_argument("--series", type=int, default=0)
+    detect.add_argument("--engine", default="auto")
+
+    save_roi = commands.add_parser("save-roi", help="Profile file_service.save_roi_to_excel")
+    save_roi.add_argument("folder", help="Folder containing roi_measurements.xlsx")
+    save_roi.add_argument("data", help="JSON file with the ROI row, as the app saves it")
+    save_roi.add_argument("--in-place", action="store_true",
+                          help="Save into the folder's workbook (default: into a scratch copy)")
+    args = parser.parse_args(argv)
+
+    if args.command == "detect-scale-bar":
+        import cv_service
+        label = f"detect_scale_bar {os.path.basename(args.image)} page {args.page}"
+
+        def call():
+            return cv_service.detect_scale_bar(args.image, page=args.page, series=args.series, engine=args.engine)
+    else:
+        import file_service
+        with open(args.data, "r") as f:
+            data = json.load(f)
+        folder = args.folder
+        if not args.in_place:
+            folder = tempfile.mkdtemp(prefix="pores-profile-")
+            workbook = os.path.join(args.folder, "roi_measurements.xlsx")
+            if os.path.exists(workbook):
+                shutil.copy2(workbook, folder)
+        label = f"save_roi_to_excel {data.get('image_name', '')} roi {data.get('selection_number', '')}"
+
+        def call():
+            return file_service.save_roi_to_excel(folder, data)
+
+    # The call's lazy imports would otherwise dominate a cold profile
+    for module in ("numpy", "cv2", "tifffile", "openpyxl"):
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+    sampler = Sampler(args.interval_ms)
+    sampler.start()
+    try:
+        result = call()
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        sampler.stop()
+        if args.command == "save-roi" and not args.in_place:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    data = sampler.to_speedscope(label)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(data, f)
+        location = args.out
+    else:
+        location = os.path.join(PROFILE_DIR, save(sampler, label) + PROFILE_SUFFIX)
+    if args.collapsed:
+        with open(args.collapsed, "w") as f:
+            f.write(collapsed(data))
+
+    print(f"Result: {result}")
+    print(f"{data['profiles'][0]['endValue'] / 1000:.3f} s, {sampler.samples} samples; profile written to {location}")
+    print("\n".join(_top_functions(data)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
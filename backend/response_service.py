@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import json
+from typing import Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+import metrics_service
+
+# Conditional GET and compact encoding for JSON endpoints whose state changes
+# rarely compared to how often the UI asks for it.
+#
+# The caller derives a version from cheap file stats (sizes and mtimes of the
+# files the payload is built from) and passes a builder: when the client's
+# If-None-Match matches the ETag, 304 is returned without building the payload.
+# Otherwise the payload is encoded as JSON (or MessagePack when the client asks
+# for application/msgpack and msgpack is installed) and compressed with brotli
+# (if installed) or gzip, following Accept-Encoding. Responses carry
+# Cache-Control: no-cache, so browsers revalidate every time and reuse their
+# cached copy on 304.
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def etag_for(*parts) -> str:
+    """
+    Weak ETag from a version tuple (weak, as the bytes differ per encoding).
+    """
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" are the same version
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def _accepted_codings(header: str) -> set:
+    codings = set()
+    for item in header.split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip() and quality > 0:
+            codings.add(name.strip().lower())
+    if "*" in codings:
+        codings.add("gzip")
+    return codings
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def conditional_response(request: Request, version: tuple, build) -> Response:
+    """
+    304 if the client has this version, else the encoded result of build().
+    """
+    etag = etag_for(*version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if _matches(request.headers.get("if-none-match"), etag):
+        metrics_service.record_cache("conditional_get", True)
+        return Response(status_code=304, headers=headers)
+    metrics_service.record_cache("conditional_get", False)
+    return encoded_response(request, build(), headers)
+
+
+def encoded_response(request: Request, payload, headers: Optional[dict] = None) -> Response:
+    """
+    payload as JSON or MessagePack, compressed as the client accepts.
+    """
+    headers = dict(headers or {})
+    accept = request.headers.get("accept", "")
+    msgpack = _msgpack() if any(t in accept for t in MSGPACK_TYPES) else None
+    with metrics_service.stage("encode", format="msgpack" if msgpack else "json") as info:
+        if msgpack is not None:
+            body, media_type = msgpack.packb(payload, use_bin_type=True), "application/msgpack"
+        else:
+            body = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+            media_type = "application/json"
+        info["bytes_out"] = len(body)
+
+    if len(body) >= MIN_COMPRESS_BYTES:
+        codings = _accepted_codings(request.headers.get("accept-encoding", ""))
+        brotli = _brotli() if "br" in codings else None
+        if brotli is not None or "gzip" in codings:
+            coding = "br" if brotli is not None else "gzip"
+            with metrics_service.stage("compress", coding=coding, bytes_in=len(body)) as info:
+                if brotli is not None:
+                    body = brotli.compress(body, quality=BROTLI_QUALITY)
+                else:
+                    body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+                info["bytes_out"] = len(body)
+            headers["Content-Encoding"] = coding
+    return Response(content=body, media_type=media_type, headers=headers)
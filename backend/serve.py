@@ -0,0 +1,100 @@
+"""
+Server entry point used by launcher.py.
+
+Runs uvicorn in-process and, once the listening socket is bound, prints a
+single readiness line on stdout:
+
+    PORES_READY {"host": "127.0.0.1", "port": 8000, "startup_ms": {...}}
+
+The same start-up profile is served by GET /api/health. Heavy modules
+(numpy, cv2, tifffile, Pillow, openpyxl) are not needed to answer requests
+until an image is opened, so they are imported on a background thread after
+the server is ready instead of before it.
+"""
+import time
+
+_PROCESS_START = time.time()
+
+import argparse
+import json
+import sys
+import threading
+
+READY_PREFIX = "PORES_READY "
+
+WARMUP_MODULES = ("numpy", "cv2", "tifffile", "PIL.Image", "PIL.PngImagePlugin", "openpyxl")
+
+
+def _warm_up(profile: dict):
+    """
+    Imports the heavy modules so the first image request does not pay for them.
+    """
+    import importlib
+
+    timings = {}
+    for module_name in WARMUP_MODULES:
+        start = time.time()
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            print(f"Warning: could not pre-import {module_name}: {e}", file=sys.stderr)
+        timings[module_name] = round((time.time() - start) * 1000, 1)
+    profile["warmup_ms"] = timings
+
+    # Make sure the built frontend has .gz/.br siblings to serve
+    import static_service
+    dist_dir = static_service.find_frontend_dist()
+    if dist_dir:
+        try:
+            static_service.precompress(dist_dir)
+        except OSError as e:
+            print(f"Warning: could not precompress frontend assets: {e}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Pore ROI Analyzer backend.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--no-warmup", action="store_true", help="Do not pre-import heavy modules after start-up")
+    parser.add_argument("--timeout-keep-alive", type=int, default=75,
+                        help="Seconds to keep idle HTTP connections open (default 75)")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    uvicorn_imported = time.time()
+    import app as backend_app
+    app_imported = time.time()
+
+    class _ReadyServer(uvicorn.Server):
+        async def startup(self, sockets=None):
+            await super().startup(sockets=sockets)
+            if self.should_exit:
+                return
+            ready = time.time()
+            profile = {
+                "startup_ms": {
+                    "uvicorn_import": round((uvicorn_imported - _PROCESS_START) * 1000, 1),
+                    "app_import": round((app_imported - uvicorn_imported) * 1000, 1),
+                    "server_bind": round((ready - app_imported) * 1000, 1),
+                    "total": round((ready - _PROCESS_START) * 1000, 1),
+                },
+            }
+            backend_app.app_state["startup"] = profile
+            # Resume background jobs interrupted by the last shutdown
+            import jobs_service
+            try:
+                jobs_service.start()
+            except Exception as e:
+                print(f"Warning: could not start the job queue: {e}", file=sys.stderr)
+            print(READY_PREFIX + json.dumps({"host": args.host, "port": args.port, **profile}), flush=True)
+            if not args.no_warmup:
+                threading.Thread(target=_warm_up, args=(profile,), daemon=True).start()
+
+    config = uvicorn.Config(backend_app.app, host=args.host, port=args.port, log_level=args.log_level,
+                            timeout_keep_alive=args.timeout_keep_alive)
+    _ReadyServer(config).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import geometry_service
+
+# Grid cell size in image pixels. Pores are typically tens to a few hundred
+# pixels across, so most ROIs touch one to four cells.
+CELL_SIZE = 256
+
+# Two ROIs whose intersection-over-union reaches this are treated as duplicates
+DUPLICATE_IOU = 0.9
+
+
+class RoiSpatialIndex:
+    """
+    Uniform grid over ROI bounding boxes for one image, with exact polygon tests.
+    Bounding boxes narrow the candidates; point-in-polygon and rasterized
+    intersection decide.
+    """
+
+    def __init__(self, cell_size: int = CELL_SIZE):
+        self.cell_size = cell_size
+        self.polygons: Dict[int, object] = {}  # roi id -> (N, 2) float64 array
+        self.bboxes: Dict[int, Tuple[float, float, float, float]] = {}
+        self.areas: Dict[int, int] = {}  # roi id -> rasterized area (pixels)
+        self.cells: Dict[Tuple[int, int], set] = {}
+
+    def _cell_range(self, bbox):
+        x0, y0, x1, y1 = bbox
+        size = self.cell_size
+        for cx in range(int(x0 // size), int(x1 // size) + 1):
+            for cy in range(int(y0 // size), int(y1 // size) + 1):
+                yield cx, cy
+
+    def upsert(self, roi_id: int, points):
+        """
+        Adds or replaces one ROI.
+        """
+        self.remove(roi_id)
+        arr = geometry_service.points_to_array(points)
+        if len(arr) < 3:
+            return
+        bbox = (float(arr[:, 0].min()), float(arr[:, 1].min()), float(arr[:, 0].max()), float(arr[:, 1].max()))
+        self.polygons[roi_id] = arr
+        self.bboxes[roi_id] = bbox
+        self.areas[roi_id] = _raster_area(arr)
+        for cell in self._cell_range(bbox):
+            self.cells.setdefault(cell, set()).add(roi_id)
+
+    def remove(self, roi_id: int):
+        bbox = self.bboxes.pop(roi_id, None)
+        self.polygons.pop(roi_id, None)
+        self.areas.pop(roi_id, None)
+        if bbox is None:
+            return
+        for cell in self._cell_range(bbox):
+            members = self.cells.get(cell)
+            if members:
+                members.discard(roi_id)
+                if not members:
+                    del self.cells[cell]
+
+    def _candidates(self, bbox) -> set:
+        found = set()
+        for cell in self._cell_range(bbox):
+            found |= self.cells.get(cell, set())
+        x0, y0, x1, y1 = bbox
+        return {
+            roi_id for roi_id in found
+            if not (self.bboxes[roi_id][2] < x0 or self.bboxes[roi_id][0] > x1 or
+                    self.bboxes[roi_id][3] < y0 or self.bboxes[roi_id][1] > y1)
+        }
+
+    def at(self, x: float, y: float) -> List[int]:
+        """
+        ROIs containing the point, smallest area first (the most specific hit).
+        """
+        hits = [roi_id for roi_id in self._candidates((x, y, x, y)) if _point_in_polygon(self.polygons[roi_id], x, y)]
+        return sorted(hits, key=lambda roi_id: abs(_polygon_area(self.polygons[roi_id])))
+
+    def overlaps(self, points, exclude: Optional[int] = None) -> List[Dict]:
+        """
+        ROIs whose interior intersects the polygon, with intersection area and IoU.
+        """
+        arr = geometry_service.points_to_array(points)
+        if len(arr) < 3:
+            return []
+        return self._overlaps(arr, _raster_area(arr), exclude)
+
+    def _overlaps(self, arr, area: int, exclude: Optional[int]) -> List[Dict]:
+        bbox = (float(arr[:, 0].min()), float(arr[:, 1].min()), float(arr[:, 0].max()), float(arr[:, 1].max()))
+        results = []
+        for roi_id in sorted(self._candidates(bbox)):
+            if roi_id == exclude:
+                continue
+            inter = _raster_intersection(arr, self.polygons[roi_id])
+            union = area + self.areas[roi_id] - inter
+            if inter > 0:
+                results.append({"id": roi_id, "intersection_px2": inter, "iou": round(inter / union, 4) if union else 0.0})
+        return results
+
+    def overlapping_pairs(self) -> List[Dict]:
+        """
+        Every pair of intersecting ROIs in the image.
+        """
+        pairs = []
+        for roi_id in sorted(self.polygons):
+            for hit in self._overlaps(self.polygons[roi_id], self.areas[roi_id], exclude=roi_id):
+                if hit["id"] > roi_id:
+                    pairs.append({"a": roi_id, "b": hit["id"], "intersection_px2": hit["intersection_px2"], "iou": hit["iou"]})
+        return pairs
+
+
+def _polygon_area(arr) -> float:
+    import numpy as np
+
+    x, y = arr[:, 0], arr[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def _point_in_polygon(arr, x: float, y: float) -> bool:
+    """
+    Even-odd ray casting, vectorized over the polygon's edges.
+    """
+    import numpy as np
+
+    xs, ys = arr[:, 0], arr[:, 1]
+    xs2, ys2 = np.roll(xs, -1), np.roll(ys, -1)
+    crosses = (ys > y) != (ys2 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_at_y = xs + (y - ys) * (xs2 - xs) / (ys2 - ys)
+    return bool(np.count_nonzero(crosses & (x < x_at_y)) % 2)
+
+
+def _raster_mask(arr, x0: int, y0: int, x1: int, y1: int):
+    """
+    Pixels of the box [x0, x1] x [y0, y1] covered by the polygon, as a uint8 mask.
+    """
+    import cv2
+    import numpy as np
+
+    mask = np.zeros((y1 - y0 + 1, x1 - x0 + 1), np.uint8)
+    cv2.fillPoly(mask, [np.rint(arr - np.array([x0, y0], np.float64)).astype(np.int32)], 1)
+    return mask
+
+
+def _pixel_box(arr) -> Tuple[int, int, int, int]:
+    import numpy as np
+
+    return (int(np.floor(arr[:, 0].min())), int(np.floor(arr[:, 1].min())),
+            int(np.ceil(arr[:, 0].max())), int(np.ceil(arr[:, 1].max())))
+
+
+def _raster_area(arr) -> int:
+    """
+    Area of a polygon in pixels, rasterized the same way as _raster_intersection.
+    """
+    import numpy as np
+
+    return int(np.count_nonzero(_raster_mask(arr, *_pixel_box(arr))))
+
+
+def _raster_intersection(a, b) -> int:
+    """
+    Intersection area (pixels) of two polygons, rasterized over the intersection of their
+    bounding boxes only; the union follows from the two areas.
+    """
+    import numpy as np
+
+    box_a, box_b = _pixel_box(a), _pixel_box(b)
+    x0, y0 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+    x1, y1 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+    if x0 > x1 or y0 > y1:
+        return 0
+    return int(np.count_nonzero(_raster_mask(a, x0, y0, x1, y1) & _raster_mask(b, x0, y0, x1, y1)))
+
+
+# ---------------------------------------------------------------------------
+# Per-image index cache, rebuilt when roi_measurements.xlsx changes on disk
+# ---------------------------------------------------------------------------
+
+_cache: Dict[Tuple[str, str, int], Tuple[Optional[float], RoiSpatialIndex]] = {}
+_cache_lock = threading.Lock()
+
+
+def _workbook_mtime(folder_path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(os.path.join(folder_path, "roi_measurements.xlsx"))
+    except OSError:
+        return None
+
+
+def get_index(folder_path: str, image_name: str, page: int = 0) -> RoiSpatialIndex:
+    """
+    Returns the index for one page of an image, building it from the latest ROI versions on first use.
+    """
+    import file_service
+    import metrics_service
+
+    key = (os.path.abspath(folder_path), image_name, page)
+    mtime = _workbook_mtime(folder_path)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            metrics_service.record_cache("spatial_index", True)
+            return cached[1]
+
+    metrics_service.record_cache("spatial_index", False)
+    index = RoiSpatialIndex()
+    analysis = file_service.load_roi_data(folder_path, image_name, points_format="packed", page=page)
+    for roi in analysis["rois"]:
+        index.upsert(roi["id"], geometry_service.decode_points(roi["pointsPacked"]))
+    with _cache_lock:
+        _cache[key] = (mtime, index)
+    return index
+
+
+def record_saved_roi(folder_path: str, image_name: str, roi_id: int, points, page: int = 0):
+    """
+    Updates a cached index after an ROI was written, so the next query does not rebuild it.
+    """
+    key = (os.path.abspath(folder_path), image_name, page)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is None:
+            return
+        cached[1].upsert(roi_id, points)
+        _cache[key] = (_workbook_mtime(folder_path), cached[1])
+
+
+def invalidate(folder_path: str, image_name: Optional[str] = None):
+    """
+    Drops cached indexes for one image (all pages), or for the whole folder.
+    """
+    folder_key = os.path.abspath(folder_path)
+    with _cache_lock:
+        for key in list(_cache):
+            if key[0] == folder_key and (image_name is None or key[1] == image_name):
+                del _cache[key]
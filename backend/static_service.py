@@ -0,0 +1,140 @@
+import gzip
+import mimetypes
+import os
+import sys
+from typing import Optional
+
+# Vite emits content-hashed bundles under assets/, so they can be cached forever
+IMMUTABLE_PREFIX = "assets/"
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+COMPRESSIBLE_EXTENSIONS = {".html", ".js", ".mjs", ".css", ".svg", ".json", ".map", ".txt", ".wasm", ".ico"}
+MIN_COMPRESS_BYTES = 1024
+
+
+def find_frontend_dist() -> Optional[str]:
+    """
+    Locates the built frontend (frontend/dist).
+    PORES_FRONTEND_DIST wins; otherwise ../frontend/dist relative to this file.
+    """
+    candidates = [
+        os.environ.get("PORES_FRONTEND_DIST"),
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "dist"),
+    ]
+    for candidate in candidates:
+        if candidate and os.path.isfile(os.path.join(candidate, "index.html")):
+            return os.path.abspath(candidate)
+    return None
+
+
+def resolve_asset(dist_dir: str, rel_path: str) -> Optional[str]:
+    """
+    Maps a URL path to a file inside dist_dir.
+    Unknown paths without an extension fall back to index.html (client-side routing);
+    anything escaping dist_dir or missing returns None.
+    """
+    rel_path = rel_path.lstrip("/")
+    candidate = os.path.abspath(os.path.join(dist_dir, rel_path)) if rel_path else os.path.join(dist_dir, "index.html")
+    try:
+        if os.path.commonpath([candidate, dist_dir]) != dist_dir:
+            return None
+    except ValueError:
+        # Different drives on Windows
+        return None
+    if os.path.isfile(candidate):
+        return candidate
+    if not os.path.splitext(rel_path)[1]:
+        return os.path.join(dist_dir, "index.html")
+    return None
+
+
+def _accepted_encodings(accept_encoding: str):
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if token:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+def asset_response(dist_dir: str, rel_path: str, accept_encoding: str = ""):
+    """
+    Builds the response for one frontend asset.
+
+    Serves the precompressed .br or .gz sibling when the client accepts it,
+    immutable caching for hashed bundles under assets/ and revalidation for
+    everything else (index.html). Returns None if the asset does not exist.
+    """
+    from starlette.responses import FileResponse
+
+    path = resolve_asset(dist_dir, rel_path)
+    if path is None:
+        return None
+
+    rel = os.path.relpath(path, dist_dir).replace(os.sep, "/")
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    headers = {
+        "Cache-Control": IMMUTABLE_CACHE if rel.startswith(IMMUTABLE_PREFIX) else REVALIDATE_CACHE,
+        "Vary": "Accept-Encoding",
+    }
+
+    accepted = _accepted_encodings(accept_encoding)
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        variant = path + suffix
+        if encoding in accepted and os.path.isfile(variant) and os.path.getmtime(variant) >= os.path.getmtime(path):
+            headers["Content-Encoding"] = encoding
+            return FileResponse(variant, media_type=media_type, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+def precompress(dist_dir: str, skip_existing: bool = True) -> int:
+    """
+    Writes .gz (and .br when the brotli package is installed) next to every
+    compressible asset over MIN_COMPRESS_BYTES. Returns the number of files written.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    written = 0
+    for root, _, files in os.walk(dist_dir):
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            if os.path.getsize(path) < MIN_COMPRESS_BYTES:
+                continue
+
+            data = None
+            targets = [(".gz", lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                targets.append((".br", lambda raw: brotli.compress(raw, quality=11)))
+            for suffix, compress in targets:
+                out_path = path + suffix
+                if skip_existing and os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(path):
+                    continue
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                compressed = compress(data)
+                # Only keep the variant if it actually saves bytes
+                if len(compressed) >= len(data):
+                    continue
+                with open(out_path, "wb") as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else find_frontend_dist()
+    if not target or not os.path.isdir(target):
+        print("Usage: python static_service.py <frontend/dist>")
+        sys.exit(1)
+    count = precompress(target, skip_existing=False)
+    print(f"Precompressed {count} file(s) in {target}")
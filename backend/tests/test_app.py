@@ -0,0 +1,16 @@
+import numpy as np
+import tifffile
+from fastapi.testclient import TestClient
+
+import app as backend
+
+
+def test_save_roi_rejects_points_without_coordinates(tmp_path, monkeypatch):
+    tifffile.imwrite(tmp_path / "plane.tif", np.zeros((64, 64), np.uint8))
+    monkeypatch.setitem(backend.app_state, "selected_folder", str(tmp_path))
+    client = TestClient(backend.app)
+    roi = {"selection_number": 1, "scale_px_per_um": 1, "area_um2": 1, "area_px2": 1,
+           "points": [{"x": 1}, {"y": 2}, {"x": 3, "y": 3}]}
+
+    assert client.post("/api/images/plane.tif/roi", json=roi).status_code == 400
+    assert client.post("/api/images/plane.tif/rois/overlaps", json={"points": roi["points"]}).status_code == 400
@@ -0,0 +1,29 @@
+import time
+
+import jobs_service
+
+
+def _wait_for(job_id, condition, timeout=60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = jobs_service.get_job(job_id)
+        if condition(job):
+            return job
+        time.sleep(0.2)
+    raise AssertionError(f"job {job_id} did not reach the expected state: {jobs_service.get_job(job_id)}")
+
+
+def test_failed_job_is_retried_after_a_delay(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs_service, "RETRY_DELAY_S", 60.0)
+    jobs_service.start(str(tmp_path / "jobs.sqlite3"))
+
+    # No roi_measurements.xlsx in the folder, so the import fails every time
+    job_id = jobs_service.submit("import", str(tmp_path), max_attempts=3)
+    job = _wait_for(job_id, lambda job: job["attempts"] == 1 and job["status"] == "queued")
+
+    assert job["not_before"] >= time.time() + 55
+    time.sleep(2)
+    assert jobs_service.get_job(job_id)["attempts"] == 1
+    assert jobs_service.retry_delay(1) == 60.0
+    assert jobs_service.retry_delay(3) == 240.0
+    assert jobs_service.retry_delay(20) == jobs_service.RETRY_MAX_DELAY_S
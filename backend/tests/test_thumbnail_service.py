@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import tifffile
+
+import memory_service
+import thumbnail_service
+
+
+def test_sprite_thumbnails_are_admitted_under_a_small_budget(tmp_path, monkeypatch):
+    # The 2 x 2 sheet of 1024 px cells alone fills the 16 MB budget; the renders
+    # must not wait behind it
+    monkeypatch.setattr(memory_service, "BUDGET_BYTES", 16 * 1024 * 1024)
+    monkeypatch.setattr(memory_service, "WAIT_SECONDS", 3.0)
+    names = []
+    for i in range(3):
+        name = f"plane_{i}.tif"
+        tifffile.imwrite(tmp_path / name, np.full((1500, 1500), i * 20000, np.uint16))
+        names.append(name)
+
+    sprite = thumbnail_service.build_sprite(str(tmp_path), names, size=1024, fmt="png")
+
+    assert sprite["errors"] == {}
+    assert sorted(sprite["cells"]) == names
+    assert (sprite["width"], sprite["height"]) == (2048, 2048)
+    assert memory_service.stats()["reserved"] == 0
+
+
+def test_sprite_layout_rejects_sheets_over_the_webp_limit():
+    assert thumbnail_service.sprite_layout(225, 1024) == (15, 15)
+    with pytest.raises(ValueError):
+        thumbnail_service.sprite_layout(226, 1024)
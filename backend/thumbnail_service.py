@@ -0,0 +1,124 @@
+import base64
+import json
+import math
+import os
+from typing import Dict, Iterator, List
+
+import memory_service
+import metrics_service
+import prefetch_service
+
+# Batched thumbnails for the image list.
+#
+# One request renders the thumbnails of many images on a thread pool (decoding,
+# resizing and encoding release the GIL) and returns them either as NDJSON, one
+# base64-encoded entry per line in completion order, or as a single sprite sheet
+# with an offset map. Thumbnails come from prefetch_service's cache when they
+# were rendered before.
+
+WORKERS = int(os.environ.get("PORES_THUMBNAIL_WORKERS", str(min(8, os.cpu_count() or 1))))
+FORMATS = ("webp", "png")
+MIN_SIZE, MAX_SIZE = 16, 1024
+
+_MIME = {"webp": "image/webp", "png": "image/png"}
+
+# A sprite sheet is limited to MAX_SPRITE_CELLS thumbnails and MAX_SPRITE_SIDE pixels
+# per side (WebP's limit is 16383); larger batches are requested in parts with names=
+MAX_SPRITE_CELLS = int(os.environ.get("PORES_SPRITE_MAX_CELLS", "400"))
+MAX_SPRITE_SIDE = 16383
+
+
+def _render(folder_path: str, image_name: str, size: int, fmt: str) -> Dict:
+    try:
+        data, width, height = prefetch_service.get_thumbnail(os.path.join(folder_path, image_name), size=size, fmt=fmt)
+        return {"name": image_name, "mime": _MIME[fmt], "width": width, "height": height, "data": data}
+    except Exception as e:
+        return {"name": image_name, "error": str(e)}
+
+
+def iter_thumbnails(folder_path: str, names: List[str], size: int = 200, fmt: str = "webp") -> Iterator[Dict]:
+    """
+    Renders thumbnails on WORKERS threads and yields them as they finish:
+    {"name", "mime", "width", "height", "data": bytes} or {"name", "error"}.
+    Closing the iterator early cancels the thumbnails that have not started.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    executor = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix="thumbnail")
+    metrics_service.set_queue_depth("thumbnails", len(names))
+    try:
+        futures = [executor.submit(_render, folder_path, name, size, fmt) for name in names]
+        remaining = len(futures)
+        for future in as_completed(futures):
+            remaining -= 1
+            metrics_service.set_queue_depth("thumbnails", remaining)
+            yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        metrics_service.set_queue_depth("thumbnails", 0)
+
+
+def ndjson_lines(folder_path: str, names: List[str], size: int = 200, fmt: str = "webp") -> Iterator[bytes]:
+    """
+    iter_thumbnails as NDJSON lines, with the image data base64-encoded.
+    """
+    for entry in iter_thumbnails(folder_path, names, size, fmt):
+        if "data" in entry:
+            entry["data"] = base64.b64encode(entry["data"]).decode("ascii")
+        yield (json.dumps(entry) + "\n").encode("utf-8")
+
+
+def sprite_layout(count: int, size: int):
+    """
+    (columns, rows) of a sprite sheet for count thumbnails of size x size.
+    Raises ValueError when the sheet would exceed MAX_SPRITE_CELLS or MAX_SPRITE_SIDE.
+    """
+    per_side = MAX_SPRITE_SIDE // size
+    limit = min(MAX_SPRITE_CELLS, per_side * per_side)
+    if count > limit:
+        raise ValueError(f"A sprite of size {size} holds at most {limit} images ({count} requested); "
+                         f"request them in batches with names=.")
+    columns = min(per_side, max(1, math.ceil(math.sqrt(count))))
+    return columns, max(1, math.ceil(count / columns))
+
+
+def build_sprite(folder_path: str, names: List[str], size: int = 200, fmt: str = "webp") -> Dict:
+    """
+    Packs the thumbnails into one sheet of size x size cells, in the order of names.
+    Returns {"mime", "data": bytes, "width", "height", "cells": {name: {x, y, width, height}},
+    "errors": {name: message}}; each thumbnail sits at the top left of its cell.
+    The sheet's pixels are reserved with memory_service once the thumbnails are rendered;
+    raises ValueError for more images than sprite_layout allows.
+    """
+    import io
+    from PIL import Image
+
+    columns, rows = sprite_layout(len(names), size)
+    # The thumbnails are rendered (and admitted one by one on the pool's threads) first;
+    # only then is the sheet reserved, so it never holds the budget the renders wait for
+    thumbnails, errors = [], {}
+    for entry in iter_thumbnails(folder_path, names, size, fmt="png"):
+        if "error" in entry:
+            errors[entry["name"]] = entry["error"]
+        else:
+            thumbnails.append(entry)
+
+    index = {name: i for i, name in enumerate(names)}
+    cells = {}
+    with memory_service.admit(columns * size * rows * size * 4, "sprite sheet"):
+        sheet = Image.new("RGBA", (columns * size, rows * size), (0, 0, 0, 0))
+        for entry in thumbnails:
+            name = entry["name"]
+            x, y = (index[name] % columns) * size, (index[name] // columns) * size
+            sheet.paste(Image.open(io.BytesIO(entry["data"])), (x, y))
+            cells[name] = {"x": x, "y": y, "width": entry["width"], "height": entry["height"]}
+
+        with metrics_service.stage(f"{fmt}_encode", bytes_in=sheet.width * sheet.height * 4) as info:
+            buffer = io.BytesIO()
+            if fmt == "webp":
+                sheet.save(buffer, format='WEBP', quality=80, method=4)
+            else:
+                sheet.save(buffer, format='PNG')
+            info["bytes_out"] = buffer.tell()
+    return {"mime": _MIME[fmt], "data": buffer.getvalue(), "width": sheet.width, "height": sheet.height,
+            "cells": cells, "errors": errors}
@@ -0,0 +1,279 @@
+from typing import Dict, Optional, Tuple
+
+import metrics_service
+
+# Plane addressing for multi-page TIFFs.
+#
+# A TIFF series has axes such as "YX", "YXS" (RGB), "ZYX", "ZCYX" or "TZCYX".
+# Everything other than Y, X, S (samples) and C (channels) is flattened into a
+# single "page" index in file order; "channel" selects along C, or along S for
+# multi-sample pages. Only the addressed plane is read: uncompressed files are
+# memory-mapped, compressed ones decode just that page, so a stack is never
+# loaded into RAM whole.
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+
+def is_tiff(image_path: str) -> bool:
+    return image_path.lower().endswith(TIFF_EXTENSIONS)
+
+
+def _leading_axes(axes: str):
+    return [i for i, axis in enumerate(axes) if axis not in "YXS"]
+
+
+def _series_info(series, index: int) -> Dict:
+    axes = series.axes
+    shape = tuple(int(n) for n in series.shape)
+    leading = _leading_axes(axes)
+    channels = 1
+    planes = 1
+    for i in leading:
+        if axes[i] == "C":
+            channels = shape[i]
+        else:
+            planes *= shape[i]
+    if "C" not in axes and "S" in axes:
+        channels = shape[axes.index("S")]
+    return {
+        "index": index,
+        "axes": axes,
+        "shape": list(shape),
+        "dtype": str(series.dtype),
+        "planes": planes,
+        "channels": channels,
+        "width": shape[axes.index("X")] if "X" in axes else 0,
+        "height": shape[axes.index("Y")] if "Y" in axes else 0,
+        # Uncompressed, contiguous data is memory-mapped rather than decoded
+        "contiguous": series.dataoffset is not None,
+    }
+
+
+def describe_image(image_path: str) -> Dict:
+    """
+    Lists the series of an image with their axes, shape, dtype and plane/channel counts,
+    read from the file header only.
+    """
+    if not is_tiff(image_path):
+        from PIL import Image
+        with Image.open(image_path) as img:
+            width, height = img.size
+            bands = len(img.getbands())
+        return {"series": [{
+            "index": 0, "axes": "YXS" if bands > 1 else "YX", "shape": [height, width] + ([bands] if bands > 1 else []),
+            "dtype": "uint8", "planes": 1, "channels": bands, "width": width, "height": height,
+            "contiguous": False,
+        }]}
+
+    import tifffile
+    with tifffile.TiffFile(image_path) as tif:
+        return {"series": [_series_info(s, i) for i, s in enumerate(tif.series)]}
+
+
+def _plane_key(axes: str, shape, page: int, channel: Optional[int]):
+    """
+    Maps (page, channel) to an index tuple over the series array, plus the flat
+    page number in file order (for decoding a single page).
+    """
+    import numpy as np
+
+    leading = _leading_axes(axes)
+    page_axes = [i for i in leading if axes[i] != "C"]
+    page_shape = [shape[i] for i in page_axes]
+    planes = int(np.prod(page_shape)) if page_shape else 1
+    if page < 0 or page >= planes:
+        raise IndexError(f"page {page} out of range (0-{planes - 1}).")
+    page_index = dict(zip(page_axes, np.unravel_index(page, page_shape) if page_shape else ()))
+
+    key = []
+    for i, axis in enumerate(axes):
+        if i in page_index:
+            key.append(int(page_index[i]))
+        elif axis == "C":
+            c = channel or 0
+            if c < 0 or c >= shape[i]:
+                raise IndexError(f"channel {c} out of range (0-{shape[i] - 1}).")
+            key.append(c)
+        else:
+            key.append(slice(None))
+
+    flat = int(np.ravel_multi_index([key[i] for i in leading], [shape[i] for i in leading])) if leading else 0
+    return tuple(key), flat
+
+
+def _to_yx(plane, plane_axes: str, channel: Optional[int], select_sample: bool):
+    """
+    Orders a plane's axes (some order of Y, X and S) as (Y, X[, S]).
+    With select_sample, channel picks one sample; without a channel, non-RGB(A)
+    multi-sample planes fall back to the first sample.
+    """
+    import numpy as np
+
+    order = [plane_axes.index(a) for a in "YXS" if a in plane_axes]
+    plane = np.transpose(plane, order)
+    if plane.ndim == 3:
+        samples = plane.shape[2]
+        if select_sample and channel is not None:
+            if channel < 0 or channel >= samples:
+                raise IndexError(f"channel {channel} out of range (0-{samples - 1}).")
+            plane = plane[:, :, channel]
+        elif samples not in (3, 4):
+            plane = plane[:, :, 0]
+    return plane
+
+
+def read_plane(image_path: str, page: int = 0, series: int = 0, channel: Optional[int] = None,
+               region: Optional[Tuple[int, int, int, int]] = None, step: int = 1):
+    """
+    Reads one 2-D plane (H, W) or (H, W, samples) of an image.
+    region=(x0, y0, x1, y1) crops it; for memory-mappable files only that region is read.
+    step > 1 keeps every step-th row and column (a subsample for statistics).
+    """
+    import numpy as np
+
+    if not is_tiff(image_path):
+        if page or series:
+            raise IndexError("Only TIFF images have more than one page.")
+        import cv2
+        img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise IOError(f"Could not read image at {image_path}")
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA if img.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+            if channel is not None:
+                img = img[:, :, channel]
+        if region:
+            x0, y0, x1, y1 = region
+            img = img[y0:y1, x0:x1]
+        return np.ascontiguousarray(img[::step, ::step])
+
+    import tifffile
+    with metrics_service.stage("tiff_decode", page=page, series=series) as info:
+        with tifffile.TiffFile(image_path) as tif:
+            if series < 0 or series >= len(tif.series):
+                raise IndexError(f"series {series} out of range (0-{len(tif.series) - 1}).")
+            tif_series = tif.series[series]
+            axes, shape = tif_series.axes, tuple(tif_series.shape)
+            key, flat_page = _plane_key(axes, shape, page, channel)
+
+            select_sample = "C" not in axes
+            try:
+                data = tifffile.memmap(image_path, series=series, mode="r")
+                plane = data.reshape(shape)[key]
+                plane_axes = "".join(a for i, a in enumerate(axes) if isinstance(key[i], slice))
+            except (ValueError, OSError):
+                # Compressed or non-contiguous data: decode just this page
+                if flat_page < len(tif_series.pages) and tif_series.pages[flat_page] is not None:
+                    tiff_page = tif_series.pages[flat_page]
+                    plane = tiff_page.asarray()
+                    plane_axes = tiff_page.axes
+                else:
+                    plane = tif.asarray(key=flat_page, series=series)
+                    plane_axes = "".join(a for a in axes if a in "YXS")
+            plane = _to_yx(plane, plane_axes, channel, select_sample)
+
+            if region:
+                x0, y0, x1, y1 = region
+                plane = plane[y0:y1, x0:x1]
+            plane = np.array(plane[::step, ::step])
+        info["bytes_out"] = plane.nbytes
+    return plane
+
+
+def plane_size(image_path: str, series: int = 0) -> Tuple[int, int]:
+    """
+    (width, height) of the planes of a series, from the header.
+    """
+    info = describe_image(image_path)["series"]
+    if series < 0 or series >= len(info):
+        raise IndexError(f"series {series} out of range (0-{len(info) - 1}).")
+    return info[series]["width"], info[series]["height"]
+
+
+def read_footprint(image_path: str, series: int = 0, step: int = 1) -> int:
+    """
+    Peak bytes read_plane allocates for one plane, from the header alone: the (stepped)
+    copy it returns, plus the whole decoded page when the data cannot be memory-mapped.
+    """
+    import numpy as np
+
+    info = describe_image(image_path)["series"]
+    if series < 0 or series >= len(info):
+        raise IndexError(f"series {series} out of range (0-{len(info) - 1}).")
+    info = info[series]
+    samples = info["channels"] if "S" in info["axes"] else 1
+    itemsize = np.dtype(info["dtype"]).itemsize
+    page_bytes = info["width"] * info["height"] * samples * itemsize
+    stepped = -(-info["width"] // step) * -(-info["height"] // step) * samples * itemsize
+    return stepped if info["contiguous"] else page_bytes + stepped
+
+
+# Pixels per block when stretching to 8 bits, which bounds the float32 temporaries
+NORMALIZE_CHUNK_PIXELS = 1 << 20
+
+
+def stretch_to_uint8(plane, low: float, high: float, gamma: float = 1.0, rounding: bool = True):
+    """
+    Maps low..high of a plane to 0..255 (clipped, then raised to 1/gamma) in blocks of rows,
+    so whatever the plane's size only about NORMALIZE_CHUNK_PIXELS float32 values exist at once.
+    Without rounding, values are truncated.
+    """
+    import numpy as np
+
+    out = np.empty(plane.shape, dtype=np.uint8)
+    if plane.size == 0:
+        return out
+    rows = max(1, NORMALIZE_CHUNK_PIXELS // max(1, plane[0].size))
+    scale = 255.0 / (float(high) - float(low)) if high > low else None
+    for start in range(0, plane.shape[0], rows):
+        block = plane[start:start + rows].astype(np.float32)
+        if scale is None:
+            block = np.where(block > low, np.float32(255), np.float32(0))
+        else:
+            block -= np.float32(low)
+            block *= np.float32(scale)
+        np.nan_to_num(block, copy=False)
+        np.clip(block, 0, 255, out=block)
+        if gamma != 1.0:
+            block /= 255
+            np.power(block, 1.0 / gamma, out=block)
+            block *= 255
+        if rounding:
+            np.rint(block, out=block)
+        out[start:start + rows] = block
+    return out
+
+
+def to_uint8(plane):
+    """
+    Min-max stretches a plane of any dtype to uint8 (uint8 input is returned unchanged),
+    block by block (see stretch_to_uint8).
+    """
+    import numpy as np
+
+    if plane.dtype == np.uint8:
+        return plane
+    min_val = np.min(plane)
+    max_val = np.max(plane)
+    if max_val > min_val:
+        return stretch_to_uint8(plane, min_val, max_val, rounding=False)
+    return np.zeros(plane.shape, dtype=np.uint8)
+
+
+def to_gray8(plane):
+    """
+    Converts a plane to 8-bit grayscale the way cv2.imread(IMREAD_GRAYSCALE) does:
+    16-bit data is scaled by 1/256, colour is converted with the usual luma weights.
+    Other dtypes are min-max stretched.
+    """
+    import cv2
+    import numpy as np
+
+    if plane.ndim == 3:
+        plane = cv2.cvtColor(plane, cv2.COLOR_RGBA2GRAY if plane.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+    if plane.dtype == np.uint8:
+        return plane
+    if plane.dtype == np.uint16:
+        # Shift straight into the 8-bit result, without a 16-bit temporary
+        return np.right_shift(plane, 8, out=np.empty(plane.shape, dtype=np.uint8), casting="unsafe")
+    return to_uint8(plane)
@@ -1,5 +1,5 @@
 import { useEffect, useState } from 'react'
-import { useStore } from '../stores/useStore'
+import { useStore, API_BASE_URL } from '../stores/useStore'
 import './ImageList.css'
 
 export default function ImageList() {
@@ -8,6 +8,10 @@ export default function ImageList() {
   const setSelectedImage = useStore((state) => state.setSelectedImage)
   const fetchImages = useStore((state) => state.fetchImages)
   const [failedThumbnails, setFailedThumbnails] = useState<Set<string>>(new Set())
+  // Data URLs from the batched /api/thumbnails stream, filled in as entries arrive
+  const [thumbnails, setThumbnails] = useState<Record<string, string>>({})
+  const [batchFailed, setBatchFailed] = useState(false)
+  const imageNames = images.map(image => image.filename).join('\n')
 
   useEffect(() => {
     if (selectedFolder) {
@@ -15,6 +19,46 @@ export default function ImageList() {
     }
   }, [selectedFolder, fetchImages])
 
+  useEffect(() => {
+    if (!imageNames) return
+    const controller = new AbortController()
+    setThumbnails({})
+    setFailedThumbnails(new Set())
+    setBatchFailed(false)
+
+    const streamThumbnails = async () => {
+      const response = await fetch(`${API_BASE_URL}/api/thumbnails?size=200`, { signal: controller.signal })
+      if (!response.ok || !response.body) throw new Error('Thumbnail batch failed.')
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      for (;;) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop() ?? ''
+
+        const loaded: Record<string, string> = {}
+        const failed: string[] = []
+        for (const line of lines) {
+          if (!line) continue
+          const entry = JSON.parse(line)
+          if (entry.error) failed.push(entry.name)
+          else loaded[entry.name] = `data:${entry.mime};base64,${entry.data}`
+        }
+        setThumbnails(prev => ({ ...prev, ...loaded }))
+        if (failed.length) setFailedThumbnails(prev => new Set([...prev, ...failed]))
+      }
+    }
+
+    streamThumbnails().catch(error => {
+      // Fall back to one request per thumbnail
+      if (error.name !== 'AbortError') setBatchFailed(true)
+    })
+    return () => controller.abort()
+  }, [imageNames])
+
   const handleThumbnailError = (filename: string) => {
     setFailedThumbnails(prev => new Set(prev).add(filename))
   }
@@ -61,9 +105,9 @@ export default function ImageList() {
             title={image.filename}
           >
             <div className="image-thumbnail">
-              {!failedThumbnails.has(image.filename) ? (
+              {!failedThumbnails.has(image.filename) && (batchFailed || thumbnails[image.filename]) ? (
                 <img
-                  src={`http://localhost:8000/api/images/${image.filename}/thumbnail?size=200`}
+                  src={batchFailed ? `${API_BASE_URL}/api/images/${image.filename}/thumbnail?size=200` : thumbnails[image.filename]}
                   alt={image.filename}
                   loading="lazy"
                   onError={() => handleThumbnailError(image.filename)}
@@ -1,11 +1,9 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { Stage, Layer, Image as KonvaImage, Line, Circle } from 'react-konva';
 import Konva from 'konva';
-import { useStore } from '../stores/useStore';
+import { useStore, API_BASE_URL } from '../stores/useStore';
 import './ImageViewer.css';
 
-const API_BASE_URL = 'http://localhost:8000';
-
 const calculatePolygonArea = (points: { x: number, y: number }[]) => {
     let area = 0;
     for (let i = 0; i < points.length; i++) {
@@ -105,12 +103,13 @@ export const ImageViewer: React.FC = () => {
         clearCurrentRoi, confirmCurrentRoi, completedRois, setSelectedImage,
         images, startModifyingRoi, cancelModifyingRoi, modifyingRoiId, deleteAnalysis,
         pendingRoiNotes, updateRoiNotesLocal, saveRoiNotes, setStageWidth, stageWidth,
-        saveFailedRoiNoteIds
+        saveFailedRoiNoteIds, selectedPage, pageCount, setSelectedPage
     } = useStore();
 
     const [image, setImage] = useState<HTMLImageElement | null>(null);
     const [stagePos, setStagePos] = useState({ x: 0, y: 0 });
     const [stageScale, setStageScale] = useState(1);
+    const [hitRoiId, setHitRoiId] = useState<number | null>(null);
     const containerRef = useRef<HTMLDivElement>(null);
 
     useEffect(() => {
@@ -118,11 +117,11 @@ export const ImageViewer: React.FC = () => {
             setImage(null);
             return;
         }
-        const imageUrl = `${API_BASE_URL}/api/images/${selectedImage.filename}`;
+        const imageUrl = `${API_BASE_URL}/api/images/${selectedImage.filename}?page=${selectedPage}`;
         const img = new window.Image();
         img.src = imageUrl;
         img.onload = () => setImage(img);
-    }, [selectedImage]);
+    }, [selectedImage, selectedPage]);
 
     // Auto-save notes with Enter key - only if content has changed
     const handleRoiNotesChange = (roiId: number, value: string) => {
@@ -145,8 +144,28 @@ export const ImageViewer: React.FC = () => {
         }
     };
 
+    // Outside drawing mode a click selects the smallest ROI under the pointer, hit-tested by the backend's spatial index
+    const selectRoiAt = async (x: number, y: number) => {
+        if (!selectedImage) return;
+        try {
+            const response = await fetch(`${API_BASE_URL}/api/images/${selectedImage.filename}/rois/at?x=${x}&y=${y}&page=${selectedPage}`);
+            if (!response.ok) return;
+            const data = await response.json();
+            const roiId: number | null = data.rois.length > 0 ? data.rois[0] : null;
+            setHitRoiId(roiId);
+            if (roiId !== null) {
+                document.getElementById(`roi-item-${roiId}`)?.scrollIntoView({ block: 'nearest', behavior: 'smooth' });
+            }
+        } catch (error) {
+            console.error('ROI hit-test failed:', error);
+        }
+    };
+
+    useEffect(() => {
+        setHitRoiId(null);
+    }, [selectedImage, selectedPage]);
+
     const handleStageClick = (e: Konva.KonvaEventObject<MouseEvent>) => {
-        if (!isDrawing) return;
         const stage = e.target.getStage();
         if (!stage) return;
         const pos = stage.getPointerPosition();
@@ -154,6 +173,10 @@ export const ImageViewer: React.FC = () => {
 
         const imageX = (pos.x - stage.x()) / stage.scaleX();
         const imageY = (pos.y - stage.y()) / stage.scaleY();
+        if (!isDrawing) {
+            selectRoiAt(imageX, imageY);
+            return;
+        }
         addCurrentRoiPoint({ x: imageX, y: imageY });
     };
 
@@ -295,6 +318,13 @@ export const ImageViewer: React.FC = () => {
                     <span className="zoom-percentage">{(stageScale * 100).toFixed(0)}%</span>
                     <button className="zoom-btn" onClick={() => setStageScale(stageScale * 1.1)} title="Zoom in">+</button>
                 </div>
+                {pageCount > 1 && (
+                    <div className="zoom-controls">
+                        <button className="zoom-btn" onClick={() => setSelectedPage(selectedPage - 1)} disabled={selectedPage === 0} title="Previous page">‹</button>
+                        <span className="zoom-percentage">Page {selectedPage + 1}/{pageCount}</span>
+                        <button className="zoom-btn" onClick={() => setSelectedPage(selectedPage + 1)} disabled={selectedPage >= pageCount - 1} title="Next page">›</button>
+                    </div>
+                )}
                 <div className="scale-input-group">
                     <label>Scale (µm):</label>
                     <input 
@@ -372,7 +402,7 @@ export const ImageViewer: React.FC = () => {
                                       <Line 
                                         key={roi.id} 
                                         points={[...roi.points.flatMap(p => [p.x, p.y]), roi.points[0].x, roi.points[0].y]} 
-                                        stroke={modifyingRoiId === roi.id ? "cyan" : "red"}
+                                        stroke={modifyingRoiId === roi.id ? "cyan" : hitRoiId === roi.id ? "yellow" : "red"}
                                         strokeWidth={modifyingRoiId === roi.id ? 3 : 2}
                                         fill={modifyingRoiId === roi.id ? "rgba(0, 255, 255, 0.2)" : "rgba(255, 0, 0, 0.1)"}
                                         closed
@@ -465,7 +495,7 @@ export const ImageViewer: React.FC = () => {
                                 const currentNotes = roi.notes ?? "";
                                 const isNotesDirty = Object.prototype.hasOwnProperty.call(pendingRoiNotes, roi.id);
                                 return (
-                                    <div key={roi.id} className={`roi-item ${modifyingRoiId === roi.id ? 'active' : ''}`}>
+                                    <div key={roi.id} id={`roi-item-${roi.id}`} className={`roi-item ${modifyingRoiId === roi.id ? 'active' : ''} ${hitRoiId === roi.id ? 'hit' : ''}`}>
                                         <div className="roi-info">
                                             <strong>ROI {roi.id}</strong>
                                             <span className="roi-version">v{roi.version}</span>
@@ -1,4 +1,5 @@
 import {create} from 'zustand';
+import { decodePackedPoints } from '../utils/polygonCodec';
 
 interface ImageFile {
   filename: string;
@@ -31,6 +32,8 @@ interface AppState {
   selectedFolder: string | null;
   images: ImageFile[];
   selectedImage: ImageFile | null;
+  selectedPage: number; // Plane of a multi-page TIFF stack; ROIs are stored per page
+  pageCount: number;
   scaleBar: ScaleBar | null;
   scaleUm: number;
   lastScaleBar: ScaleBar | null;
@@ -49,6 +52,7 @@ interface AppState {
   selectFolder: () => Promise<void>;
   fetchImages: () => Promise<void>;
   setSelectedImage: (image: ImageFile | null) => void;
+  setSelectedPage: (page: number) => void;
   fetchScaleBar: (filename: string) => Promise<void>;
   loadSavedAnalysis: (filename: string) => Promise<void>;
   setScaleBar: (bar: ScaleBar | null) => void;
@@ -66,12 +70,16 @@ interface AppState {
   flushPendingRoiNotes: () => Promise<void>;
 }
 
-const API_BASE_URL = 'http://localhost:8000';
+// Same-origin by default: the backend serves the built frontend, and the Vite dev
+// server proxies /api to it. Set VITE_API_BASE_URL for a separately hosted backend.
+export const API_BASE_URL: string = import.meta.env.VITE_API_BASE_URL ?? '';
 
 export const useStore = create<AppState>((set, get) => ({
   selectedFolder: null,
   images: [],
   selectedImage: null,
+  selectedPage: 0,
+  pageCount: 1,
   scaleBar: null,
   scaleUm: 0,
   lastScaleBar: null,
@@ -167,6 +175,8 @@ export const useStore = create<AppState>((set, get) => ({
     // Clear state and set new image first
     set({ 
       selectedImage: image, 
+      selectedPage: 0,
+      pageCount: 1,
       // Don't clear scaleBar here - let loadSavedAnalysis restore it
       // scaleBar: null,  
       completedRois: [], 
@@ -179,6 +189,31 @@ export const useStore = create<AppState>((set, get) => ({
     // Then load saved analysis (which will populate scaleBar if found)
     if (image) {
       get().loadSavedAnalysis(image.filename);
+      fetch(`${API_BASE_URL}/api/images/${image.filename}/pages`)
+        .then(response => response.ok ? response.json() : null)
+        .then(data => {
+          if (data && get().selectedImage?.filename === image.filename) {
+            set({ pageCount: Math.max(1, data.series?.[0]?.planes ?? 1) });
+          }
+        })
+        .catch(err => console.log('Could not read page count:', err));
+    }
+  },
+
+  setSelectedPage: (page) => {
+    const { selectedImage, pageCount } = get();
+    const validPage = Math.max(0, Math.min(pageCount - 1, page));
+    // ROIs belong to a page: switching pages swaps the ROI set, the scale bar stays per image
+    set({
+      selectedPage: validPage,
+      completedRois: [],
+      currentRoiPoints: [],
+      isDrawing: false,
+      modifyingRoiId: null,
+      pendingRoiNotes: {}
+    });
+    if (selectedImage) {
+      get().loadSavedAnalysis(selectedImage.filename);
     }
   },
 
@@ -188,14 +223,21 @@ export const useStore = create<AppState>((set, get) => ({
     if (currentState.selectedImage?.filename !== filename) {
       return;
     }
+    const page = currentState.selectedPage;
     
     try {
-      const response = await fetch(`${API_BASE_URL}/api/images/${filename}/analysis`);
+      const response = await fetch(`${API_BASE_URL}/api/images/${filename}/analysis?page=${page}`);
       if (response.ok) {
         const data = await response.json();
         
-        // Verify we still have the same image selected
-        if (get().selectedImage?.filename !== filename) return;
+        // Verify we still have the same image and page selected
+        if (get().selectedImage?.filename !== filename || get().selectedPage !== page) return;
+
+        // ROI geometry arrives packed; expand it to point lists for the canvas
+        data.rois = (data.rois || []).map((roi: ROI & { pointsPacked?: string }) => {
+          const { pointsPacked, ...rest } = roi;
+          return pointsPacked !== undefined ? { ...rest, points: decodePackedPoints(pointsPacked) } : roi;
+        });
         
         const savedNotes = (data.rois || []).reduce((acc: Record<number, string>, roi: ROI) => {
           acc[roi.id] = roi.notes ?? "";
@@ -252,7 +294,7 @@ export const useStore = create<AppState>((set, get) => ({
     if (get().selectedImage?.filename !== filename) return;
     
     try {
-      const response = await fetch(`${API_BASE_URL}/api/images/${filename}/scale-bar`);
+      const response = await fetch(`${API_BASE_URL}/api/images/${filename}/scale-bar?page=${get().selectedPage}`);
       if (!response.ok) throw new Error('Scale bar not detected.');
       const data = await response.json();
       
@@ -360,7 +402,7 @@ export const useStore = create<AppState>((set, get) => ({
   },
 
   confirmCurrentRoi: async () => {
-    const { selectedImage, currentRoiPoints, scaleUm, completedRois, fetchImages, modifyingRoiId, pendingRoiNotes } = get();
+    const { selectedImage, selectedPage, currentRoiPoints, scaleUm, completedRois, fetchImages, modifyingRoiId, pendingRoiNotes } = get();
     if (!selectedImage || currentRoiPoints.length < 3) return;
 
     const scaleBar = get().scaleBar;
@@ -402,6 +444,7 @@ export const useStore = create<AppState>((set, get) => ({
       points: currentRoiPoints,
       is_modification: modifyingRoiId !== null,
       notes: existingNotes,
+      page: selectedPage,
     };
 
     try {
@@ -411,19 +454,31 @@ export const useStore = create<AppState>((set, get) => ({
         body: JSON.stringify(newRoiData),
       });
 
+      if (response.status === 409) {
+        // Backend rejected a duplicate of an existing ROI; keep the drawing so the user can adjust it
+        const data = await response.json();
+        set({ error: data.detail || 'ROI duplicates an existing ROI.' });
+        return;
+      }
       if (!response.ok) throw new Error('Failed to save ROI.');
 
+      // The backend simplifies the polygon on ingest; keep the geometry it stored
+      const saved = await response.json();
+      const savedPoints: Point[] = saved.points ?? currentRoiPoints;
+      const savedAreaPx2: number = saved.areaPx2 ?? areaPx2;
+      const savedAreaUm2: number = saved.areaUm2 ?? areaUm2;
+
       // If modifying, update existing ROI; if new, add to list
       const updatedRois = modifyingRoiId !== null
         ? completedRois.map(r => r.id === modifyingRoiId 
-          ? { ...r, points: currentRoiPoints, areaPx2, areaUm2, version, notes: existingNotes }
+          ? { ...r, points: savedPoints, areaPx2: savedAreaPx2, areaUm2: savedAreaUm2, version, notes: existingNotes }
           : r)
         : [...completedRois, {
             id: roiId,
             version: 1,
-            points: currentRoiPoints,
-            areaPx2,
-            areaUm2,
+            points: savedPoints,
+            areaPx2: savedAreaPx2,
+            areaUm2: savedAreaUm2,
             notes: existingNotes,
           }];
 
@@ -509,7 +564,7 @@ export const useStore = create<AppState>((set, get) => ({
   },
 
   saveRoiNotes: async (roiId, notes, retry = false) => {
-    const { selectedImage, completedRois, scaleUm, scaleBar } = get();
+    const { selectedImage, selectedPage, completedRois, scaleUm, scaleBar } = get();
     if (!selectedImage) return;
     const roi = completedRois.find(r => r.id === roiId);
     if (!roi) return;
@@ -530,6 +585,7 @@ export const useStore = create<AppState>((set, get) => ({
       is_modification: true,
       is_notes_only: true, // Flag to distinguish notes-only updates
       notes,
+      page: selectedPage,
     };
 
     try {
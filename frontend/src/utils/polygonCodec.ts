@@ -0,0 +1,50 @@
+// Decoder for the backend's packed polygon format (see backend/geometry_service.py):
+//   p1:<dtype><flags>:<base64 little-endian payload>
+// dtype "i" = int32 pairs, "f" = float32 pairs; flag "d" = delta-encoded rows.
+// API responses are never zlib-compressed ("z"), HTTP compression covers that.
+
+export interface PackedPoint {
+  x: number;
+  y: number;
+}
+
+const PACKED_PREFIX = 'p1:';
+
+export const decodePackedPoints = (packed: string): PackedPoint[] => {
+  if (!packed.startsWith(PACKED_PREFIX)) {
+    throw new Error('Unsupported polygon encoding');
+  }
+  const body = packed.slice(PACKED_PREFIX.length);
+  const sep = body.indexOf(':');
+  const spec = body.slice(0, sep);
+  if (spec.includes('z')) {
+    throw new Error('Compressed polygon payloads are not supported in the browser');
+  }
+
+  const binary = atob(body.slice(sep + 1));
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  const view = new DataView(bytes.buffer);
+  const count = bytes.length / 4;
+  const isInt = spec[0] === 'i';
+  const isDelta = spec.includes('d');
+
+  const points: PackedPoint[] = [];
+  let x = 0;
+  let y = 0;
+  for (let i = 0; i + 1 < count; i += 2) {
+    const a = isInt ? view.getInt32(i * 4, true) : view.getFloat32(i * 4, true);
+    const b = isInt ? view.getInt32(i * 4 + 4, true) : view.getFloat32(i * 4 + 4, true);
+    if (isDelta) {
+      x += a;
+      y += b;
+    } else {
+      x = a;
+      y = b;
+    }
+    points.push({ x, y });
+  }
+  return points;
+};
@@ -4,4 +4,10 @@ import react from '@vitejs/plugin-react'
 // https://vite.dev/config/
 export default defineConfig({
   plugins: [react()],
+  server: {
+    // Same-origin API calls during development; the backend serves dist/ in production
+    proxy: {
+      '/api': 'http://localhost:8000',
+    },
+  },
 })
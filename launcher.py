@@ -11,8 +11,9 @@ import webbrowser
 import time
 import socket
 import threading
+import argparse
+from collections import deque
 from pathlib import Path
-from http.server import SimpleHTTPRequestHandler, HTTPServer
 import json
 
 def find_free_port(start_port=8000):
@@ -28,23 +29,63 @@ def find_free_port(start_port=8000):
             port += 1
     raise RuntimeError("Could not find a free port")
 
-def check_port_ready(host, port, timeout=10):
-    """Check if a port is ready and accepting connections."""
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            result = sock.connect_ex((host, port))
-            sock.close()
-            if result == 0:
-                return True
-        except:
-            pass
-        time.sleep(0.5)
-    return False
+# Printed by backend/serve.py on stdout once the server socket is listening
+READY_PREFIX = "PORES_READY "
+
+def start_output_readers(process, stderr_tail):
+    """
+    Drain the server's stdout and stderr on background threads so the pipes never fill up.
+    Returns an Event that is set (with the parsed start-up profile in event.profile) when the
+    readiness line arrives, or when stdout closes because the server exited.
+    """
+    ready = threading.Event()
+    ready.profile = None
+
+    def read_stdout():
+        for line in process.stdout:
+            if line.startswith(READY_PREFIX) and not ready.is_set():
+                try:
+                    ready.profile = json.loads(line[len(READY_PREFIX):])
+                except ValueError:
+                    ready.profile = {}
+                ready.set()
+        ready.set()
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.rstrip("\n"))
+
+    threading.Thread(target=read_stdout, daemon=True).start()
+    threading.Thread(target=read_stderr, daemon=True).start()
+    return ready
+
+def print_startup_report(profile, stderr_lines, launch_time, top=15):
+    """Print the server start-up profile and, with -X importtime, the slowest imports."""
+    print("\nStart-up profile:")
+    print(f"  launcher -> ready: {(time.time() - launch_time) * 1000:8.1f} ms")
+    for stage, ms in (profile or {}).get("startup_ms", {}).items():
+        print(f"  {stage:<17} {ms:8.1f} ms")
+
+    imports = []
+    for line in stderr_lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [part.strip() for part in line[len("import time:"):].split("|")]
+        if len(parts) == 3 and parts[1].isdigit():
+            imports.append((int(parts[1]), parts[2].strip()))
+    if imports:
+        print(f"\nSlowest imports (cumulative, top {top}):")
+        for cumulative_us, module in sorted(imports, reverse=True)[:top]:
+            print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
 
 def main():
     """Main launcher function."""
+    parser = argparse.ArgumentParser(description="Start the ROI Analyzer.")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print an import-time and start-up profile of the backend")
+    parser.add_argument("--no-browser", action="store_true", help="Do not open the browser")
+    args = parser.parse_args()
+
     try:
         # Get the application directory
         if getattr(sys, 'frozen', False):
@@ -57,6 +98,9 @@ def main():
         # Resolve paths
         backend_dir = app_dir / 'backend'
         frontend_dist_dir = app_dir / 'frontend' / 'dist'
+        if not (frontend_dist_dir / 'index.html').exists() and (app_dir / 'frontend' / 'index.html').exists():
+            # PyInstaller bundle: launcher.spec copies dist/ to frontend/
+            frontend_dist_dir = app_dir / 'frontend'
         
         # Verify backend exists
         if not backend_dir.exists() or not (backend_dir / 'app.py').exists():
@@ -82,11 +126,19 @@ def main():
         # Prepare environment
         env = os.environ.copy()
         env['PYTHONUNBUFFERED'] = '1'
+        env.setdefault('PORES_LOG_LEVEL', 'WARNING')
+        # The backend serves the built UI and the API from the same origin
+        if (frontend_dist_dir / 'index.html').exists():
+            env['PORES_FRONTEND_DIST'] = str(frontend_dist_dir)
+        else:
+            print(f"Warning: built frontend not found at {frontend_dist_dir} (run 'npm run build' in frontend/)")
         
-        # Start the FastAPI server
-        uvicorn_cmd = [
-            sys.executable, '-m', 'uvicorn',
-            'app:app',
+        # Start the FastAPI server; serve.py prints a readiness line once it is listening
+        uvicorn_cmd = [sys.executable]
+        if args.profile_startup:
+            uvicorn_cmd += ['-X', 'importtime']
+        uvicorn_cmd += [
+            'serve.py',
             '--host', '127.0.0.1',
             '--port', str(port),
             '--log-level', 'warning'
@@ -95,6 +147,7 @@ def main():
         # Create process with appropriate flags
         creationflags = subprocess.CREATE_NEW_PROCESS_GROUP if sys.platform == 'win32' else 0
         
+        launch_time = time.time()
         try:
             server_process = subprocess.Popen(
                 uvicorn_cmd,
@@ -111,30 +164,36 @@ def main():
             input("Press Enter to exit...")
             sys.exit(1)
         
-        # Wait for server to be ready
+        # Wait for the readiness line instead of polling the port
         print("Waiting for server to start...")
-        if not check_port_ready('127.0.0.1', port):
-            stdout, stderr = server_process.communicate()
+        stderr_tail = deque(maxlen=5000 if args.profile_startup else 200)
+        ready = start_output_readers(server_process, stderr_tail)
+        if not ready.wait(timeout=60) or ready.profile is None:
+            if server_process.poll() is None:
+                server_process.terminate()
+            server_process.wait()
+            time.sleep(0.1)  # let the stderr reader catch up
             print("Error starting backend server:")
-            if stderr:
-                print(stderr)
+            print("\n".join(stderr_tail))
             input("Press Enter to exit...")
             sys.exit(1)
         
         print("✓ Backend server started successfully!")
-        time.sleep(1)
+        if args.profile_startup:
+            print_startup_report(ready.profile, list(stderr_tail), launch_time)
         
         # Open web frontend
         url = f'http://127.0.0.1:{port}'
-        print(f"\nOpening ROI Analyzer in your browser...")
-        print(f"URL: {url}")
-        
-        # Try to open browser
-        try:
-            webbrowser.open(url, new=2)  # new=2 opens in new tab/window
-        except Exception as e:
-            print(f"Could not open browser: {e}")
-            print(f"Please manually visit: {url}")
+        if not args.no_browser:
+            print(f"\nOpening ROI Analyzer in your browser...")
+            print(f"URL: {url}")
+            
+            # Try to open browser
+            try:
+                webbrowser.open(url, new=2)  # new=2 opens in new tab/window
+            except Exception as e:
+                print(f"Could not open browser: {e}")
+                print(f"Please manually visit: {url}")
         
         print("\n" + "=" * 60)
         print("Server is running. Close this window to stop ROI Analyzer.")
@@ -144,9 +203,10 @@ def main():
         while True:
             if server_process.poll() is not None:
                 # Server process ended
-                stdout, stderr = server_process.communicate()
-                if stderr:
-                    print(f"Server error: {stderr}")
+                time.sleep(0.1)  # let the stderr reader catch up
+                errors = [line for line in stderr_tail if not line.startswith("import time:")]
+                if errors:
+                    print("Server error:\n" + "\n".join(errors))
                 break
             time.sleep(1)
     